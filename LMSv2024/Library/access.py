@@ -0,0 +1,106 @@
+"""
+Membership access mapping.
+
+A membership with ``book_access_percentage = p`` unlocks the first ``p`` percent
+of the catalogue in id order. Instead of computing that split on every page
+view, ``BookAccess`` stores the cheapest tier unlocking each book, so the
+student views filter on one indexed column:
+
+    Book.objects.filter(access__min_access_percentage__lte=p)
+
+A new book gets its row in the transaction that saves it, with the tier of
+its place in id order: past the end of the catalogue (the usual case) only a
+tier unlocking 100% covers it. A deleted book's row goes with it. Neither
+moves the other books across tier boundaries, so the split drifts by a book
+per tier now and then until the next full refresh: ``manage.py
+refresh_book_access`` (run it nightly), the catalogue import, or a change to
+the membership tiers (see signals.py). A refresh issues one ranged UPDATE per
+tier and only touches rows whose tier actually moved.
+"""
+from django.db import transaction
+from django.db.models import Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Book, BookAccess, Membership, UserMembership
+
+BATCH_SIZE = 1000
+
+
+def _create_missing_rows():
+    missing = Book.objects.filter(access__isnull=True).order_by('id').values_list('id', flat=True)
+    batch = []
+    for book_id in missing.iterator(chunk_size=BATCH_SIZE):
+        batch.append(BookAccess(book_id=book_id))
+        if len(batch) >= BATCH_SIZE:
+            BookAccess.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        BookAccess.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def add_book_access(book):
+    """Map a newly created book without recomputing the tier boundaries."""
+    following = BookAccess.objects.filter(book_id__gt=book.pk).order_by('book_id').first()
+    if following is not None:
+        membership, percentage = following.membership_id, following.min_access_percentage
+    else:
+        tier = Membership.objects.filter(book_access_percentage__gte=100).order_by('book_access_percentage', 'id').first()
+        membership, percentage = (tier.pk, tier.book_access_percentage) if tier else (None, None)
+    BookAccess.objects.get_or_create(
+        book_id=book.pk, defaults={'membership_id': membership, 'min_access_percentage': percentage},
+    )
+
+
+@transaction.atomic
+def refresh_book_access():
+    _create_missing_rows()
+    total = Book.objects.count()
+    ordered_ids = Book.objects.order_by('id').values_list('id', flat=True)
+
+    last_id = 0
+    for tier in Membership.objects.order_by('book_access_percentage', 'id'):
+        count = total * tier.book_access_percentage // 100
+        if not count:
+            continue
+        boundary_id = ordered_ids[min(count, total) - 1]
+        if boundary_id <= last_id:
+            continue  # A cheaper tier already unlocks these books
+        (BookAccess.objects
+            .filter(book_id__gt=last_id, book_id__lte=boundary_id)
+            .exclude(membership=tier, min_access_percentage=tier.book_access_percentage)
+            .update(membership=tier, min_access_percentage=tier.book_access_percentage))
+        last_id = boundary_id
+
+    # Beyond the widest tier books can only be rented
+    (BookAccess.objects
+        .filter(book_id__gt=last_id)
+        .exclude(membership__isnull=True, min_access_percentage__isnull=True)
+        .update(membership=None, min_access_percentage=None))
+
+
+def split_books_by_access(books, user_membership):
+    """
+    Split ``books`` into the ones the membership gives access to and the ones
+    that must be rented.
+    """
+    if not user_membership:
+        return books.none(), books
+    percentage = user_membership.membership.book_access_percentage
+    return (
+        books.filter(access__min_access_percentage__lte=percentage),
+        books.exclude(access__min_access_percentage__lte=percentage),
+    )
+
+
+def split_books_for_user(books, user):
+    """
+    ``split_books_by_access`` with the user's current membership looked up
+    inside the query, so the books can be fetched without loading it first.
+    """
+    current = UserMembership.objects.for_user(user).active().values('membership__book_access_percentage')[:1]
+    # No membership compares against -1, which unlocks nothing
+    percentage = Coalesce(Subquery(current), Value(-1))
+    return (
+        books.filter(access__min_access_percentage__lte=percentage),
+        books.exclude(access__min_access_percentage__lte=percentage),
+    )
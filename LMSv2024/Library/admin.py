@@ -1,4 +1,9 @@
+import codecs
+
 from django.contrib import admin
+
+from .content import write_content
+from .forms import ISBNForm
 from .models import Membership, Author, Category, Book, IssuedBook, ISBN, Language, UserMembership, Payment
 # Register your models here.
 
@@ -7,9 +12,20 @@ admin.site.register(UserMembership)
 admin.site.register(Author)
 admin.site.register(Category)
 admin.site.register(Book)
-admin.site.register(ISBN)
 admin.site.register(Language)
 admin.site.register(IssuedBook)
 admin.site.register(Payment)
 
 
+@admin.register(ISBN)
+class ISBNAdmin(admin.ModelAdmin):
+    form = ISBNForm
+    list_display = ('isbn_number', 'content_length', 'content_chunk_count')
+    readonly_fields = ('content_length', 'content_chunk_count')
+    search_fields = ('isbn_number',)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        upload = form.cleaned_data.get('content_file')
+        if upload:
+            write_content(obj, codecs.iterdecode(upload.chunks(), 'utf-8'))
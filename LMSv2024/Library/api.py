@@ -0,0 +1,155 @@
+"""
+Read-only JSON API for the catalogue, under ``/api/v1/<resource>/``.
+
+Validators come from the per-table change versions kept for the response
+cache (caching.py): the ETag hashes the versions of every table a resource
+reads together with the query string, and Last-Modified is when the latest
+of those tables changed. Both are known before any row is read, so a client
+polling with ``If-None-Match`` or ``If-Modified-Since`` gets ``304 Not
+Modified`` for one cache lookup and no database query. Versions are bumped
+after commit, so a response can only ever carry an ETag older than its data,
+which costs the client one extra full fetch, never a missed change.
+
+Lists are paged with keyset cursors in id order (``?after=<cursor>``, up to
+``LIBRARY_API_MAX_PAGE_SIZE`` rows per page with ``limit``), and
+``?fields=title,price`` returns only the named fields; columns of related
+tables are only joined when asked for. Rows are read with ``values()``.
+"""
+import hashlib
+
+from django.conf import settings
+
+from . import caching
+from .models import Author, Book, Category, Language, Membership
+from .pagination import InvalidCursor, KeysetPaginator
+
+VERSION = 'v1'
+PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+class Resource:
+    def __init__(self, name, queryset, fields, models, filters=()):
+        self.name = name
+        self.queryset = queryset  # Callable, so the resource never holds a stale queryset
+        self.fields = fields  # Output name -> field path
+        self.models = models  # Tables whose changes can change the output
+        self.filters = filters  # Exact-match id filters: (parameter, field path)
+
+    def select(self, requested=None):
+        """Output names for a ``fields`` parameter; ``id`` always comes first."""
+        if not requested:
+            return list(self.fields)
+        names = [name.strip() for name in requested.split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise InvalidQuery(f"Unknown fields: {', '.join(unknown)}. Fields are {', '.join(self.fields)}.")
+        return ['id'] + [name for name in dict.fromkeys(names) if name != 'id']
+
+    def rows(self, names, params):
+        """``values()`` of the selected fields, filtered by the request parameters."""
+        queryset = self.queryset()
+        for parameter, field in self.filters:
+            value = params.get(parameter)
+            if value:
+                if not value.isdigit():
+                    raise InvalidQuery(f"{parameter} must be an id.")
+                queryset = queryset.filter(**{field: int(value)})
+        return queryset.values(*{self.fields[name] for name in names})
+
+    def serialize(self, names, row):
+        return {name: row[self.fields[name]] for name in names}
+
+
+RESOURCES = {
+    resource.name: resource for resource in [
+        Resource(
+            'books',
+            Book.objects.all,
+            {
+                'id': 'id', 'title': 'title', 'author': 'author_id', 'author_name': 'author__name',
+                'category': 'category_id', 'category_name': 'category__name', 'language': 'language_id',
+                'language_name': 'language__name', 'isbn': 'isbn__isbn_number', 'quantity': 'quantity',
+                'price': 'price', 'description': 'description', 'add_date': 'add_date',
+            },
+            models=('book', 'stock', 'author', 'category', 'language', 'isbn'),
+            filters=[('author', 'author_id'), ('category', 'category_id'), ('language', 'language_id')],
+        ),
+        Resource(
+            'authors',
+            Author.objects.all,
+            {'id': 'id', 'name': 'name', 'biography': 'biography', 'date_of_birth': 'date_of_birth',
+             'date_of_death': 'date_of_death', 'book_count': 'book_count'},
+            models=('author',),
+        ),
+        Resource(
+            'categories',
+            Category.objects.all,
+            {'id': 'id', 'name': 'name', 'description': 'description', 'book_count': 'book_count'},
+            models=('category',),
+        ),
+        Resource(
+            'languages',
+            Language.objects.all,
+            {'id': 'id', 'name': 'name', 'book_count': 'book_count'},
+            models=('language',),
+        ),
+        Resource(
+            'memberships',
+            Membership.objects.all,
+            {'id': 'id', 'name': 'name', 'price_per_month': 'price_per_month',
+             'book_access_percentage': 'book_access_percentage'},
+            models=('membership',),
+        ),
+    ]
+}
+
+
+### ---------- Validators ---------- ###
+
+def etag(request, resource, pk=None):
+    """Strong ETag of a response; None for unknown resources."""
+    resource = RESOURCES.get(resource)
+    if resource is None:
+        return None
+    query = sorted(request.GET.lists())
+    state = f'{VERSION}:{resource.name}:{pk}:{caching.versions(resource.models)}:{query}'
+    return hashlib.md5(state.encode(), usedforsecurity=False).hexdigest()
+
+
+def last_modified(request, resource, pk=None):
+    resource = RESOURCES.get(resource)
+    return None if resource is None else caching.last_changed(resource.models)
+
+
+### ---------- Responses ---------- ###
+
+def page_size(value):
+    maximum = getattr(settings, 'LIBRARY_API_MAX_PAGE_SIZE', MAX_PAGE_SIZE)
+    if not value:
+        return min(getattr(settings, 'LIBRARY_API_PAGE_SIZE', PAGE_SIZE), maximum)
+    if not value.isdigit() or not 0 < int(value) <= maximum:
+        raise InvalidQuery(f"limit must be between 1 and {maximum}.")
+    return int(value)
+
+
+def list_payload(resource, params):
+    """``{'results': [...], 'next': cursor or None}`` for one page."""
+    names = resource.select(params.get('fields'))
+    paginator = KeysetPaginator(resource.rows(names, params), ('id',), page_size(params.get('limit')))
+    try:
+        page = paginator.page(after=params.get('after'))
+    except InvalidCursor:
+        raise InvalidQuery("Invalid cursor.")
+    return {'results': [resource.serialize(names, row) for row in page], 'next': page.next_cursor}
+
+
+def detail_payload(resource, params, pk):
+    """The object's fields, or None if there is no such object."""
+    names = resource.select(params.get('fields'))
+    row = resource.rows(names, {}).filter(pk=pk).first()
+    return None if row is None else resource.serialize(names, row)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class LibraryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Library'
+
+    def ready(self):
+        # Register model signal receivers (search index maintenance)
+        from . import signals  # noqa: F401
@@ -0,0 +1,170 @@
+"""
+Async versions of the read-heavy student views, for ASGI deployments.
+
+Queries go through the async ORM, and independent ones are awaited together
+with ``asyncio.gather``; book lists resolve the student's membership in a
+subquery (``split_books_for_user``) so they need not wait for it. Django still
+runs each query on the request's database thread, so the win is the event loop
+never blocking on the database rather than parallel queries on the wire.
+
+Everything a template iterates is loaded before rendering; ``render`` itself
+(context processors, the session, the cache) runs through ``sync_to_async``.
+
+``urls.py`` routes to these views unless ``LIBRARY_ASYNC_VIEWS`` is False. The
+sync versions in views.py stay in use for that case and as the benchmark
+baseline (``run_benchmarks --async``).
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required, user_passes_test
+from django.http import Http404
+from django.shortcuts import redirect, render
+
+from . import payments, recommendations
+from .access import split_books_for_user
+from .memberships import current_membership
+from .middleware import query_budget
+from .models import Book, BookContentChunk, Membership, Purchase, Rent
+from .pagination import apaginate
+from .roles import is_librarian, is_student
+
+arender = sync_to_async(render)
+
+
+async def _user(request):
+    user = await request.auser()
+    # Templates read request.user; hand them the user already loaded
+    request.user = user
+    return user
+
+
+_current_membership = sync_to_async(current_membership)
+
+
+async def _recommended(user, books):
+    return [book async for book in recommendations.for_user(user, books)]
+
+
+@query_budget(6)  # Cold caches: session, user, roles, membership, a page of books, recommendations
+@login_required
+@user_passes_test(is_student)
+async def student_dashboard(request):
+    """
+    Student dashboard showing books, membership plans, and purchased membership details.
+    """
+    user = await _user(request)
+    books, _ = split_books_for_user(Book.objects.for_browsing(), user)
+    user_membership, recommended_books, books = await asyncio.gather(
+        _current_membership(user), _recommended(user, books), apaginate(request, books, ('id',)),
+    )
+    memberships = Membership.objects.all()  # Not rendered by the template, so never evaluated
+
+    context = {
+        'user_membership': user_membership,
+        'memberships': memberships,
+        'books': books,
+        'page': books,
+        'recommended_books': recommended_books,
+    }
+    return await arender(request, 'student_dashboard.html', context)
+
+
+@query_budget(4)
+@login_required
+async def available_books(request):
+    """
+    View to display available books based on user's membership plan.
+    """
+    user = await _user(request)
+    accessible_books, rent_books = split_books_for_user(Book.objects.for_browsing(), user)
+    recommended_books, rent_books = await asyncio.gather(
+        _recommended(user, rent_books), apaginate(request, rent_books, ('id',)),
+    )
+
+    context = {
+        'accessible_books': accessible_books,
+        'rent_books': rent_books,
+        'page': rent_books,
+        'recommended_books': recommended_books,
+        'rent_key': payments.new_idempotency_key(),
+    }
+    return await arender(request, 'student/available_books.html', context)
+
+
+@query_budget(4)
+@login_required
+async def rent_list(request):
+    """
+    View to display the list of rented books by the user.
+    """
+    user = await _user(request)
+    rents = await apaginate(request, Rent.objects.for_user(user), ('-start_date', '-id'))
+    context = {'rented_books': rents, 'page': rents}
+    return await arender(request, 'student/rent_list.html', context)
+
+
+@query_budget(4)
+@login_required
+async def purchase_list(request):
+    """
+    View to display the list of purchased books by the user.
+    """
+    user = await _user(request)
+    purchases = await apaginate(request, Purchase.objects.for_user(user), ('-purchase_date', '-id'))
+    context = {'purchased_books': purchases, 'page': purchases}
+    return await arender(request, 'student/purchased_books.html', context)
+
+
+async def can_read_book(user, book):
+    """Async ``views.can_read_book``: the three ways in are checked together."""
+    if await sync_to_async(is_librarian)(user):
+        return True
+    accessible_books, _ = split_books_for_user(Book.objects.all(), user)
+    return any(await asyncio.gather(
+        accessible_books.filter(pk=book.pk).aexists(),
+        Rent.objects.filter(user=user, book=book).aexists(),
+        Purchase.objects.filter(user=user, book=book).aexists(),
+    ))
+
+
+@login_required
+async def read_book(request, book_id):
+    """
+    Reader view showing one page (content chunk) of the book at a time.
+    """
+    user = await _user(request)
+    try:
+        book = await Book.objects.select_related('isbn').aget(id=book_id)
+    except Book.DoesNotExist:
+        raise Http404("No Book matches the given query.")
+
+    total_pages = book.isbn.content_chunk_count if book.isbn else 0
+    try:
+        page_number = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page_number = 1
+
+    async def page_text():
+        if not total_pages:
+            return None
+        return await (
+            BookContentChunk.objects.filter(isbn=book.isbn, index=page_number - 1)
+            .values_list('text', flat=True).afirst()
+        )
+
+    allowed, text = await asyncio.gather(can_read_book(user, book), page_text())
+    if not allowed:
+        messages.error(request, "Rent or purchase this book to read it.")
+        return redirect('available_books')
+
+    context = {
+        'book': book,
+        'page_text': text,
+        'page_number': page_number,
+        'total_pages': total_pages,
+        'previous_page': page_number - 1 if page_number > 1 else None,
+        'next_page': page_number + 1 if page_number < total_pages else None,
+    }
+    return await arender(request, 'student/read_book.html', context)
@@ -0,0 +1,212 @@
+"""
+Search-as-you-type completions for book titles, author names and student
+usernames.
+
+Each kind keeps a ``PrefixIndex`` in the worker process: a sorted list of
+keys with a parallel array of primary keys, where the keys are the lowercased
+label from the start of each of its first ``MAX_WORDS`` words, so "pot"
+completes "Harry Potter". A lookup is one ``bisect`` plus a scan of the
+matching run, with no database query. Keys and labels are truncated and
+entries capped per kind (``LIBRARY_AUTOCOMPLETE_MAX_ENTRIES``), which bounds
+the memory a worker spends on it.
+
+An index is loaded from the database on its first lookup, in primary key
+order, so a capped index always keeps the same (oldest) objects. Saves and
+deletes update it after commit (signals.py), in the process that made them.
+Other processes compare the cache versions (caching.py) the index was loaded
+at with the current ones on the first lookup after
+``LIBRARY_AUTOCOMPLETE_TTL`` seconds, and only when they moved reload it in a
+background thread, serving the old copy until the new one is ready
+(``LIBRARY_AUTOCOMPLETE_BACKGROUND_BUILD = False`` reloads in the request).
+"""
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+
+from . import caching, search
+from .models import Author, Book
+from .roles import STUDENT
+
+logger = logging.getLogger(__name__)
+
+SOURCES = {
+    'book': (lambda: Book.objects.all(), 'title'),
+    'author': (lambda: Author.objects.all(), 'name'),
+    'user': (lambda: User.objects.filter(groups__name=STUDENT), 'username'),
+}
+VERSIONS = {  # Cache versions bumped by the writes that change each kind's labels
+    'book': ('book',),
+    'author': ('author',),
+    'user': (search.version_name('student'),),
+}
+MAX_WORDS = 6  # Words of a label that a completion can start at
+KEY_LENGTH = 32
+LABEL_LENGTH = 120
+MAX_ENTRIES = 500000
+TTL = 5 * 60
+LIMIT = 10
+SCAN_FACTOR = 5  # Entries scanned per completion returned, for ranking
+
+
+def _normalize(text):
+    return ' '.join(text.lower().split())
+
+
+def keys_for(label):
+    """Index keys of ``label``: its normalized text from each word on."""
+    words = _normalize(label).split(' ')
+    return {' '.join(words[index:])[:KEY_LENGTH] for index in range(min(len(words), MAX_WORDS)) if words[index]}
+
+
+class PrefixIndex:
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.keys = []  # Sorted
+        self.pks = array('q')  # pks[i] is the object keys[i] belongs to; no per-entry tuples or ints
+        self.labels = {}  # pk -> label
+        self.version = None  # caching.versions() of the kind when it was loaded
+        self.checked_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, rows, max_entries=MAX_ENTRIES):
+        """Index ``(pk, label)`` rows, sorting once at the end."""
+        index = cls(max_entries)
+        entries = []
+        for pk, label in rows:
+            keys = keys_for(label or '')
+            if len(entries) + len(keys) > max_entries:
+                logger.warning("Autocomplete index full at %d entries, later labels are left out", max_entries)
+                break
+            index.labels[pk] = (label or '')[:LABEL_LENGTH]
+            entries.extend((key, pk) for key in keys)
+        entries.sort()
+        index.keys = [key for key, _ in entries]
+        index.pks = array('q', (pk for _, pk in entries))
+        return index
+
+    def _drop(self, pk):
+        label = self.labels.pop(pk, None)
+        if label is None:
+            return
+        for key in keys_for(label):
+            for position in range(bisect_left(self.keys, key), bisect_right(self.keys, key)):
+                if self.pks[position] == pk:
+                    del self.keys[position]
+                    del self.pks[position]
+                    break
+
+    def update(self, pk, label):
+        with self._lock:
+            self._drop(pk)
+            keys = keys_for(label)
+            if len(self.keys) + len(keys) > self.max_entries:
+                return
+            self.labels[pk] = label[:LABEL_LENGTH]
+            for key in keys:
+                position = bisect_right(self.keys, key)
+                self.keys.insert(position, key)
+                self.pks.insert(position, pk)
+
+    def remove(self, pk):
+        with self._lock:
+            self._drop(pk)
+
+    def complete(self, prefix, limit=LIMIT):
+        """``(pk, label)`` of up to ``limit`` labels with a word starting with ``prefix``."""
+        prefix = _normalize(prefix)[:KEY_LENGTH]
+        if not prefix:
+            return []
+        found = {}
+        with self._lock:
+            position = bisect_left(self.keys, prefix)
+            end = min(position + limit * SCAN_FACTOR, len(self.keys))
+            while position < end and self.keys[position].startswith(prefix):
+                pk = self.pks[position]
+                found.setdefault(pk, self.labels[pk])
+                position += 1
+        # Labels that start with the prefix first, then alphabetically
+        ranked = sorted(found.items(), key=lambda item: (not _normalize(item[1]).startswith(prefix), item[1].lower()))
+        return ranked[:limit]
+
+
+### ---------- Per-process indexes ---------- ###
+
+_indexes = {}
+_build_lock = threading.Lock()
+_loading = set()
+
+
+def _load(kind):
+    queryset, field = SOURCES[kind]
+    version = caching.versions(VERSIONS[kind])  # Read first, so a write during the load is never missed
+    rows = queryset().order_by('pk').values_list('pk', field).iterator(chunk_size=5000)
+    max_entries = getattr(settings, 'LIBRARY_AUTOCOMPLETE_MAX_ENTRIES', MAX_ENTRIES)
+    index = PrefixIndex.build(rows, max_entries)
+    index.version = version
+    _indexes[kind] = index
+
+
+def _load_in_background(kind):
+    with _build_lock:
+        if kind in _loading:
+            return
+        _loading.add(kind)
+
+    def run():
+        try:
+            _load(kind)
+        finally:
+            with _build_lock:
+                _loading.discard(kind)
+            connection.close()
+
+    threading.Thread(target=run, name=f'autocomplete-load-{kind}', daemon=True).start()
+
+
+def get_index(kind):
+    index = _indexes.get(kind)
+    if index is None:
+        with _build_lock:
+            if kind not in _indexes:
+                _load(kind)
+        return _indexes[kind]
+    now = time.monotonic()
+    if now - index.checked_at > getattr(settings, 'LIBRARY_AUTOCOMPLETE_TTL', TTL):
+        index.checked_at = now
+        if caching.versions(VERSIONS[kind]) != index.version:
+            # Another process wrote; keep answering from this copy meanwhile
+            if getattr(settings, 'LIBRARY_AUTOCOMPLETE_BACKGROUND_BUILD', True):
+                _load_in_background(kind)
+            else:
+                _load(kind)
+    return _indexes[kind]
+
+
+def complete(kind, prefix, limit=LIMIT):
+    return get_index(kind).complete(prefix, limit)
+
+
+def refresh(kind, pks):
+    """Re-read the labels of ``pks`` into this process's index, if it is loaded."""
+    index = _indexes.get(kind)
+    if index is None:
+        return
+    queryset, field = SOURCES[kind]
+    labels = dict(queryset().filter(pk__in=pks).values_list('pk', field))
+    for pk in pks:
+        if labels.get(pk) is None:
+            index.remove(pk)  # Deleted, or no longer a student
+        else:
+            index.update(pk, labels[pk])
+
+
+def reset():
+    """Drop every loaded index (tests, settings changes)."""
+    _indexes.clear()
@@ -0,0 +1,48 @@
+"""
+Resumable, bounded-memory batch processing.
+
+``run_batch`` walks a queryset in keyset order (see pagination.py), hands each
+chunk of rows to a callback and records how far it got in a ``BatchCheckpoint``
+in the same transaction. Memory stays at one chunk however many rows match, and
+a job that is interrupted picks up after the last committed chunk when it runs
+again for the same date.
+"""
+from django.db import transaction
+
+from .models import BatchCheckpoint
+from .pagination import decode_cursor, encode_cursor, keyset_filter, keyset_order
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def run_batch(job, run_date, queryset, ordering, fields, process, chunk_size=DEFAULT_CHUNK_SIZE,
+              restart=False, progress=None):
+    """
+    Call ``process(rows)`` for consecutive chunks of ``queryset.values(*fields)``
+    ordered by ``ordering`` (which must end with a unique column). Returns the
+    checkpoint; a run already finished for ``run_date`` is not repeated unless
+    ``restart`` is set.
+    """
+    checkpoint, _ = BatchCheckpoint.objects.get_or_create(job=job, run_date=run_date)
+    if restart:
+        checkpoint.cursor, checkpoint.processed, checkpoint.finished = '', 0, False
+        checkpoint.save()
+    keys = [field.lstrip('-') for field in ordering]
+    fields = list(dict.fromkeys([*keys, *fields]))
+
+    while not checkpoint.finished:
+        chunk = queryset
+        if checkpoint.cursor:
+            chunk = chunk.filter(keyset_filter(ordering, decode_cursor(checkpoint.cursor)))
+        rows = list(chunk.order_by(*keyset_order(ordering)).values(*fields)[:chunk_size])
+
+        with transaction.atomic():
+            if rows:
+                process(rows)
+                checkpoint.cursor = encode_cursor([rows[-1][key] for key in keys])
+                checkpoint.processed += len(rows)
+            checkpoint.finished = len(rows) < chunk_size
+            checkpoint.save()
+        if progress:
+            progress(checkpoint)
+    return checkpoint
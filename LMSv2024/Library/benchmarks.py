@@ -0,0 +1,309 @@
+"""
+Synthetic-load benchmarks for the Library views.
+
+Each ``Scenario`` names a view, the role that calls it and how to build a
+request from the seeded ids. ``run()`` drives a weighted mix of scenarios
+through the Django test client and records, per view: latency percentiles,
+query counts and (in a separate pass, because tracing slows everything down)
+peak Python memory. Results are plain dicts so the ``run_benchmarks`` command
+can write them to JSON and diff two runs.
+
+``compare_sync_async()`` instead serves the student views through the ASGI
+handler from many concurrent connections, once with the sync views and once
+with their async versions, and reports throughput for each.
+
+``compare_payment_recording()`` records the same payment feed, with a share of
+replayed keys, once through ``payments.charge()`` row by row and once through
+the batch ``payments.record_payments()``.
+"""
+import asyncio
+import math
+import random
+import statistics
+import time
+import tracemalloc
+import types
+from importlib import import_module
+
+from django.conf import settings
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import path, reverse
+
+from . import async_views, payments, views
+from .models import Book, Membership, Payment
+
+LIBRARIAN = 'librarian'
+STUDENT = 'student'
+
+
+class Scenario:
+    def __init__(self, name, role, weight, build, method='get'):
+        self.name = name
+        self.role = role
+        self.weight = weight
+        self.build = build  # (rng, ids) -> (url, data)
+        self.method = method
+
+
+def _search_term(rng):
+    return rng.choice(['synthetic', 'book 1', 'author 2', 'category', '42'])
+
+
+SCENARIOS = [
+    Scenario('manage_books', LIBRARIAN, 10, lambda rng, ids: (reverse('manage_books'), {})),
+    Scenario('manage_books_search', LIBRARIAN, 5,
+             lambda rng, ids: (reverse('manage_books'), {'q': _search_term(rng)})),
+    Scenario('analytics', LIBRARIAN, 3, lambda rng, ids: (reverse('analytics'), {})),
+    Scenario('available_books', STUDENT, 30, lambda rng, ids: (reverse('available_books'), {})),
+    Scenario('student_dashboard', STUDENT, 30, lambda rng, ids: (reverse('student_dashboard'), {})),
+    Scenario('take_membership', STUDENT, 5,
+             lambda rng, ids: (reverse('take_membership', args=[rng.choice(ids['memberships'])]), {})),
+    Scenario('take_membership_pay', STUDENT, 2,
+             lambda rng, ids: (reverse('take_membership', args=[rng.choice(ids['memberships'])]),
+                               {'payment_method': rng.choice(['Card', 'UPI'])}),
+             method='post'),
+    Scenario('rent_book', STUDENT, 10, lambda rng, ids: (reverse('rent_book', args=[rng.choice(ids['books'])]), {})),
+    Scenario('rent_list', STUDENT, 4, lambda rng, ids: (reverse('rent_list'), {})),
+    Scenario('purchase_list', STUDENT, 4, lambda rng, ids: (reverse('purchase_list'), {})),
+]
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return 0.0
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+def _clients(users):
+    clients = []
+    for user in users:
+        client = Client(raise_request_exception=False)
+        client.force_login(user)
+        clients.append(client)
+    return clients
+
+
+def run(librarians, students, requests=1000, memory_samples=20, scenarios=SCENARIOS, seed=0, log=None):
+    """
+    Issue ``requests`` requests drawn from ``scenarios`` by weight and return
+    ``{view: {...}}`` statistics.
+    """
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+    ids = {
+        'books': list(Book.objects.values_list('id', flat=True)),
+        'memberships': list(Membership.objects.values_list('id', flat=True)),
+    }
+    clients = {LIBRARIAN: _clients(librarians), STUDENT: _clients(students)}
+
+    def call(scenario):
+        url, data = scenario.build(rng, ids)
+        client = rng.choice(clients[scenario.role])
+        return getattr(client, scenario.method)(url, data)
+
+    # Warm up template loading, URL resolving and the search index
+    for scenario in scenarios:
+        call(scenario)
+
+    samples = {scenario.name: {'latency': [], 'queries': [], 'errors': 0} for scenario in scenarios}
+    weights = [scenario.weight for scenario in scenarios]
+    for number in range(1, requests + 1):
+        scenario = rng.choices(scenarios, weights)[0]
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = call(scenario)
+            elapsed = time.perf_counter() - started
+        sample = samples[scenario.name]
+        sample['latency'].append(elapsed * 1000)
+        sample['queries'].append(len(queries))
+        if response.status_code >= 500:
+            sample['errors'] += 1
+        if number % 500 == 0:
+            log(f"{number}/{requests} requests")
+
+    peaks = {}
+    tracemalloc.start()
+    try:
+        for scenario in scenarios:
+            peak = 0
+            for _ in range(memory_samples):
+                tracemalloc.reset_peak()
+                call(scenario)
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+            peaks[scenario.name] = peak
+    finally:
+        tracemalloc.stop()
+
+    results = {}
+    for name, sample in samples.items():
+        latency = sorted(sample['latency'])
+        if not latency:
+            continue
+        results[name] = {
+            'requests': len(latency),
+            'errors': sample['errors'],
+            'p50_ms': round(percentile(latency, 0.50), 3),
+            'p95_ms': round(percentile(latency, 0.95), 3),
+            'p99_ms': round(percentile(latency, 0.99), 3),
+            'mean_queries': round(statistics.mean(sample['queries']), 2),
+            'max_queries': max(sample['queries']),
+            'peak_memory_kb': round(peaks.get(name, 0) / 1024, 1),
+        }
+    return results
+
+
+def compare(before, after, metrics=('p50_ms', 'p95_ms', 'p99_ms', 'mean_queries', 'peak_memory_kb')):
+    """Rows of (view, metric, before, after, change %) for views present in both runs."""
+    rows = []
+    for view in sorted(set(before) & set(after)):
+        for metric in metrics:
+            old, new = before[view].get(metric), after[view].get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old * 100 if old else 0.0
+            rows.append((view, metric, old, new, change))
+    return rows
+
+
+### ---------- Sync vs async under concurrency ---------- ###
+
+# (name, sync view, async view, route suffix)
+ASYNC_PAIRS = [
+    ('student_dashboard', views.student_dashboard, async_views.student_dashboard, ''),
+    ('available_books', views.available_books, async_views.available_books, ''),
+    ('rent_list', views.rent_list, async_views.rent_list, ''),
+    ('purchase_list', views.purchase_list, async_views.purchase_list, ''),
+    ('read_book', views.read_book, async_views.read_book, '<int:book_id>/'),
+]
+
+
+def comparison_urlconf():
+    """The project URLs plus ``bench/<sync|async>/<view>/`` routes for every pair."""
+    module = types.ModuleType('library_benchmark_urls')
+    module.urlpatterns = [
+        path(f'bench/{mode}/{name}/{suffix}', view, name=f'bench_{mode}_{name}')
+        for name, sync_view, async_view, suffix in ASYNC_PAIRS
+        for mode, view in (('sync', sync_view), ('async', async_view))
+    ] + list(import_module(settings.ROOT_URLCONF).urlpatterns)
+    return module
+
+
+async def _drive(clients, urls, requests, concurrency):
+    """Send ``requests`` GETs from ``concurrency`` connections; return throughput and latencies."""
+    remaining = iter(range(requests))
+    latencies = []
+    errors = 0
+
+    async def connection_loop(client, rng):
+        nonlocal errors
+        for _ in remaining:
+            started = time.perf_counter()
+            response = await client.get(rng.choice(urls))
+            latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 500:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        connection_loop(clients[index % len(clients)], random.Random(index)) for index in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+    }
+
+
+def compare_sync_async(students, requests=1000, concurrency=50, log=None):
+    """``{view: {'sync': {...}, 'async': {...}}}`` measured through the ASGI handler."""
+    log = log or (lambda message: None)
+    book_ids = list(Book.objects.values_list('id', flat=True)[:200])
+
+    async def measure():
+        clients = []
+        for user in students:
+            client = AsyncClient(raise_request_exception=False)
+            await client.aforce_login(user)
+            clients.append(client)
+        results = {}
+        for name, _, _, suffix in ASYNC_PAIRS:
+            results[name] = {}
+            for mode in ('sync', 'async'):
+                url_name = f'bench_{mode}_{name}'
+                if suffix:
+                    urls = [reverse(url_name, args=[book_id]) for book_id in book_ids]
+                else:
+                    urls = [reverse(url_name)]
+                await _drive(clients, urls, concurrency, concurrency)  # Warm up
+                results[name][mode] = await _drive(clients, urls, requests, concurrency)
+                log(f"{name} ({mode}): {results[name][mode]['throughput_rps']} req/s")
+        return results
+
+    with override_settings(ROOT_URLCONF=comparison_urlconf()):
+        return asyncio.run(measure())
+
+
+### ---------- Payment recording ---------- ###
+
+def _payment_feed(students, count, duplicates, prefix, rng):
+    entries = []
+    for index in range(count):
+        if entries and rng.random() < duplicates:
+            entries.append(rng.choice(entries))  # A retried delivery
+            continue
+        entries.append({
+            'user_id': rng.choice(students).pk,
+            'amount': rng.randint(10, 500),
+            'payment_type': rng.choice(payments.PAYMENT_TYPES),
+            'payment_method': rng.choice(payments.PAYMENT_METHODS),
+            'idempotency_key': f'{prefix}:{index}',
+        })
+    return entries
+
+
+def compare_payment_recording(students, count=2000, duplicates=0.1, chunk_size=payments.DEFAULT_CHUNK_SIZE, log=None):
+    """``{'single': {...}, 'batch': {...}}``: payments per second and queries per payment."""
+    log = log or (lambda message: None)
+    users = {student.pk: student for student in students}
+    results = {}
+    queries = 0
+
+    def count_queries(execute, *args):
+        # The debug query log is capped at 9000 entries, too few for a whole feed
+        nonlocal queries
+        queries += 1
+        return execute(*args)
+
+    for mode in ('single', 'batch'):
+        entries = _payment_feed(students, count, duplicates, f'bench-{mode}', random.Random(0))
+        queries = 0
+        with connection.execute_wrapper(count_queries):
+            started = time.perf_counter()
+            if mode == 'single':
+                created = sum(
+                    payments.charge(
+                        users[entry['user_id']], entry['amount'], entry['payment_type'],
+                        entry['payment_method'], entry['idempotency_key'],
+                    )[1]
+                    for entry in entries
+                )
+            else:
+                created = payments.record_payments(entries, chunk_size=chunk_size).created
+            elapsed = time.perf_counter() - started
+        results[mode] = {
+            'entries': len(entries),
+            'created': created,
+            'payments_per_second': round(len(entries) / elapsed, 1),
+            'queries_per_payment': round(queries / len(entries), 3),
+        }
+        log(f"{mode}: {results[mode]['payments_per_second']} payments/s")
+    Payment.objects.filter(idempotency_key__startswith='bench-').delete()
+    return results
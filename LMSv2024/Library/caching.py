@@ -0,0 +1,243 @@
+"""
+Response and fragment caching with model-driven invalidation.
+
+Every cache key embeds the current *version* of the models the content was
+rendered from. Saving or deleting a tracked model bumps its version (see
+signals.py), so stale entries are never served: they just stop being looked up
+and age out of the cache. Nothing has to enumerate or delete keys.
+
+Two entry points:
+
+* ``cache_response('book', 'author')`` caches whole GET responses for anonymous
+  visitors (pages that carry a CSRF token, cookies or flash messages are never
+  stored).
+* ``{% cachefragment 'catalogue' 'book' vary=request.get_full_path %}`` in
+  templates (``{% load library_cache %}``) caches part of a per-user page.
+
+Entries live in the cache alias named by ``LIBRARY_CACHE_ALIAS`` (default
+``'default'``). Any Django backend works; for example::
+
+    CACHES = {
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'library': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': BASE_DIR / 'cache',
+        },
+    }
+    LIBRARY_CACHE_ALIAS = 'library'
+
+The version counters live in the same alias, so with several processes it must
+be a shared backend (file-based, Memcached, Redis) for invalidation to reach all
+of them.
+"""
+import contextvars
+import functools
+import hashlib
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from asgiref.local import Local
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import caches
+from django.db import transaction
+
+DEFAULT_TIMEOUT = 60 * 10
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+# Set by the instrumentation middleware to count hits for the current request
+request_counters = contextvars.ContextVar('library_cache_request_counters', default=None)
+
+
+def get_cache():
+    return caches[getattr(settings, 'LIBRARY_CACHE_ALIAS', 'default')]
+
+
+def default_timeout():
+    return getattr(settings, 'LIBRARY_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+### ---------- Versions ---------- ###
+
+def _version_key(name):
+    return f'library:version:{name}'
+
+
+def _changed_key(name):
+    return f'library:changed:{name}'
+
+
+def _seed():
+    # A counter restarting at 1 after a restart, eviction or flush would repeat
+    # versions, and so cache keys and ETags, for data that has since changed
+    return time.time_ns()
+
+
+def versions(names):
+    """Current version of each model name, as one string usable in a cache key."""
+    cache = get_cache()
+    keys = [_version_key(name) for name in names]
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        for key in missing:
+            cache.add(key, _seed(), None)
+        found.update(cache.get_many(missing))  # Another process may have seeded it first
+    return '.'.join(str(found.get(key, 0)) for key in keys)
+
+
+def last_changed(names):
+    """When the most recently bumped of these models changed (UTC), or None if none is known."""
+    found = get_cache().get_many([_changed_key(name) for name in names])
+    if not found:
+        return None
+    return datetime.fromtimestamp(max(found.values()), timezone.utc)
+
+
+def bump(*names):
+    """Invalidate everything rendered from these models. Returns ``{name: new version}``."""
+    cache = get_cache()
+    cache.set_many({_changed_key(name): time.time() for name in names}, None)
+    bumped = {}
+    for name in names:
+        key = _version_key(name)
+        # Versions never expire, otherwise an entry could come back to life
+        seed = _seed()
+        if cache.add(key, seed, None):
+            bumped[name] = seed
+            continue
+        try:
+            bumped[name] = cache.incr(key)
+        except ValueError:  # Evicted between add() and incr()
+            cache.add(key, seed, None)
+            bumped[name] = cache.get(key, seed)
+    return bumped
+
+
+# Names waiting for a commit, per thread (or async context) like Django's connections
+_pending = Local()
+
+
+def _bump_pending():
+    names = getattr(_pending, 'names', None)
+    if names:
+        _pending.names = set()
+        bump(*sorted(names))
+
+
+def bump_on_commit(*names):
+    """
+    Bump after the current transaction commits, so a reader cannot cache the old
+    rows under the new version. A cascade that deletes hundreds of books still
+    bumps each version once: the first callback to run bumps every pending
+    name and the others find nothing left. Names left over from a rolled back
+    transaction are bumped with the next commit, which only costs a miss.
+    """
+    if not transaction.get_connection().in_atomic_block:
+        bump(*names)
+        return
+    if not hasattr(_pending, 'names'):
+        _pending.names = set()
+    _pending.names.update(names)
+    transaction.on_commit(_bump_pending)
+
+
+### ---------- Hit / miss counters ---------- ###
+
+def record(name, hit):
+    with _stats_lock:
+        _stats[(name, 'hit' if hit else 'miss')] += 1
+    counters = request_counters.get()
+    if counters is not None:
+        counters.record_cache(hit)
+
+
+def stats():
+    """``{name: {'hit': n, 'miss': n}}`` for this process since it started."""
+    with _stats_lock:
+        result = {}
+        for (name, outcome), count in _stats.items():
+            result.setdefault(name, {'hit': 0, 'miss': 0})[outcome] = count
+        return result
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+### ---------- Fragments ---------- ###
+
+def fragment_key(name, models, vary=()):
+    digest = hashlib.md5(repr(tuple(vary)).encode(), usedforsecurity=False).hexdigest()
+    return f'library:fragment:{name}:{versions(models)}:{digest}'
+
+
+def get_or_render(name, models, vary, render, timeout=None):
+    """Return the cached fragment or call ``render()`` and store the result."""
+    cache = get_cache()
+    key = fragment_key(name, models, vary)
+    content = cache.get(key)
+    record(name, content is not None)
+    if content is None:
+        content = render()
+        cache.set(key, content, default_timeout() if timeout is None else timeout)
+    return content
+
+
+### ---------- Whole responses ---------- ###
+
+def _is_cacheable_request(request):
+    if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+        return False
+    # Reading the storage length does not mark the messages as shown
+    return not len(messages.get_messages(request))
+
+
+def _is_cacheable_response(request, response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+        and 'private' not in response.get('Cache-Control', '')
+    )
+
+
+def cache_response(*models, timeout=None):
+    """
+    Cache a view's response for anonymous visitors until one of ``models`` changes.
+
+    The key covers the full path, so query strings (search, cursors) are cached
+    separately. Responses carry ``X-Cache: HIT`` or ``MISS``.
+    """
+    def decorator(view_func):
+        name = view_func.__name__
+
+        @functools.wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if not _is_cacheable_request(request):
+                return view_func(request, *args, **kwargs)
+
+            cache = get_cache()
+            path = hashlib.md5(request.get_full_path().encode(), usedforsecurity=False).hexdigest()
+            key = f'library:response:{name}:{versions(models)}:{path}'
+            cached = cache.get(key)
+            record(name, cached is not None)
+            if cached is not None:
+                cached['X-Cache'] = 'HIT'
+                return cached
+
+            response = view_func(request, *args, **kwargs)
+            if hasattr(response, 'render') and callable(response.render):
+                response.render()
+            if _is_cacheable_response(request, response):
+                cache.set(key, response, default_timeout() if timeout is None else timeout)
+            response['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
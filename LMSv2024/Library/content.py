@@ -0,0 +1,94 @@
+"""
+Chunked storage for book text.
+
+A book's text is stored as ``BookContentChunk`` rows of at most ``CHUNK_CHARS``
+characters, addressed by ISBN. Each chunk records its byte offset in the UTF-8
+encoded text, so byte ranges and reader pages are served by reading only the
+chunks they touch.
+"""
+from django.db import transaction
+
+from .models import ISBN, BookContentChunk
+
+CHUNK_CHARS = 16384
+WRITE_BATCH = 50
+
+
+def _pieces(source):
+    """Split a string, an iterable of strings or a text file into chunk-sized pieces."""
+    if isinstance(source, str):
+        for start in range(0, len(source), CHUNK_CHARS):
+            yield source[start:start + CHUNK_CHARS]
+        return
+    if hasattr(source, 'read'):
+        source = iter(lambda: source.read(CHUNK_CHARS), '')
+    buffer = ''
+    for text in source:
+        if isinstance(text, bytes):
+            text = text.decode('utf-8')
+        buffer += text
+        while len(buffer) >= CHUNK_CHARS:
+            yield buffer[:CHUNK_CHARS]
+            buffer = buffer[CHUNK_CHARS:]
+    if buffer:
+        yield buffer
+
+
+@transaction.atomic
+def write_content(isbn, source):
+    """Replace the text stored for ``isbn``, writing it in batches of chunks."""
+    BookContentChunk.objects.filter(isbn=isbn).delete()
+    offset = 0
+    count = 0
+    batch = []
+    for piece in _pieces(source):
+        batch.append(BookContentChunk(isbn=isbn, index=count, byte_offset=offset, text=piece))
+        offset += len(piece.encode('utf-8'))
+        count += 1
+        if len(batch) >= WRITE_BATCH:
+            BookContentChunk.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        BookContentChunk.objects.bulk_create(batch)
+    ISBN.objects.filter(pk=isbn.pk).update(content_length=offset, content_chunk_count=count)
+    isbn.content_length = offset
+    isbn.content_chunk_count = count
+
+
+def read_page(isbn, page):
+    """Text of the 1-based reader ``page``, or None past the end."""
+    return (
+        BookContentChunk.objects.filter(isbn=isbn, index=page - 1)
+        .values_list('text', flat=True)
+        .first()
+    )
+
+
+def iter_bytes(isbn, start=0, end=None):
+    """
+    Yield the UTF-8 bytes ``start`` to ``end`` (inclusive) of the text, one
+    chunk at a time.
+    """
+    if end is None:
+        end = isbn.content_length - 1
+    if start > end:
+        return
+    first = (
+        BookContentChunk.objects.filter(isbn=isbn, byte_offset__lte=start)
+        .order_by('-byte_offset')
+        .values_list('index', flat=True)
+        .first()
+    )
+    if first is None:
+        return
+    chunks = (
+        BookContentChunk.objects.filter(isbn=isbn, index__gte=first, byte_offset__lte=end)
+        .order_by('index')
+        .values_list('byte_offset', 'text')
+    )
+    for offset, text in chunks.iterator(chunk_size=4):
+        data = text.encode('utf-8')
+        lo = max(start - offset, 0)
+        hi = min(end - offset + 1, len(data))
+        if lo < hi:
+            yield data[lo:hi]
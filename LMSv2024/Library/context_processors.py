@@ -0,0 +1,20 @@
+"""
+Template context processors.
+
+Enable by adding to ``TEMPLATES[0]['OPTIONS']['context_processors']``::
+
+    'Library.context_processors.roles',
+"""
+from django.utils.functional import SimpleLazyObject
+
+from .roles import is_librarian, is_student
+
+
+def roles(request):
+    user = getattr(request, 'user', None)
+    if user is None:
+        return {}
+    return {
+        'is_librarian': SimpleLazyObject(lambda: is_librarian(user)),
+        'is_student': SimpleLazyObject(lambda: is_student(user)),
+    }
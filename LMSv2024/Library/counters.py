@@ -0,0 +1,91 @@
+"""
+Denormalised book counts on ``Author``, ``Category`` and ``Language``.
+
+Every ``Book`` write adjusts the ``book_count`` of the rows it points at:
+creating a book adds one to its author, category and language, deleting it
+subtracts one, and moving it to another author (category, language) moves one
+from the old row to the new. Each adjustment is an
+``UPDATE ... SET book_count = book_count + 1`` built with ``F()`` in the
+transaction of the book write, so concurrent writers never lose a count and a
+rolled back save changes nothing. ``Book.from_db`` remembers the keys a book
+was loaded with, so a save only costs the updates of the counts it changes.
+
+Soft-deleted books no longer count (deletion.py). Bulk writes skip the model
+signals: the catalogue importer calls ``reconcile()`` for the rows it
+touched, and ``manage.py reconcile_book_counts`` recomputes every count from
+the books in one ``UPDATE`` per table.
+"""
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from . import caching
+from .models import COUNTED_FIELDS, Author, Book, Category, Language
+
+COUNTERS = dict(zip(COUNTED_FIELDS, (Author, Category, Language)))
+
+
+def _adjust(model, pk, delta):
+    if pk is not None and model.objects.filter(pk=pk).update(book_count=F('book_count') + delta):
+        caching.bump_on_commit(model._meta.model_name)
+
+
+def _saved_fields(update_fields):
+    if update_fields is None:
+        return COUNTED_FIELDS
+    return [field for field in COUNTED_FIELDS if field in update_fields or field[:-3] in update_fields]
+
+
+### ---------- Book signals ---------- ###
+
+def book_saving(book):
+    """Make sure an existing book knows the keys it is counted under before it is saved."""
+    if book.pk is None:
+        return
+    counted = getattr(book, '_counted', {})
+    missing = [field for field in COUNTED_FIELDS if field not in counted]
+    if missing:  # Not loaded from the database, or loaded with only()/defer()
+        counted.update(Book.objects.filter(pk=book.pk).values(*missing).first() or dict.fromkeys(missing))
+    book._counted = counted
+
+
+def book_saved(book, created, update_fields=None):
+    if book.deleted_at is not None:
+        return
+    before = {} if created else book._counted
+    for field in _saved_fields(update_fields):
+        old, new = before.get(field), getattr(book, field)
+        if old != new:
+            _adjust(COUNTERS[field], old, -1)
+            _adjust(COUNTERS[field], new, 1)
+        before[field] = new
+    book._counted = before
+
+
+def book_deleted(book):
+    if book.deleted_at is not None:
+        return  # Taken off when it was soft-deleted (deletion.py)
+    for field, model in COUNTERS.items():
+        _adjust(model, getattr(book, field), -1)
+
+
+### ---------- Reconciliation ---------- ###
+
+def _actual(field):
+    books = Book.objects.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(n=Count('id'))
+    return Coalesce(Subquery(books.values('n')), Value(0))
+
+
+def reconcile(authors=None, categories=None, languages=None):
+    """
+    Recompute the counts of the given author, category and language ids from
+    the books; all rows of a table when its ids are None. Returns how many
+    rows were corrected.
+    """
+    corrected = 0
+    for (field, model), pks in zip(COUNTERS.items(), (authors, categories, languages)):
+        rows = model.objects.all() if pks is None else model.objects.filter(pk__in=pks)
+        changed = rows.exclude(book_count=_actual(field)).update(book_count=_actual(field))
+        if changed:
+            caching.bump_on_commit(model._meta.model_name)
+        corrected += changed
+    return corrected
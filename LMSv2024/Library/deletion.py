@@ -0,0 +1,149 @@
+"""
+Soft deletion of authors, books and categories, purged in the background.
+
+``soft_delete()`` only stamps ``deleted_at``. The default managers
+(``objects``) leave stamped rows out, so the object is gone from every list,
+search, API response and recommendation as soon as the request commits;
+``all_objects`` still sees it. An author's books are stamped with it in one
+``UPDATE``, since the purge will cascade to them, and dropped from the search
+and autocomplete indexes with it.
+
+The real deletion, with its cascade to rentals, purchases, loans and the
+rest, runs as ``purge`` jobs (jobs.py). A job removes at most
+``LIBRARY_PURGE_CHUNK_SIZE`` dependent rows, deepest first, in one short
+transaction. It then queues the next chunk ``LIBRARY_PURGE_PAUSE`` seconds
+later, so purging a prolific author never holds locks for long and leaves the
+database to request traffic in between. Foreign keys that are ``SET_NULL``
+are cleared chunk by chunk the same way. Progress is kept in a
+``BatchCheckpoint`` named ``purge:<model>:<id>`` (see
+``manage.py purge_deleted``).
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+
+from . import autocomplete, caching, counters, jobs, search
+from .models import Author, BatchCheckpoint, Book, Category, Job
+
+logger = logging.getLogger(__name__)
+
+MODELS = {model._meta.model_name: model for model in (Author, Book, Category)}
+SEARCH_KINDS = {Author: 'author', Book: 'book', Category: 'category'}
+CHUNK_SIZE = 500
+PAUSE_SECONDS = 1.0
+
+
+def checkpoint_name(model_name, pk):
+    return f'purge:{model_name}:{pk}'
+
+
+### ---------- Hiding ---------- ###
+
+def soft_delete(obj):
+    """Hide ``obj`` now and queue its purge. Returns False if it was already deleted."""
+    model = type(obj)
+    name = model._meta.model_name
+    now = timezone.now()
+    with transaction.atomic():
+        if not model.all_objects.filter(pk=obj.pk, deleted_at__isnull=True).update(deleted_at=now):
+            return False
+        if model is Book:
+            counters.book_deleted(obj)
+        elif model is Author:
+            book_ids = list(Book.objects.filter(author=obj).values_list('pk', flat=True))
+            books = Book.objects.filter(pk__in=book_ids)
+            touched = books.values('category_id', 'language_id').distinct()
+            categories = {row['category_id'] for row in touched} - {None}
+            languages = {row['language_id'] for row in touched} - {None}
+            if books.update(deleted_at=now):
+                counters.reconcile(authors=[obj.pk], categories=categories, languages=languages)
+                caching.bump_on_commit('book')
+                # Hidden books drop out of the indexes, which answer without asking the database
+                transaction.on_commit(lambda: (
+                    search.refresh('book', book_ids),
+                    autocomplete.refresh('book', book_ids),
+                ))
+        obj.deleted_at = now
+        caching.bump_on_commit(name)
+        BatchCheckpoint.objects.update_or_create(
+            job=checkpoint_name(name, obj.pk), run_date=now.date(),
+            defaults={'cursor': '', 'processed': 0, 'finished': False},
+        )
+        jobs.enqueue('purge', model=name, pk=obj.pk, run_date=now.date().isoformat())
+        kind = SEARCH_KINDS[model]
+        transaction.on_commit(lambda: search.unindex(kind, obj.pk))
+        if kind in autocomplete.SOURCES:
+            transaction.on_commit(lambda: autocomplete.refresh(kind, [obj.pk]))
+    return True
+
+
+### ---------- Purging ---------- ###
+
+def _children(rel, queryset):
+    return rel.related_model._base_manager.filter(**{f'{rel.field.name}__in': queryset.values('pk')})
+
+
+def _delete_chunk(queryset, chunk_size):
+    """
+    Delete up to ``chunk_size`` rows under (or, once nothing is left under
+    them, of) ``queryset``. Returns how many rows were deleted or updated.
+    """
+    for rel in queryset.model._meta.related_objects:
+        if rel.on_delete is models.CASCADE:
+            done = _delete_chunk(_children(rel, queryset), chunk_size)
+        elif rel.on_delete is models.SET_NULL:
+            ids = list(_children(rel, queryset).values_list('pk', flat=True)[:chunk_size])
+            done = rel.related_model._base_manager.filter(pk__in=ids).update(**{rel.field.name: None})
+            if done:
+                caching.bump_on_commit(rel.related_model._meta.model_name)
+                if rel.related_model is Book:  # Book documents carry the category name
+                    transaction.on_commit(lambda ids=ids: search.reindex(
+                        'book', search.source_queryset('book').filter(pk__in=ids)
+                    ))
+        else:
+            continue
+        if done:
+            return done
+    ids = list(queryset.values_list('pk', flat=True)[:chunk_size])
+    if ids:
+        queryset.model._base_manager.filter(pk__in=ids).delete()
+    return len(ids)
+
+
+def purge_step(model_name, pk, run_date, chunk_size=None):
+    """
+    Purge one chunk of a soft-deleted object and queue the next. Meant to run
+    inside the job's transaction; returns True once the object is gone.
+    """
+    model = MODELS[model_name]
+    chunk_size = chunk_size or getattr(settings, 'LIBRARY_PURGE_CHUNK_SIZE', CHUNK_SIZE)
+    target = model._base_manager.filter(pk=pk, deleted_at__isnull=False)
+    done = _delete_chunk(target, chunk_size)
+    finished = not target.exists()
+
+    checkpoint, _ = BatchCheckpoint.objects.get_or_create(job=checkpoint_name(model_name, pk), run_date=run_date)
+    checkpoint.processed += done
+    checkpoint.finished = finished
+    checkpoint.save()
+    if finished:
+        logger.info("Purged %s %s (%d rows)", model_name, pk, checkpoint.processed)
+    else:
+        pause = getattr(settings, 'LIBRARY_PURGE_PAUSE', PAUSE_SECONDS)
+        jobs.enqueue('purge', run_after=timezone.now() + timedelta(seconds=pause),
+                     model=model_name, pk=pk, run_date=run_date)
+    return finished
+
+
+def pending():
+    """Soft-deleted objects with no purge job queued, e.g. after a job failed for good."""
+    queued = {
+        (payload['model'], payload['pk'])
+        for payload in Job.objects.filter(kind='purge').exclude(status=Job.FAILED).values_list('payload', flat=True)
+    }
+    for name, model in MODELS.items():
+        for obj in model.all_objects.filter(deleted_at__isnull=False).order_by('id'):
+            if (name, obj.pk) not in queued:
+                yield obj
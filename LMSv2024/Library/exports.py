@@ -0,0 +1,215 @@
+"""
+Streaming data exports.
+
+Each ``Export`` names the columns of one dataset and how to filter it. Rows are
+read in keyset chunks of ``CHUNK_SIZE`` in id order (``id > last`` with a
+``LIMIT``, as batches.py does), since MySQL's driver buffers the whole result
+of a plain ``.iterator()``, and encoded a batch at a time, so memory stays flat
+however many rows there are; ``stream()`` yields
+bytes for a ``StreamingHttpResponse`` or a file, gzip-compressed on the fly if
+asked. The book export uses the import columns (importer.py), so an exported
+catalogue can be fed back to ``import_catalog``.
+
+Filters mirror the list screens: ``q`` goes through the search index (book
+search for books, student search for everything else), and ``since``/``until``
+bound the export's date column. A search matching more than
+``LIBRARY_EXPORT_SEARCH_LIMIT`` rows raises ``TooManyMatches`` before anything
+is written, rather than producing a file with only some of them.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from . import search
+from .models import Book, Payment, Purchase, Rent
+from .roles import STUDENT
+
+FORMATS = ('csv', 'jsonl', 'json')
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson',
+    'json': 'application/json',
+}
+CHUNK_SIZE = 2000  # Rows fetched per round trip
+BATCH_ROWS = 200  # Rows encoded per yielded piece
+SEARCH_LIMIT = 10000
+
+
+class TooManyMatches(ValueError):
+    pass
+
+
+class Export:
+    def __init__(self, name, queryset, columns, search_kind, search_field='pk', date_field=None, filters=()):
+        self.name = name
+        self.queryset = queryset  # Callable, so the export never holds a stale queryset
+        self.columns = columns  # (header, field path) pairs
+        self.search_kind = search_kind
+        self.search_field = search_field  # Field the search hits' ids are matched against
+        self.date_field = date_field
+        self.filters = filters  # Extra exact-match filters: (option name, field path)
+
+    @property
+    def headers(self):
+        return [header for header, _ in self.columns]
+
+    def rows(self, q=None, since=None, until=None, **filters):
+        """
+        Tuples in column order, fetched ``CHUNK_SIZE`` at a time. The filters
+        are applied, and the search run, before the first row is asked for.
+        """
+        queryset = self.queryset()
+        if q:
+            limit = getattr(settings, 'LIBRARY_EXPORT_SEARCH_LIMIT', SEARCH_LIMIT)
+            ids = search.search_ids(self.search_kind, q, limit + 1)
+            if len(ids) > limit:
+                raise TooManyMatches(f"The search matches more than {limit} rows; narrow it down.")
+            queryset = queryset.filter(**{f'{self.search_field}__in': ids})
+        if since:
+            queryset = queryset.filter(**{f'{self.date_field}__gte': _bound(queryset, self.date_field, since, time.min)})
+        if until:
+            queryset = queryset.filter(**{f'{self.date_field}__lte': _bound(queryset, self.date_field, until, time.max)})
+        for option, field in self.filters:
+            if filters.get(option):
+                queryset = queryset.filter(**{field: filters[option]})
+        return _chunked(queryset.values_list('id', *(field for _, field in self.columns)))
+
+
+def _chunked(rows):
+    last = 0
+    while True:
+        chunk = list(rows.filter(id__gt=last).order_by('id')[:CHUNK_SIZE])
+        for row in chunk:
+            yield row[1:]
+        if len(chunk) < CHUNK_SIZE:
+            return
+        last = chunk[-1][0]
+
+
+def _bound(queryset, field, day, at):
+    """Dates compare as they are; datetime columns get the start or end of the day."""
+    if queryset.model._meta.get_field(field).get_internal_type() != 'DateTimeField':
+        return day
+    moment = datetime.combine(day, at)
+    return timezone.make_aware(moment) if settings.USE_TZ else moment
+
+
+EXPORTS = {
+    export.name: export for export in [
+        Export(
+            'books',
+            Book.objects.all,
+            [('id', 'id'), ('title', 'title'), ('author', 'author__name'), ('category', 'category__name'),
+             ('language', 'language__name'), ('isbn', 'isbn__isbn_number'), ('quantity', 'quantity'),
+             ('price', 'price'), ('description', 'description')],
+            search_kind='book',
+            filters=[('category', 'category__name'), ('language', 'language__name')],
+        ),
+        Export(
+            'payments',
+            Payment.objects.all,
+            [('id', 'id'), ('username', 'user__username'), ('payment_type', 'payment_type'),
+             ('payment_method', 'payment_method'), ('amount', 'amount'), ('payment_date', 'payment_date')],
+            search_kind='student',
+            search_field='user',
+            date_field='payment_date',
+            filters=[('payment_type', 'payment_type'), ('payment_method', 'payment_method')],
+        ),
+        Export(
+            'rents',
+            Rent.objects.all,
+            [('id', 'id'), ('username', 'user__username'), ('book', 'book__title'), ('start_date', 'start_date'),
+             ('end_date', 'end_date'), ('rental_fee', 'rental_fee'), ('expired', 'expired')],
+            search_kind='student',
+            search_field='user',
+            date_field='start_date',
+        ),
+        Export(
+            'purchases',
+            Purchase.objects.all,
+            [('id', 'id'), ('username', 'user__username'), ('book', 'book__title'),
+             ('purchase_date', 'purchase_date'), ('purchase_price', 'purchase_price'),
+             ('delivery_address', 'delivery_address')],
+            search_kind='student',
+            search_field='user',
+            date_field='purchase_date',
+        ),
+        Export(
+            'students',
+            lambda: User.objects.filter(groups__name=STUDENT),
+            [('id', 'id'), ('username', 'username'), ('first_name', 'first_name'), ('last_name', 'last_name'),
+             ('email', 'email'), ('is_active', 'is_active'), ('date_joined', 'date_joined')],
+            search_kind='student',
+            date_field='date_joined',
+        ),
+    ]
+}
+
+
+### ---------- Encoders ---------- ###
+
+def _batches(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_ROWS:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _csv(headers, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+    for batch in _batches(rows):
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()  # Header of an empty export
+
+
+def _jsonl(headers, rows):
+    for batch in _batches(rows):
+        yield ''.join(json.dumps(dict(zip(headers, row)), cls=DjangoJSONEncoder) + '\n' for row in batch)
+
+
+def _json(headers, rows):
+    separator = '['
+    for batch in _batches(rows):
+        yield separator + ','.join(json.dumps(dict(zip(headers, row)), cls=DjangoJSONEncoder) for row in batch)
+        separator = ','
+    yield ']\n' if separator == ',' else '[]\n'
+
+
+ENCODERS = {'csv': _csv, 'jsonl': _jsonl, 'json': _json}
+
+
+def _gzip(pieces):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)  # gzip container
+    for piece in pieces:
+        data = compressor.compress(piece)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream(export, file_format='csv', compress=False, **filters):
+    """Bytes of ``export`` in ``file_format``, produced lazily. Raises ``TooManyMatches`` straight away."""
+    rows = export.rows(**filters)
+    pieces = (text.encode() for text in ENCODERS[file_format](export.headers, rows))
+    return _gzip(pieces) if compress else pieces
+
+
+def filename(export, file_format, compress=False):
+    return f"{export.name}.{file_format}{'.gz' if compress else ''}"
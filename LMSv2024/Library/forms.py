@@ -41,6 +41,27 @@ class BookForm(forms.ModelForm):
             'quantity', 'book_image', 'description', 'price'
         ]
 
+    def clean(self):
+        cleaned_data = super().clean()
+        # Deleted books keep their (title, author) until the purge removes them
+        title, author = cleaned_data.get('title'), cleaned_data.get('author')
+        if title and author and Book.all_objects.filter(title=title, author=author, deleted_at__isnull=False).exists():
+            raise ValidationError("A deleted book with this title and author is still being removed. Try again shortly.")
+        return cleaned_data
+
+
+class ISBNForm(forms.ModelForm):
+    # Book text is stored in chunks (see content.py), so it is uploaded as a file
+    content_file = forms.FileField(
+        required=False,
+        label='Book content',
+        help_text='UTF-8 text file. Replaces the stored content.',
+    )
+
+    class Meta:
+        model = ISBN
+        fields = ['isbn_number']
+
 
 class AuthorForm(forms.ModelForm):
     class Meta:
@@ -52,6 +73,12 @@ class CategoryForm(forms.ModelForm):
         model = Category
         fields = ['name', 'description']
 
+    def clean_name(self):
+        name = self.cleaned_data['name']
+        if Category.all_objects.filter(name=name, deleted_at__isnull=False).exists():
+            raise ValidationError("A deleted category with this name is still being removed. Try again shortly.")
+        return name
+
 
 
 
@@ -77,4 +104,43 @@ class MembershipForm(forms.ModelForm):
             'name': forms.Select(choices=Membership.MEMBERSHIP_CHOICES),
             'price_per_month': forms.NumberInput(attrs={'class': 'form-control'}),
             'book_access_percentage': forms.NumberInput(attrs={'class': 'form-control'}),
-        }
\ No newline at end of file
+        }
+
+
+class AnalyticsRangeForm(forms.Form):
+    start = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    end = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start, end = cleaned_data.get('start'), cleaned_data.get('end')
+        if start and end and start > end:
+            raise forms.ValidationError("The start date must not be after the end date.")
+        return cleaned_data
+
+
+class ExportForm(forms.Form):
+    FORMAT_CHOICES = [('csv', 'CSV'), ('jsonl', 'JSON Lines'), ('json', 'JSON')]
+
+    format = forms.ChoiceField(choices=FORMAT_CHOICES, required=False)
+    gzip = forms.BooleanField(required=False)
+    q = forms.CharField(required=False)
+    since = forms.DateField(required=False)
+    until = forms.DateField(required=False)
+    payment_type = forms.ChoiceField(choices=[('', '')] + Payment.PAYMENT_TYPES, required=False)
+    payment_method = forms.ChoiceField(choices=[('', '')] + Payment.PAYMENT_METHOD, required=False)
+    category = forms.CharField(required=False)
+    language = forms.CharField(required=False)
+
+    def filters(self):
+        """Keyword arguments for ``exports.stream``."""
+        data = dict(self.cleaned_data)
+        del data['format'], data['gzip']
+        return data
+
+
+class CatalogImportForm(forms.Form):
+    FORMAT_CHOICES = [('csv', 'CSV'), ('jsonl', 'JSON Lines')]
+
+    feed = forms.FileField(help_text='Columns: title, author, category, language, isbn, quantity, price, description')
+    file_format = forms.ChoiceField(choices=FORMAT_CHOICES, label='Format')
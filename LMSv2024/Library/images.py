@@ -0,0 +1,118 @@
+"""
+Book cover pipeline.
+
+Uploads are stored under their content hash (``Book_image/<sha256>.<ext>``), so
+uploading the same picture twice keeps a single file. Saving a book with new
+cover queues a ``render_book_image`` job (jobs.py) in the same transaction, so
+the render survives a restart and is retried if it fails. The job is keyed on
+the image: a picture already waiting is not queued again, and workers never
+run two renders of one picture at once. The job renders resized WebP and JPEG
+copies at ``RENDITION_WIDTHS`` and records the widths it produced on
+``Book.book_image_renditions``; the ``book_image`` template tag turns that
+into a ``<picture>`` with ``srcset``.
+"""
+import hashlib
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from PIL import Image, ImageOps
+
+UPLOAD_DIR = 'Book_image'
+RENDITION_DIR = 'Book_image/renditions'
+RENDITION_WIDTHS = (100, 200, 400, 800)
+RENDITION_FORMATS = {'webp': ('WEBP', {'quality': 80, 'method': 4}),
+                     'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True})}
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """File names are content hashes, so an existing name already holds the same bytes."""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('allow_overwrite', True)
+        super().__init__(**kwargs)
+
+    def _save(self, name, content):
+        if self.exists(name):
+            return name
+        return super()._save(name, content)
+
+
+_storage = None
+
+
+def book_image_storage():
+    global _storage
+    if _storage is None:
+        _storage = ContentAddressedStorage()
+    return _storage
+
+
+def content_hash(file):
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def book_image_upload_to(instance, filename):
+    extension = os.path.splitext(filename)[1].lower() or '.jpg'
+    return f"{UPLOAD_DIR}/{content_hash(instance.book_image)}{extension}"
+
+
+def rendition_name(image_name, width, extension):
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    return f"{RENDITION_DIR}/{stem}-{width}.{extension}"
+
+
+def rendition_url(image_name, width, extension):
+    return book_image_storage().url(rendition_name(image_name, width, extension))
+
+
+def generate_renditions(image_name):
+    """
+    Render every rendition of ``image_name`` that does not exist yet and return
+    the widths available. Widths larger than the original are skipped.
+    """
+    storage = book_image_storage()
+    with storage.open(image_name, 'rb') as source:
+        image = Image.open(source)
+        # Let the JPEG decoder downscale while decoding instead of after
+        image.draft('RGB', (max(RENDITION_WIDTHS), max(RENDITION_WIDTHS)))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        widths = [w for w in RENDITION_WIDTHS if w <= image.width] or [image.width]
+        for width in sorted(widths, reverse=True):
+            height = max(round(image.height * width / image.width), 1)
+            # Each smaller rendition is resized from the previous one
+            image = image.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+            for extension, (pil_format, options) in RENDITION_FORMATS.items():
+                name = rendition_name(image_name, width, extension)
+                if storage.exists(name):
+                    continue
+                buffer = BytesIO()
+                image.save(buffer, pil_format, **options)
+                storage.save(name, ContentFile(buffer.getvalue()))
+    return sorted(widths)
+
+
+def process_book_image(image_name):
+    """
+    Generate renditions and record them on every book using this image. A
+    file that cannot be rendered raises, so the job is retried with backoff.
+    """
+    from .models import Book
+
+    widths = generate_renditions(image_name)
+    Book.objects.filter(book_image=image_name).update(book_image_renditions=widths)
+
+
+def schedule_renditions(image_name):
+    """Queue the renders of ``image_name`` in the current transaction, unless they already are."""
+    from . import jobs
+
+    jobs.enqueue('render_book_image', key=f'render:{image_name}', image_name=image_name)
@@ -0,0 +1,261 @@
+"""
+Bulk catalog import.
+
+Reads a CSV or JSON Lines supplier feed row by row and writes it in chunks:
+authors, categories, languages and ISBNs are resolved through in-memory lookup
+maps (creating the missing ones with one ``bulk_create`` per chunk), then the
+books themselves are bulk inserted. Rows whose ``(title, author)`` already
+exists are reported as duplicates rather than failing the chunk.
+
+Recognised columns: title, author, category, language, isbn, quantity, price,
+description. Only title and author are required. A file that cannot be read
+any further (not UTF-8, malformed CSV) stops the import with a file error
+once the rows read before it are written.
+"""
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction
+
+from . import caching, counters, search
+from .access import refresh_book_access
+from .models import ISBN, Author, Book, Category, Language
+
+DEFAULT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+PRICE_FIELD = Book._meta.get_field('price')
+MAX_PRICE = Decimal(10) ** (PRICE_FIELD.max_digits - PRICE_FIELD.decimal_places)
+
+
+class FeedError(ValueError):
+    """The feed cannot be read past a point, as opposed to one bad row."""
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.duplicates = 0
+        self.error_count = 0
+        self.errors = []  # (line number, message), capped at MAX_REPORTED_ERRORS
+        self.file_error = None  # Why reading stopped early, if it did
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+def read_rows(stream, file_format):
+    """
+    Yield ``(line number, row dict)`` from a text stream without reading it
+    all. Raises ``FeedError`` where the stream stops making sense.
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        try:
+            for row in reader:
+                yield reader.line_num, row
+        except UnicodeDecodeError:
+            raise FeedError(f"The file is not UTF-8 text after line {reader.line_num}")
+        except csv.Error as exc:
+            raise FeedError(f"Malformed CSV after line {reader.line_num}: {exc}")
+    elif file_format == 'jsonl':
+        line_number = 0
+        try:
+            for line_number, line in enumerate(stream, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as exc:
+                    yield line_number, exc
+                    continue
+                yield line_number, row if isinstance(row, dict) else ValueError("Expected a JSON object")
+        except UnicodeDecodeError:
+            raise FeedError(f"The file is not UTF-8 text after line {line_number}")
+    else:
+        raise ValueError(f"Unsupported import format: {file_format!r}")
+
+
+def _text(row, field, max_length=None):
+    value = row.get(field)
+    value = '' if value is None else str(value).strip()
+    if max_length and len(value) > max_length:
+        raise ValueError(f"{field} is longer than {max_length} characters")
+    return value
+
+
+def _isbn(row):
+    """ISBN-10 or ISBN-13 with hyphens and spaces removed; '' when absent."""
+    value = _text(row, 'isbn').replace('-', '').replace(' ', '').upper()
+    if value and not (len(value) == 13 and value.isdigit()
+                      or len(value) == 10 and value[:9].isdigit() and (value[9].isdigit() or value[9] == 'X')):
+        raise ValueError("isbn must have 10 or 13 digits")
+    return value
+
+
+def clean_row(row):
+    """Validate one feed row, raising ValueError with a readable message."""
+    title = _text(row, 'title', 150)
+    author = _text(row, 'author', 200)
+    if not title:
+        raise ValueError("title is required")
+    if not author:
+        raise ValueError("author is required")
+    try:
+        quantity = int(_text(row, 'quantity') or 1)
+        price = Decimal(_text(row, 'price') or '0')
+        if not price.is_finite():
+            raise InvalidOperation
+        price = price.quantize(Decimal('0.01'))
+    except (ValueError, InvalidOperation):
+        raise ValueError("quantity and price must be numbers")
+    if quantity < 0 or price < 0:
+        raise ValueError("quantity and price cannot be negative")
+    if price >= MAX_PRICE:
+        raise ValueError(f"price must be less than {MAX_PRICE}")
+    return {
+        'title': title,
+        'author': author,
+        'category': _text(row, 'category', 100),
+        'language': _text(row, 'language', 100),
+        'isbn': _isbn(row),
+        'quantity': quantity,
+        'price': price,
+        'description': _text(row, 'description'),
+    }
+
+
+class CatalogImporter:
+    def __init__(self, added_by, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+        self.added_by = added_by
+        self.chunk_size = chunk_size
+        self.progress = progress  # Called with the report after every chunk
+        self.authors = {}
+        self.categories = {}
+        self.languages = {}
+
+    def run(self, rows):
+        report = ImportReport()
+        rows = iter(rows)
+        while report.file_error is None:
+            chunk = []
+            try:
+                for item in islice(rows, self.chunk_size):
+                    chunk.append(item)
+            except FeedError as exc:
+                report.file_error = str(exc)  # Still write the rows read before it
+            if not chunk:
+                break
+            self._import_chunk(chunk, report)
+            report.elapsed = time.monotonic() - report.started
+            if self.progress:
+                self.progress(report)
+        # Bulk inserts bypass model signals, so refresh the derived data once
+        refresh_book_access()
+        report.elapsed = time.monotonic() - report.started
+        return report
+
+    def _resolve(self, model, cache, names):
+        """Map names to ids, creating the ones that do not exist yet. Returns the new ids."""
+        missing = {name for name in names if name and name not in cache}
+        if not missing:
+            return []
+        for name, pk in model.objects.filter(name__in=missing).order_by('-pk').values_list('name', 'pk'):
+            cache[name] = pk  # Lowest pk wins when names are duplicated
+        to_create = [name for name in missing if name not in cache]
+        if not to_create:
+            return []
+        model.objects.bulk_create([model(name=name) for name in to_create], ignore_conflicts=True)
+        for name, pk in model.objects.filter(name__in=to_create).order_by('-pk').values_list('name', 'pk'):
+            cache[name] = pk
+        return [cache[name] for name in to_create]
+
+    def _resolve_isbns(self, numbers):
+        numbers = {number for number in numbers if number}
+        if not numbers:
+            return {}
+        ISBN.objects.bulk_create([ISBN(isbn_number=number) for number in numbers], ignore_conflicts=True)
+        return dict(ISBN.objects.filter(isbn_number__in=numbers).values_list('isbn_number', 'pk'))
+
+    @transaction.atomic
+    def _import_chunk(self, chunk, report):
+        cleaned = {}
+        for line, row in chunk:
+            report.rows += 1
+            if isinstance(row, Exception):
+                report.add_error(line, str(row))
+                continue
+            try:
+                data = clean_row(row)
+            except ValueError as exc:
+                report.add_error(line, str(exc))
+                continue
+            key = (data['title'], data['author'])
+            if key in cleaned:
+                report.duplicates += 1
+                continue
+            cleaned[key] = data
+        if not cleaned:
+            return
+
+        rows = list(cleaned.values())
+        new_authors = self._resolve(Author, self.authors, (row['author'] for row in rows))
+        new_categories = self._resolve(Category, self.categories, (row['category'] for row in rows))
+        self._resolve(Language, self.languages, (row['language'] for row in rows))
+        isbns = self._resolve_isbns(row['isbn'] for row in rows)
+
+        author_ids = {self.authors[row['author']] for row in rows}
+        matching = Book.objects.filter(author_id__in=author_ids, title__in={row['title'] for row in rows})
+        existing_rows = list(matching.values_list('title', 'author_id'))
+        existing = set(existing_rows)
+        books = []
+        for row in rows:
+            author_id = self.authors[row['author']]
+            if (row['title'], author_id) in existing:
+                report.duplicates += 1
+                continue
+            books.append(Book(
+                title=row['title'],
+                author_id=author_id,
+                category_id=self.categories.get(row['category']),
+                language_id=self.languages.get(row['language']),
+                isbn_id=isbns.get(row['isbn']),
+                quantity=row['quantity'],
+                price=row['price'],
+                description=row['description'],
+                added_by=self.added_by,
+            ))
+        # ignore_conflicts covers books inserted concurrently since the check above,
+        # so count what was written rather than what was sent
+        Book.objects.bulk_create(books, ignore_conflicts=True)
+        created = matching.count() - len(existing_rows)
+        report.created += created
+        report.duplicates += len(books) - created
+        counters.reconcile(
+            authors={book.author_id for book in books},
+            categories={book.category_id for book in books} - {None},
+            languages={book.language_id for book in books} - {None},
+        )
+
+        # Bulk inserts bypass the model signals that keep the search index and caches fresh
+        caching.bump_on_commit('book', 'author', 'category', 'language')
+        new_books = Book.objects.filter(
+            author_id__in={book.author_id for book in books}, title__in={book.title for book in books}
+        )
+        transaction.on_commit(lambda: (
+            search.reindex('author', Author.objects.filter(pk__in=new_authors)),
+            search.reindex('category', Category.objects.filter(pk__in=new_categories)),
+            search.reindex('book', search.source_queryset('book').filter(pk__in=new_books)),
+        ))
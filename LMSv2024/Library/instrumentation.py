@@ -0,0 +1,160 @@
+"""
+Per-view request metrics, exported in the Prometheus text format.
+
+``InstrumentationMiddleware`` (middleware.py) fills one ``RequestStats`` per
+request and hands it to ``METRICS.observe()``; the ``metrics`` view renders the
+totals. Numbers are kept per process, so with several workers each one is
+scraped separately (or behind a multiprocess-aware proxy).
+"""
+import contextvars
+import threading
+import time
+from collections import defaultdict
+
+from django.template import base as template_base
+
+from . import caching
+
+# Upper bounds, in seconds, of the request duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current = contextvars.ContextVar('library_request_stats', default=None)
+
+
+class RequestStats:
+    def __init__(self):
+        self.view = None
+        self.wall = 0.0
+        self.db_time = 0.0
+        self.queries = 0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        self._caching_token = caching.request_counters.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        caching.request_counters.reset(self._caching_token)
+        _current.reset(self._token)
+
+    # caching.record() calls this for the request being served
+    def record_cache(self, hit):
+        if hit:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+
+
+class ViewMetrics:
+    def __init__(self):
+        self.requests = defaultdict(int)  # (method, status) -> count
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.count = 0
+        self.wall = 0.0
+        self.db_time = 0.0
+        self.queries = 0
+        self.template_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = defaultdict(ViewMetrics)
+
+    def observe(self, stats, method, status):
+        with self._lock:
+            metrics = self._views[stats.view or 'unresolved']
+            metrics.requests[(method, str(status))] += 1
+            metrics.count += 1
+            metrics.wall += stats.wall
+            metrics.db_time += stats.db_time
+            metrics.queries += stats.queries
+            metrics.template_time += stats.template_time
+            metrics.cache_hits += stats.cache_hits
+            metrics.cache_misses += stats.cache_misses
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if stats.wall <= bound:
+                    metrics.buckets[index] += 1
+                    break
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+    def render(self):
+        """The collected metrics in the Prometheus text exposition format."""
+        with self._lock:
+            views = sorted(self._views.items())
+            lines = [
+                '# HELP library_requests_total Requests served, by view, method and status.',
+                '# TYPE library_requests_total counter',
+            ]
+            for view, metrics in views:
+                for (method, status), count in sorted(metrics.requests.items()):
+                    lines.append(
+                        f'library_requests_total{{view="{view}",method="{method}",status="{status}"}} {count}'
+                    )
+
+            lines += [
+                '# HELP library_request_duration_seconds Wall time per request.',
+                '# TYPE library_request_duration_seconds histogram',
+            ]
+            for view, metrics in views:
+                cumulative = 0
+                for bound, count in zip(DURATION_BUCKETS, metrics.buckets):
+                    cumulative += count
+                    lines.append(f'library_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+                lines.append(f'library_request_duration_seconds_bucket{{view="{view}",le="+Inf"}} {metrics.count}')
+                lines.append(f'library_request_duration_seconds_sum{{view="{view}"}} {metrics.wall:.6f}')
+                lines.append(f'library_request_duration_seconds_count{{view="{view}"}} {metrics.count}')
+
+            for name, help_text, attribute, fmt in (
+                ('library_db_seconds_total', 'Time spent in database queries.', 'db_time', '.6f'),
+                ('library_db_queries_total', 'Database queries run.', 'queries', 'd'),
+                ('library_template_seconds_total', 'Time spent rendering templates.', 'template_time', '.6f'),
+                ('library_cache_hits_total', 'Response and fragment cache hits.', 'cache_hits', 'd'),
+                ('library_cache_misses_total', 'Response and fragment cache misses.', 'cache_misses', 'd'),
+            ):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+                for view, metrics in views:
+                    lines.append(f'{name}{{view="{view}"}} {getattr(metrics, attribute):{fmt}}')
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+
+
+### ---------- Template render timing ---------- ###
+
+# What Template._render was when timing was installed, which may itself be
+# a wrapper (the test runner's, for one)
+_wrapped_render = None
+
+
+def _timed_render(self, context):
+    stats = _current.get()
+    if stats is None:
+        return _wrapped_render(self, context)
+    # {% extends %} and {% include %} render nested templates; time only the outermost
+    stats.template_depth += 1
+    started = time.perf_counter()
+    try:
+        return _wrapped_render(self, context)
+    finally:
+        stats.template_depth -= 1
+        if not stats.template_depth:
+            stats.template_time += time.perf_counter() - started
+
+
+def install_template_timing():
+    """Time ``Template._render`` for instrumented requests. Idempotent."""
+    global _wrapped_render
+    if _wrapped_render is None:
+        _wrapped_render = template_base.Template._render
+        template_base.Template._render = _timed_render
@@ -0,0 +1,76 @@
+"""
+Stock keeping for ``Book.quantity``.
+
+Copies are taken with a single conditional ``UPDATE ... SET quantity =
+quantity - n WHERE id = %s AND quantity >= n``: the database serialises
+concurrent writers on that row, and a writer that finds too few copies updates
+nothing instead of driving the count negative. The reservation and the Rent or
+Purchase row are written in one transaction, so a failure after reserving puts
+the copy back by rolling back. The rare deadlock or lock timeout the database
+reports anyway is retried with jittered backoff.
+
+Stock moves on every rental and purchase, so it has its own ``stock`` cache
+version (caching.py) rather than bumping ``book``: only what shows
+quantities (the librarian catalogue, the books API) depends on it, and
+pages and reports built from the rest of the book rows stay cached.
+"""
+import functools
+import logging
+import random
+import time
+
+from django.db import OperationalError, transaction
+from django.db.models import F
+
+from . import caching
+from .models import Book, Purchase, Rent
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+BACKOFF_SECONDS = 0.02
+
+
+class OutOfStock(Exception):
+    def __init__(self, book_id):
+        super().__init__(f"Book {book_id} has no copies left")
+        self.book_id = book_id
+
+
+def retry_on_conflict(func):
+    """Re-run ``func`` in a fresh transaction when the database reports a deadlock or lock timeout."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                with transaction.atomic():
+                    return func(*args, **kwargs)
+            except OperationalError:
+                # Retrying inside an outer transaction would replay on a broken connection
+                if attempt == MAX_ATTEMPTS or transaction.get_connection().in_atomic_block:
+                    raise
+                logger.warning("Inventory conflict in %s, retrying (attempt %d)", func.__name__, attempt)
+                time.sleep(BACKOFF_SECONDS * 2 ** attempt * random.random())
+    return wrapper
+
+
+def reserve(book_id, quantity=1):
+    """Take ``quantity`` copies off the shelf or raise OutOfStock. Call inside a transaction."""
+    updated = Book.objects.filter(pk=book_id, quantity__gte=quantity).update(quantity=F('quantity') - quantity)
+    if not updated:
+        raise OutOfStock(book_id)
+    caching.bump_on_commit('stock')
+
+
+@retry_on_conflict
+def rent(user, book, payment=None):
+    reserve(book.pk)
+    return Rent.objects.create(user=user, book=book, rental_fee=book.rent_price, payment=payment)
+
+
+@retry_on_conflict
+def purchase(user, book, delivery_address, payment=None):
+    reserve(book.pk)
+    return Purchase.objects.create(
+        user=user, book=book, delivery_address=delivery_address, purchase_price=book.price, payment=payment,
+    )
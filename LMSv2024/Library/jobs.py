@@ -0,0 +1,223 @@
+"""
+Write-behind job queue.
+
+Requests do their transactional insert and ``enqueue()`` the side effects that
+can wait: analytics rollups, payment receipts, book cover renditions
+(images.py) and the purge of soft-deleted rows (deletion.py). A job is a row in the ``Job`` table written in the
+caller's transaction, so a rolled back rent leaves no job behind and a
+committed one never loses its job, without any broker to run.
+The contended daily rollup counters are then updated by the workers rather
+than inside every checkout.
+
+``manage.py run_job_worker`` runs a pool of worker threads. Each claims a
+batch of due jobs (``SELECT ... FOR UPDATE SKIP LOCKED`` where the database
+has it, a conditional ``UPDATE`` on the status otherwise), runs every handler
+in one transaction with the deletion of its job row, and puts failed jobs
+back with exponential, jittered backoff. After ``LIBRARY_JOB_MAX_ATTEMPTS`` a
+job stays ``failed`` for inspection. Jobs whose worker died are taken back
+once their lease (``LIBRARY_JOB_LEASE`` seconds) runs out; the deletion only
+succeeds for the worker holding the current claim, so database effects happen
+exactly once. Emails are at least once: a crash after sending retries them.
+Jobs given a ``key`` are serialised: one with the same key already pending
+absorbs a new one, and none is claimed while another with its key is running.
+
+Batch code that writes with ``bulk_create`` (payments.record_payments,
+process_memberships) records its rollups itself: no signals fire and nothing
+waits on it.
+"""
+import logging
+import os
+import random
+import socket
+import threading
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import deletion, images, rollups
+from .models import Job, Payment
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 20
+MAX_ATTEMPTS = 5
+BACKOFF_SECONDS = 2
+MAX_BACKOFF_SECONDS = 60 * 60
+LEASE_SECONDS = 5 * 60
+POLL_SECONDS = 1.0
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """Register the decorated function as the handler of ``kind`` jobs; it gets the payload as keywords."""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, run_after=None, key='', **payload):
+    """
+    Queue a job in the current transaction, due now or at ``run_after``.
+    ``payload`` must be JSON-serialisable. With a ``key``, returns the job
+    already pending under it instead of queueing another.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"No handler for job {kind!r}")
+    if key:
+        pending = Job.objects.filter(key=key, status=Job.PENDING).first()
+        if pending is not None:
+            return pending
+    return Job.objects.create(kind=kind, key=key, payload=payload, run_after=run_after or timezone.now())
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+
+### ---------- Claiming and running ---------- ###
+
+def requeue_expired(now=None):
+    """Put back running jobs whose worker has held them past the lease. Returns how many."""
+    now = now or timezone.now()
+    lease = timedelta(seconds=getattr(settings, 'LIBRARY_JOB_LEASE', LEASE_SECONDS))
+    return Job.objects.filter(status=Job.RUNNING, locked_at__lt=now - lease).update(status=Job.PENDING, locked_by='')
+
+
+def claim(worker, limit=BATCH_SIZE):
+    """Mark up to ``limit`` due jobs as running under ``worker`` and return them."""
+    now = timezone.now()
+    with transaction.atomic():
+        running_keys = Job.objects.filter(status=Job.RUNNING).exclude(key='').values('key')
+        due = (Job.objects.filter(status=Job.PENDING, run_after__lte=now)
+               .exclude(key__in=running_keys).order_by('run_after', 'id'))
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        ids, keys = [], set()
+        for pk, key in due.values_list('id', 'key')[:limit]:
+            if key and key in keys:
+                continue  # Its twin in this batch runs first
+            keys.add(key)
+            ids.append(pk)
+        # The status condition keeps two workers from taking the same job where SKIP LOCKED is missing
+        Job.objects.filter(pk__in=ids, status=Job.PENDING).update(
+            status=Job.RUNNING, locked_by=worker, locked_at=now, attempts=F('attempts') + 1,
+        )
+    return list(Job.objects.filter(pk__in=ids, status=Job.RUNNING, locked_by=worker, locked_at=now).order_by('id'))
+
+
+def _backoff(attempts):
+    delay = min(BACKOFF_SECONDS * 2 ** attempts, MAX_BACKOFF_SECONDS)
+    return timedelta(seconds=delay * (0.5 + random.random() / 2))
+
+
+def run_job(job):
+    """Run one claimed job. Returns True on success, False on failure and None if the claim was lost."""
+    claimed = Job.objects.filter(pk=job.pk, status=Job.RUNNING, locked_by=job.locked_by, locked_at=job.locked_at)
+    try:
+        with transaction.atomic():
+            if not claimed.delete()[0]:
+                return None  # The lease ran out and another worker has the job
+            HANDLERS[job.kind](**job.payload)
+        return True
+    except Exception as error:
+        max_attempts = getattr(settings, 'LIBRARY_JOB_MAX_ATTEMPTS', MAX_ATTEMPTS)
+        if job.attempts >= max_attempts:
+            logger.exception("Job %s failed for good after %d attempts", job, job.attempts)
+            changes = {'status': Job.FAILED}
+        else:
+            logger.warning("Job %s failed (attempt %d), retrying: %s", job, job.attempts, error)
+            changes = {'status': Job.PENDING, 'run_after': timezone.now() + _backoff(job.attempts)}
+        claimed.update(locked_by='', last_error=f'{type(error).__name__}: {error}', **changes)
+        return False
+
+
+def run_pending(worker=None, limit=BATCH_SIZE):
+    """Claim and run one batch. Returns ``(succeeded, failed)``."""
+    worker = worker or worker_name()
+    requeue_expired()
+    results = [run_job(job) for job in claim(worker, limit)]
+    return results.count(True), results.count(False)
+
+
+def drain(limit=BATCH_SIZE):
+    """Run jobs until none are due. For tests and one-off runs."""
+    succeeded = failed = 0
+    while True:
+        done, errors = run_pending(limit=limit)
+        if not done and not errors:
+            return succeeded, failed
+        succeeded, failed = succeeded + done, failed + errors
+
+
+def work(workers=4, poll=POLL_SECONDS, stop=None, progress=None):
+    """
+    Run ``workers`` threads until ``stop`` (a ``threading.Event``) is set or
+    Ctrl-C, which lets every thread finish its batch. A thread sleeps ``poll``
+    seconds whenever it finds nothing to do.
+    """
+    stop = stop or threading.Event()
+
+    def loop():
+        worker = worker_name()
+        while not stop.is_set():
+            try:
+                succeeded, failed = run_pending(worker)
+            finally:
+                close_old_connections()
+            if progress and (succeeded or failed):
+                progress(worker, succeeded, failed)
+            if not succeeded and not failed:
+                stop.wait(poll)
+        connection.close()
+
+    threads = [threading.Thread(target=loop, name=f'library-jobs-{index}', daemon=True) for index in range(workers)]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+### ---------- Handlers ---------- ###
+
+@handler('record_rollups')
+def record_rollups(model, pk):
+    instance = apps.get_model('Library', model).objects.filter(pk=pk).first()
+    if instance is not None:  # Deleted since: reconcile_rollups settles it
+        rollups.record(rollups.entries_for(instance))
+
+
+@handler('send_receipt')
+def send_receipt(payment):
+    payment = Payment.objects.select_related('user').filter(pk=payment).first()
+    if payment is None or not payment.user.email:
+        return
+    send_mail(
+        f"Your {payment.payment_type.lower()} payment receipt",
+        f"Hello {payment.user.get_full_name() or payment.user.username},\n\n"
+        f"We received your {payment.payment_type.lower()} payment of {payment.amount} by {payment.payment_method} "
+        f"on {payment.payment_date:%d %b %Y}.\nReceipt number: {payment.pk}\n",
+        None,  # DEFAULT_FROM_EMAIL
+        [payment.user.email],
+    )
+
+
+@handler('render_book_image')
+def render_book_image(image_name):
+    images.process_book_image(image_name)
+
+
+@handler('purge')
+def purge(model, pk, run_date):
+    deletion.purge_step(model, pk, run_date)
@@ -0,0 +1,97 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from Library import synthetic
+from Library.models import Author, Book, IssuedBook, Payment, Purchase, Rent, UserMembership
+
+INDEXED_MODELS = (Author, Book, IssuedBook, Payment, Purchase, Rent, UserMembership)
+PAGE = 26  # One keyset page plus the look-ahead row
+
+
+def hot_queries(user_id, book_id):
+    """The filter and sort paths the indexes exist for, as (label, queryset)."""
+    return [
+        ('rent_list', Rent.objects.for_user(user_id).order_by('-start_date', '-id')[:PAGE]),
+        ('purchase_list', Purchase.objects.for_user(user_id).order_by('-purchase_date', '-id')[:PAGE]),
+        ('payment history', Payment.objects.filter(user_id=user_id).order_by('-payment_date')[:PAGE]),
+        ('current membership', UserMembership.objects.for_user(user_id).active()[:1]),
+        ('open loans of a book', IssuedBook.objects.filter(book_id=book_id, return_date__isnull=True)),
+        ('open loans of a user', IssuedBook.objects.filter(user_id=user_id, return_date__isnull=True)),
+        ('manage_books', Book.objects.for_catalog().order_by('category__name', 'title', 'id')[:PAGE]),
+        ('librarian_dashboard', Book.objects.for_catalog().order_by('title', 'id')[:PAGE]),
+        ('manage_authors', Author.objects.order_by('name', 'id')[:PAGE]),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database with synthetic data and compare query plans "
+        "and latencies of the hot filter/sort paths without and with the Library indexes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=20000)
+        parser.add_argument('--students', type=int, default=2000)
+        parser.add_argument('--activity', type=int, default=25, help="Rentals, purchases, payments and loans per student.")
+        parser.add_argument('--repeat', type=int, default=50, help="Timed runs per query.")
+        parser.add_argument('--plans', action='store_true', help="Print the query plans.")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.stdout.write("Seeding synthetic data...")
+            user_ids, book_ids = synthetic.generate(
+                books=options['books'], students=options['students'], activity=options['activity'],
+                log=lambda message: self.stdout.write(f"  {message}"),
+            )
+            rng = random.Random(1)
+            samples = [(rng.choice(user_ids), rng.choice(book_ids)) for _ in range(options['repeat'])]
+
+            self.set_indexes(enabled=False)
+            before = self.measure(samples, options['plans'], 'without indexes')
+            self.set_indexes(enabled=True)
+            after = self.measure(samples, options['plans'], 'with indexes')
+
+            self.stdout.write(f"\n{'query':<24}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+            for label in before:
+                speedup = before[label] / after[label] if after[label] else float('inf')
+                self.stdout.write(f"{label:<24}{before[label]:>12.3f}{after[label]:>12.3f}{speedup:>9.1f}x")
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def set_indexes(self, enabled):
+        with connection.schema_editor() as editor:
+            for model in INDEXED_MODELS:
+                for index in model._meta.indexes:
+                    if index.contains_expressions or (index.condition and not connection.features.supports_partial_indexes):
+                        continue
+                    if enabled:
+                        editor.add_index(model, index)
+                    else:
+                        editor.remove_index(model, index)
+        if connection.vendor in ('postgresql', 'sqlite'):
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    def measure(self, samples, show_plans, heading):
+        """Median latency per query in milliseconds."""
+        timings = {}
+        for user_id, book_id in samples:
+            for label, queryset in hot_queries(user_id, book_id):
+                started = time.perf_counter()
+                list(queryset)
+                timings.setdefault(label, []).append((time.perf_counter() - started) * 1000)
+        if show_plans:
+            self.stdout.write(self.style.MIGRATE_HEADING(f"\nPlans {heading}"))
+            user_id, book_id = samples[0]
+            for label, queryset in hot_queries(user_id, book_id):
+                self.stdout.write(self.style.MIGRATE_LABEL(label))
+                self.stdout.write(queryset.explain())
+        return {label: statistics.median(values) for label, values in timings.items()}
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from Library.recommendations import build_neighbours
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the \"readers also rented\" neighbours of every book from the rental, purchase and loan "
+        "history. Run nightly."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--neighbours', type=int, help="Neighbours kept per book.")
+        parser.add_argument('--basket', type=int, help="Latest books per reader that count.")
+        parser.add_argument('--min-support', type=int, help="Readers two books must share to be neighbours.")
+
+    def handle(self, *args, **options):
+        def progress(books):
+            self.stdout.write(f"Scored neighbours for {books} books, writing...")
+
+        rows = build_neighbours(
+            neighbours=options['neighbours'], basket=options['basket'], min_support=options['min_support'],
+            progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(f"Stored {rows} neighbours."))
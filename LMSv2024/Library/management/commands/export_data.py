@@ -0,0 +1,43 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Library import exports
+from Library.forms import ExportForm
+
+
+class Command(BaseCommand):
+    help = "Stream books, payments, rents, purchases or students to a CSV, JSON Lines or JSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(exports.EXPORTS))
+        parser.add_argument('--output', '-o', help="File to write, defaults to standard output.")
+        parser.add_argument('--format', choices=exports.FORMATS, default='csv')
+        parser.add_argument('--gzip', action='store_true', help="Compress the output with gzip.")
+        parser.add_argument('--q', help="Search query, as on the list screens.")
+        parser.add_argument('--since', help="First day (YYYY-MM-DD).")
+        parser.add_argument('--until', help="Last day (YYYY-MM-DD).")
+        parser.add_argument('--payment-type')
+        parser.add_argument('--payment-method')
+        parser.add_argument('--category')
+        parser.add_argument('--language')
+
+    def handle(self, *args, **options):
+        form = ExportForm({key: value for key, value in options.items() if value is not None})
+        if not form.is_valid():
+            raise CommandError(form.errors.as_text())
+        export = exports.EXPORTS[options['name']]
+        try:
+            pieces = exports.stream(export, options['format'], options['gzip'], **form.filters())
+        except exports.TooManyMatches as error:
+            raise CommandError(str(error))
+
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for piece in pieces:
+                output.write(piece)
+        finally:
+            if options['output']:
+                output.close()
+        if options['output']:
+            self.stderr.write(self.style.SUCCESS(f"Wrote {options['output']}."))
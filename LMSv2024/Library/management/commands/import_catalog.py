@@ -0,0 +1,46 @@
+import os
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from Library.importer import DEFAULT_CHUNK_SIZE, CatalogImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = "Import books, authors, categories, languages and ISBNs from a CSV or JSON Lines feed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Defaults to the file extension.")
+        parser.add_argument('--added-by', required=True, help="Username recorded as the librarian adding the books.")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if file_format not in ('csv', 'jsonl'):
+            raise CommandError("Cannot tell the feed format, pass --format csv or --format jsonl.")
+        try:
+            added_by = User.objects.get(username=options['added_by'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['added_by']!r}.")
+
+        def progress(report):
+            self.stdout.write(
+                f"{report.rows} rows, {report.created} created, {report.duplicates} duplicates, "
+                f"{report.error_count} errors ({report.rows_per_second:.0f} rows/s)"
+            )
+
+        importer = CatalogImporter(added_by, chunk_size=options['chunk_size'], progress=progress)
+        with open(path, encoding='utf-8', newline='') as stream:
+            report = importer.run(read_rows(stream, file_format))
+
+        for line, message in report.errors:
+            self.stderr.write(f"line {line}: {message}")
+        if report.file_error:
+            raise CommandError(f"{report.file_error}. Imported {report.created} books from the "
+                               f"{report.rows} rows before it.")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {report.created} books from {report.rows} rows in {report.elapsed:.1f}s "
+            f"({report.rows_per_second:.0f} rows/s)."
+        ))
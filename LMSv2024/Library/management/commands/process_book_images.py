@@ -0,0 +1,51 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from Library.images import UPLOAD_DIR, book_image_storage, content_hash, process_book_image
+from Library.models import Book
+
+
+class Command(BaseCommand):
+    help = (
+        "Move book covers to content-hash file names (merging duplicate uploads) "
+        "and render any missing renditions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep-originals',
+            action='store_true',
+            help="Do not delete the old files after moving them to their hashed names.",
+        )
+
+    def handle(self, *args, **options):
+        storage = book_image_storage()
+        names = list(
+            Book.objects.exclude(book_image='').exclude(book_image__isnull=True)
+            .values_list('book_image', flat=True).distinct()
+        )
+        moved = rendered = 0
+        for name in names:
+            if not storage.exists(name):
+                self.stderr.write(f"Missing file: {name}")
+                continue
+            with storage.open(name, 'rb') as image_file:
+                extension = os.path.splitext(name)[1].lower()
+                hashed_name = f"{UPLOAD_DIR}/{content_hash(image_file)}{extension}"
+                if hashed_name != name and not storage.exists(hashed_name):
+                    storage.save(hashed_name, image_file)
+
+            if hashed_name != name:
+                Book.objects.filter(book_image=name).update(book_image=hashed_name, book_image_renditions=[])
+                if not options['keep_originals']:
+                    storage.delete(name)
+                moved += 1
+            try:
+                process_book_image(hashed_name)
+            except (OSError, ValueError) as error:
+                self.stderr.write(f"Could not render {hashed_name}: {error}")
+                continue
+            rendered += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Renamed {moved} file(s), processed {rendered} image(s)."))
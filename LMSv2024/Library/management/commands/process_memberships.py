@@ -0,0 +1,32 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Library.batches import DEFAULT_CHUNK_SIZE
+from Library.memberships import process_memberships
+
+
+class Command(BaseCommand):
+    help = (
+        "Expire memberships that have ended and renew the auto-renewing ones in resumable chunks. "
+        "Run nightly; an interrupted run continues where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Process as of this day (YYYY-MM-DD), defaults to today.")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--restart', action='store_true', help="Ignore the saved checkpoint for the day.")
+
+    def handle(self, *args, **options):
+        try:
+            today = date.fromisoformat(options['date']) if options['date'] else date.today()
+        except ValueError:
+            raise CommandError(f"Invalid date {options['date']!r}, expected YYYY-MM-DD.")
+
+        def progress(checkpoint):
+            self.stdout.write(f"{checkpoint.job}: {checkpoint.processed} rows")
+
+        checkpoint = process_memberships(
+            today, chunk_size=options['chunk_size'], restart=options['restart'], progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(f"Memberships for {today}: {checkpoint.processed} rows done."))
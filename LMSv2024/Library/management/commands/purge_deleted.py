@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from Library import deletion, jobs
+from Library.models import BatchCheckpoint
+
+
+class Command(BaseCommand):
+    help = "Show the progress of purges of deleted authors, books and categories, and requeue any that stopped."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requeue', action='store_true', help="Queue a purge for deleted rows that have none.")
+
+    def handle(self, *args, **options):
+        for checkpoint in BatchCheckpoint.objects.filter(job__startswith='purge:', finished=False).order_by('run_date'):
+            self.stdout.write(str(checkpoint))
+
+        stalled = list(deletion.pending())
+        for obj in stalled:
+            self.stdout.write(f"No purge queued for {obj._meta.model_name} {obj.pk} ({obj})")
+        if options['requeue'] and stalled:
+            with transaction.atomic():
+                for obj in stalled:
+                    jobs.enqueue('purge', model=obj._meta.model_name, pk=obj.pk,
+                                 run_date=obj.deleted_at.date().isoformat())
+            self.stdout.write(self.style.SUCCESS(f"{len(stalled)} purges queued."))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from Library import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the catalog search index in bulk."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--kind',
+            action='append',
+            choices=sorted(search.SEARCH_FIELDS),
+            help="Index to rebuild (repeatable). Defaults to all of them.",
+        )
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        backend = search.get_backend()
+        kinds = options['kind'] or list(search.SEARCH_FIELDS)
+        self.stdout.write(f"Using {type(backend).__name__}")
+        for kind in kinds:
+            started = time.monotonic()
+            backend.rebuild(kind, chunk_size=options['chunk_size'])
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt '{kind}' index in {time.monotonic() - started:.2f}s"))
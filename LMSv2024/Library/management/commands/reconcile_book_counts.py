@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from Library import counters
+
+
+class Command(BaseCommand):
+    help = "Recompute the book counts of every author, category and language from the books and fix any drift."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            corrected = counters.reconcile()
+        self.stdout.write(self.style.SUCCESS(f"Book counts reconciled: {corrected} rows corrected."))
@@ -0,0 +1,34 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Library import rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the analytics rollups for a date range from the source tables and fix any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help="First day (YYYY-MM-DD), defaults to --days before --until.")
+        parser.add_argument('--until', help="Last day (YYYY-MM-DD), defaults to today.")
+        parser.add_argument('--days', type=int, default=7, help="Days to check when --since is not given.")
+        parser.add_argument('--all', action='store_true', help="Reconcile everything since the first activity.")
+        parser.add_argument('--window', type=int, default=rollups.RECONCILE_WINDOW, help="Days per transaction.")
+
+    def handle(self, *args, **options):
+        try:
+            until = date.fromisoformat(options['until']) if options['until'] else date.today()
+            if options['all']:
+                since = rollups.first_day()
+            elif options['since']:
+                since = date.fromisoformat(options['since'])
+            else:
+                since = until - timedelta(days=options['days'] - 1)
+        except ValueError as exc:
+            raise CommandError(f"Invalid date: {exc}")
+
+        def progress(day, corrected):
+            self.stdout.write(f"up to {day}: {corrected} rows corrected")
+
+        corrected = rollups.reconcile(since, until, window=options['window'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f"Reconciled {since} to {until}: {corrected} rows corrected."))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from Library.access import refresh_book_access
+from Library.models import BookAccess
+
+
+class Command(BaseCommand):
+    help = "Recompute the cheapest membership tier that unlocks each book."
+
+    def handle(self, *args, **options):
+        refresh_book_access()
+        self.stdout.write(self.style.SUCCESS(f"Book access mapping refreshed ({BookAccess.objects.count()} books)."))
@@ -0,0 +1,158 @@
+import json
+import platform
+from datetime import datetime, timezone
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from Library import benchmarks, synthetic
+
+ISOLATED_SETTINGS = {
+    # Keep synthetic rows out of the real search index and caches
+    'LIBRARY_SEARCH_BACKEND': 'memory',
+    'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    'LIBRARY_CACHE_ALIAS': 'default',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database, drive the main views through the test client "
+        "and record latency percentiles, query counts and peak memory per view as JSON."
+    )
+
+    def add_arguments(self, parser):
+        volumes = parser.add_argument_group('data volumes')
+        volumes.add_argument('--authors', type=int)
+        volumes.add_argument('--books', type=int, default=5000)
+        volumes.add_argument('--users', type=int, default=500, help="Students.")
+        volumes.add_argument('--rents', type=int)
+        volumes.add_argument('--purchases', type=int)
+        volumes.add_argument('--payments', type=int)
+        volumes.add_argument('--activity', type=int, default=10,
+                             help="Default rents, purchases and payments per student.")
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--clients', type=int, default=50, help="Distinct logged-in students sending requests.")
+        parser.add_argument('--memory-samples', type=int, default=10)
+        parser.add_argument('--view', action='append', help="Only run these scenarios (repeatable).")
+        parser.add_argument('--async', action='store_true', dest='compare_async',
+                            help="Compare sync and async student views through ASGI instead of the request mix.")
+        parser.add_argument('--concurrency', type=int, default=50, help="Concurrent connections for --async.")
+        parser.add_argument('--payment-recording', action='store_true',
+                            help="Compare row-by-row and batch payment recording instead of the request mix.")
+        parser.add_argument('--label', default='', help="Free text stored with the results, e.g. a commit id.")
+        parser.add_argument('--output', help="Write the results to this JSON file.")
+        parser.add_argument('--compare', help="A previous results file to diff against.")
+
+    def handle(self, *args, **options):
+        scenarios = benchmarks.SCENARIOS
+        if options['view']:
+            scenarios = [scenario for scenario in scenarios if scenario.name in options['view']]
+            if not scenarios:
+                raise CommandError(f"Unknown scenario. Choose from: {', '.join(s.name for s in benchmarks.SCENARIOS)}")
+        previous = None
+        if options['compare']:
+            with open(options['compare']) as results_file:
+                previous = json.load(results_file)['views']
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(**ISOLATED_SETTINGS):
+                results = self.run(options, scenarios)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if 'views' in results:
+            self.print_table(results['views'])
+        if 'async_comparison' in results:
+            self.print_async_table(results['async_comparison'])
+        if 'payment_recording' in results:
+            self.print_payment_table(results['payment_recording'])
+        if options['output']:
+            with open(options['output'], 'w') as results_file:
+                json.dump(results, results_file, indent=2, sort_keys=True)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+        if previous is not None and 'views' in results:
+            self.print_comparison(previous, results['views'])
+
+    def run(self, options, scenarios):
+        def log(message):
+            self.stdout.write(f"  {message}")
+
+        self.stdout.write("Seeding synthetic data...")
+        volumes = {key: options[key] for key in ('authors', 'books', 'rents', 'purchases', 'payments', 'activity')}
+        student_ids, _ = synthetic.generate(
+            students=options['users'], log=log, **volumes,
+        )
+        librarians = list(User.objects.filter(groups__name='Librarian'))
+        students = list(User.objects.filter(pk__in=student_ids[:options['clients']]))
+
+        if options['payment_recording']:
+            self.stdout.write(f"Recording {options['requests']} payments...")
+            measured = {'payment_recording': benchmarks.compare_payment_recording(
+                students, count=options['requests'], log=log,
+            )}
+        elif options['compare_async']:
+            self.stdout.write(f"Comparing sync and async views with {options['concurrency']} connections...")
+            measured = {'async_comparison': benchmarks.compare_sync_async(
+                students, requests=options['requests'], concurrency=options['concurrency'], log=log,
+            )}
+        else:
+            self.stdout.write(f"Running {options['requests']} requests...")
+            measured = {'views': benchmarks.run(
+                librarians, students, requests=options['requests'], memory_samples=options['memory_samples'],
+                scenarios=scenarios, log=log,
+            )}
+        return {
+            **measured,
+            'meta': {
+                'label': options['label'],
+                'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'database': connection.vendor,
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'volumes': dict(volumes, users=options['users']),
+                'requests': options['requests'],
+                'concurrency': options['concurrency'] if options['compare_async'] else 1,
+            },
+        }
+
+    def print_table(self, views):
+        self.stdout.write(
+            f"\n{'view':<22}{'n':>6}{'err':>5}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'peak KB':>10}"
+        )
+        for name, row in views.items():
+            self.stdout.write(
+                f"{name:<22}{row['requests']:>6}{row['errors']:>5}{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}"
+                f"{row['p99_ms']:>9.2f}{row['mean_queries']:>9.1f}{row['peak_memory_kb']:>10.1f}"
+            )
+
+    def print_async_table(self, comparison):
+        self.stdout.write(f"\n{'view':<20}{'mode':<7}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'err':>5}")
+        for name, modes in comparison.items():
+            for mode, row in modes.items():
+                self.stdout.write(
+                    f"{name:<20}{mode:<7}{row['throughput_rps']:>9.1f}{row['p50_ms']:>9.2f}"
+                    f"{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}{row['errors']:>5}"
+                )
+
+    def print_payment_table(self, recording):
+        self.stdout.write(f"\n{'mode':<8}{'entries':>9}{'created':>9}{'per s':>10}{'queries':>9}")
+        for mode, row in recording.items():
+            self.stdout.write(
+                f"{mode:<8}{row['entries']:>9}{row['created']:>9}{row['payments_per_second']:>10.1f}"
+                f"{row['queries_per_payment']:>9.3f}"
+            )
+
+    def print_comparison(self, previous, views):
+        self.stdout.write(f"\n{'view':<22}{'metric':<16}{'before':>10}{'after':>10}{'change':>9}")
+        for view, metric, old, new, change in benchmarks.compare(previous, views):
+            line = f"{view:<22}{metric:<16}{old:>10.2f}{new:>10.2f}{change:>+8.1f}%"
+            if change > 10:
+                line = self.style.WARNING(line)
+            self.stdout.write(line)
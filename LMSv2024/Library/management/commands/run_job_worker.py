@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from Library import jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the write-behind job workers (rollups, receipts) until interrupted. "
+        "Start as many processes as needed; they share the queue safely."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help="Worker threads in this process.")
+        parser.add_argument('--poll', type=float, default=jobs.POLL_SECONDS,
+                            help="Seconds an idle worker waits before looking again.")
+        parser.add_argument('--once', action='store_true', help="Run every due job, then exit.")
+
+    def handle(self, *args, **options):
+        if options['once']:
+            succeeded, failed = jobs.drain()
+            self.stdout.write(self.style.SUCCESS(f"{succeeded} jobs done, {failed} failed."))
+            return
+
+        def progress(worker, succeeded, failed):
+            self.stdout.write(f"{worker}: {succeeded} done, {failed} failed")
+
+        self.stdout.write(f"Running {options['workers']} workers, Ctrl-C to stop.")
+        jobs.work(options['workers'], options['poll'], progress=progress)
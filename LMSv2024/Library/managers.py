@@ -0,0 +1,67 @@
+from datetime import date
+
+from django.db import models
+
+
+class LiveManager(models.Manager):
+    """Leaves soft-deleted rows out (see deletion.py); ``all_objects`` still has them."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+# Each method returns rows already joined and trimmed to the columns its screen
+# renders, so templates never trigger a query per row.
+
+class BookQuerySet(models.QuerySet):
+    def for_catalog(self):
+        """Rows for the librarian book table (manage_books)."""
+        return self.select_related('author', 'category').only(
+            'id', 'title', 'price', 'quantity', 'book_image', 'book_image_renditions',
+            'author__name', 'category__name',
+        )
+
+    def for_browsing(self):
+        """Rows for the student book cards (available_books, student_dashboard)."""
+        return self.select_related('author').only(
+            'id', 'title', 'price', 'description', 'book_image', 'book_image_renditions', 'author__name',
+        )
+
+
+class IssuedBookQuerySet(models.QuerySet):
+    def with_related(self):
+        return self.select_related('book', 'user').only(
+            'id', 'issue_date', 'return_date', 'book__title', 'user__username',
+        )
+
+
+class RentQuerySet(models.QuerySet):
+    def for_user(self, user):
+        """A student's rentals with the book title joined in (rent_list)."""
+        return self.filter(user=user).select_related('book').only(
+            'id', 'start_date', 'end_date', 'rental_fee', 'book__title',
+        )
+
+
+class PurchaseQuerySet(models.QuerySet):
+    def for_user(self, user):
+        """A student's purchases with the book title joined in (purchase_list)."""
+        return self.filter(user=user).select_related('book').only(
+            'id', 'purchase_date', 'purchase_price', 'book__title',
+        )
+
+
+class UserMembershipQuerySet(models.QuerySet):
+    def with_membership(self):
+        return self.select_related('membership')
+
+    def for_user(self, user):
+        """Newest membership first."""
+        return self.filter(user=user).with_membership().order_by('-start_date', '-id')
+
+    def active(self, on=None):
+        """Memberships in force on ``on`` (today); ``for_user(user).active().first()`` is the current one."""
+        on = on or date.today()
+        return self.filter(status='active', start_date__lte=on).filter(
+            models.Q(end_date__isnull=True) | models.Q(end_date__gte=on)
+        )
@@ -0,0 +1,148 @@
+"""
+Membership lifecycle.
+
+A student has at most one ``active`` membership: ``subscribe`` cancels the
+current one when another plan is bought. ``process_memberships`` (run nightly
+with ``manage.py process_memberships``) expires every active membership whose
+``end_date`` has passed and, where ``auto_renew`` is set, charges the plan
+price again and starts the next period. It works through the expired rows in
+resumable chunks (batches.py) with one UPDATE and two bulk inserts per chunk;
+renewal payments are keyed by the membership they renew (payments.py), so a
+rerun never charges a renewal twice.
+
+``current_membership`` serves the membership in force from the cache, so the
+student pages do not look it up on every request. Entries are dropped when the
+user's memberships or their plan change (see signals.py) and never outlive the
+last day of the membership.
+"""
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from . import caching, payments, rollups
+from .batches import DEFAULT_CHUNK_SIZE, run_batch
+from .models import MEMBERSHIP_PERIOD, UserMembership
+
+MEMBERSHIP_CACHE_TIMEOUT = 60 * 60
+JOB = 'process_memberships'
+
+_NO_MEMBERSHIP = 'none'  # Cached in place of None, which reads as a miss
+_UNSET = object()
+
+
+def _cache_key(user_id):
+    return f'library:membership:{user_id}'
+
+
+def _timeout(membership):
+    timeout = getattr(settings, 'LIBRARY_MEMBERSHIP_CACHE_TIMEOUT', MEMBERSHIP_CACHE_TIMEOUT)
+    if membership is None or membership.end_date is None:
+        return timeout
+    ends = datetime.combine(membership.end_date + timedelta(days=1), time.min)
+    return max(min(timeout, int((ends - datetime.now()).total_seconds())), 1)
+
+
+def current_membership(user):
+    """The user's membership in force today (with its plan), or None."""
+    if not user.is_authenticated:
+        return None
+    membership = getattr(user, '_library_membership', _UNSET)
+    if membership is _UNSET:
+        key = _cache_key(user.pk)
+        membership = cache.get(key)
+        if membership is None:
+            membership = UserMembership.objects.for_user(user).active().first()
+            cache.set(key, membership or _NO_MEMBERSHIP, _timeout(membership))
+        elif membership == _NO_MEMBERSHIP:
+            membership = None
+        # Per-request memo, as in roles.py
+        user._library_membership = membership
+    return membership
+
+
+def invalidate_memberships(user_ids):
+    cache.delete_many([_cache_key(user_id) for user_id in user_ids])
+
+
+@transaction.atomic
+def subscribe(user, membership, payment_method, auto_renew=False, idempotency_key=None):
+    """
+    Charge for ``membership`` and make it the user's current one, starting today.
+    A replayed ``idempotency_key`` returns the membership bought the first time.
+    """
+    today = date.today()
+
+    def start(payment):
+        UserMembership.objects.filter(user=user, status=UserMembership.ACTIVE).update(
+            status=UserMembership.CANCELLED, end_date=today,
+        )
+        # The create() below fires the signals that invalidate the cached membership
+        UserMembership.objects.create(
+            user=user,
+            membership=membership,
+            start_date=today,
+            end_date=today + MEMBERSHIP_PERIOD,
+            auto_renew=auto_renew,
+            payment=payment,
+        )
+
+    payment, _ = payments.charge(
+        user, membership.price_per_month, 'Membership', payment_method, idempotency_key, fulfil=start,
+    )
+    return UserMembership.objects.filter(payment=payment).first()
+
+
+def process_memberships(today, chunk_size=DEFAULT_CHUNK_SIZE, restart=False, progress=None):
+    """Expire the memberships that ended before ``today`` and renew the auto-renewing ones."""
+    def process(rows):
+        # Lock the chunk and skip rows changed since they were read
+        still_active = set(
+            UserMembership.objects.select_for_update()
+            .filter(pk__in=[row['id'] for row in rows], status=UserMembership.ACTIVE)
+            .values_list('id', flat=True)
+        )
+        rows = [row for row in rows if row['id'] in still_active]
+        if not rows:
+            return
+        UserMembership.objects.filter(pk__in=still_active).update(status=UserMembership.EXPIRED)
+
+        # Keyed by the expiring membership, so a renewal is never charged twice
+        renewing = {f"renewal:{row['id']}": row for row in rows if row['auto_renew']}
+        charged = payments.record_payments([
+            {
+                'user_id': row['user_id'],
+                'amount': row['membership__price_per_month'],
+                'payment_type': 'Membership',
+                'payment_method': row['payment__payment_method'] or 'Card',
+                'idempotency_key': key,
+            }
+            for key, row in renewing.items()
+        ], chunk_size=chunk_size)
+        renewed = set(
+            UserMembership.objects.filter(payment__idempotency_key__in=renewing).values_list('payment_id', flat=True)
+        )
+        renewals = UserMembership.objects.bulk_create([
+            UserMembership(
+                user_id=row['user_id'],
+                membership_id=row['membership_id'],
+                start_date=today,
+                end_date=today + MEMBERSHIP_PERIOD,
+                auto_renew=True,
+                payment=charged.payments[key],
+            )
+            for key, row in renewing.items() if charged.payments[key].pk not in renewed
+        ])
+        rollups.record_instances(renewals)  # bulk_create sends no post_save
+
+        user_ids = {row['user_id'] for row in rows}
+        transaction.on_commit(lambda: invalidate_memberships(user_ids))
+        caching.bump_on_commit('usermembership')
+
+    return run_batch(
+        JOB, today, UserMembership.objects.filter(status=UserMembership.ACTIVE, end_date__lt=today),
+        ('end_date', 'id'),
+        ('user_id', 'membership_id', 'auto_renew', 'membership__price_per_month', 'payment__payment_method'),
+        process, chunk_size=chunk_size, restart=restart, progress=progress,
+    )
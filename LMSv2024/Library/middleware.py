@@ -0,0 +1,228 @@
+"""
+Middleware for the Library app.
+
+Enable by adding to ``MIDDLEWARE`` in settings (after the auth middleware)::
+
+    'Library.middleware.QueryBudgetMiddleware',      # debug/test: query budgets
+    'Library.middleware.InstrumentationMiddleware',  # per-view metrics and profiling
+
+Both are hybrid middleware: under ASGI they run as coroutines, so an async
+view (async_views.py) is reached without running the middleware, and the rest
+of the chain, through a worker thread. Queries are counted by one wrapper on
+every connection (see ``QueryCounter``), so neither has to reach the thread
+the request's ORM calls run on.
+"""
+import contextvars
+import cProfile
+import logging
+import os
+import random
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+from .instrumentation import METRICS, RequestStats, install_template_timing
+
+logger = logging.getLogger(__name__)
+request_logger = logging.getLogger('Library.requests')
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(max_queries):
+    """
+    Declare how many database queries a view may run per request, including
+    the session and user lookups done by middleware.
+    """
+    def decorator(view_func):
+        view_func.query_budget = max_queries
+        return view_func
+    return decorator
+
+
+# Counters open in the current request. Context variables are copied into the
+# threads sync_to_async runs the request's ORM calls on, so one wrapper per
+# connection serves every thread and async request alike.
+_active_counters = contextvars.ContextVar('library_query_counters', default=())
+
+
+def _count_queries(execute, sql, params, many, context):
+    counters = _active_counters.get()
+    if not counters:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        for counter in counters:
+            counter.count += 1
+            counter.duration += elapsed
+
+
+def watch_connection(connection):
+    """Install the counting wrapper on ``connection``; signals.py does it for every new connection."""
+    if _count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_queries)
+
+
+class QueryCounter:
+    """Counts the queries run inside ``with QueryCounter() as counter:``, on any connection or thread."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __enter__(self):
+        for connection in connections.all(initialized_only=True):
+            watch_connection(connection)  # Opened before the signal receiver was connected
+        self._token = _active_counters.set(_active_counters.get() + (self,))
+        return self
+
+    def __exit__(self, *exc_info):
+        _active_counters.reset(self._token)
+
+
+class QueryBudgetMiddleware:
+    """
+    Count the queries each request runs and compare them to the view's budget.
+
+    Budgets come from ``@query_budget(n)`` on the view, or from the
+    ``LIBRARY_QUERY_BUDGETS`` setting keyed by URL name. Overruns raise
+    ``QueryBudgetExceeded`` (which fails the test that made the request) unless
+    ``LIBRARY_QUERY_BUDGET_STRICT`` is False, in which case they are logged.
+    """
+
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with QueryCounter() as counter:
+            response = self.get_response(request)
+        self._check(request, counter)
+        return response
+
+    async def __acall__(self, request):
+        with QueryCounter() as counter:
+            response = await self.get_response(request)
+        self._check(request, counter)
+        return response
+
+    def _check(self, request, counter):
+        budget = getattr(request, 'query_budget', None)
+        if budget is not None and counter.count > budget:
+            message = f"{request.path} ran {counter.count} queries, budget is {budget}"
+            if getattr(settings, 'LIBRARY_QUERY_BUDGET_STRICT', True):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        budget = getattr(view_func, 'query_budget', None)
+        if budget is None:
+            url_name = request.resolver_match.url_name if request.resolver_match else None
+            budget = getattr(settings, 'LIBRARY_QUERY_BUDGETS', {}).get(url_name)
+        request.query_budget = budget
+
+
+class InstrumentationMiddleware:
+    """
+    Record wall time, database time and query count, template render time and
+    cache hits for every request, per view. The totals are served in the
+    Prometheus text format by the ``metrics`` view.
+
+    Each request is logged to the ``Library.requests`` logger: at DEBUG
+    normally, at WARNING when it takes longer than ``LIBRARY_SLOW_REQUEST_MS``
+    (default 500). With ``LIBRARY_PROFILE_SAMPLE_RATE`` (0 to 1) and
+    ``LIBRARY_PROFILE_DIR`` set, that share of requests runs under cProfile and
+    is dumped to ``<dir>/<view>-<timestamp>.prof`` for ``python -m pstats`` or
+    snakeviz. Under ASGI cProfile only sees the event loop thread, so profiles
+    of async requests leave out the ORM work done in ``sync_to_async`` threads.
+    """
+
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        self.slow_seconds = getattr(settings, 'LIBRARY_SLOW_REQUEST_MS', 500) / 1000
+        self.sample_rate = getattr(settings, 'LIBRARY_PROFILE_SAMPLE_RATE', 0.0)
+        self.profile_dir = getattr(settings, 'LIBRARY_PROFILE_DIR', None)
+        install_template_timing()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profiler = self._start_profiler()
+        with RequestStats() as stats, QueryCounter() as counter:
+            started = time.perf_counter()
+            response = self.get_response(request)
+            stats.wall = time.perf_counter() - started
+        self._record(request, response, stats, counter, profiler)
+        return response
+
+    async def __acall__(self, request):
+        profiler = self._start_profiler()
+        with RequestStats() as stats, QueryCounter() as counter:
+            started = time.perf_counter()
+            response = await self.get_response(request)
+            stats.wall = time.perf_counter() - started
+        self._record(request, response, stats, counter, profiler)
+        return response
+
+    def _record(self, request, response, stats, counter, profiler):
+        match = request.resolver_match
+        stats.view = match.view_name if match else None
+        stats.queries = counter.count
+        stats.db_time = counter.duration
+        METRICS.observe(stats, request.method, response.status_code)
+        if profiler is not None:
+            self._dump_profile(profiler, stats.view)
+        self._log(request, response, stats)
+
+    def _start_profiler(self):
+        if not self.profile_dir or random.random() >= self.sample_rate:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # Another thread is already profiling
+            return None
+        return profiler
+
+    def _dump_profile(self, profiler, view):
+        profiler.disable()
+        os.makedirs(self.profile_dir, exist_ok=True)
+        name = f"{(view or 'unresolved').replace(':', '.')}-{time.time_ns()}.prof"
+        profiler.dump_stats(os.path.join(self.profile_dir, name))
+
+    def _log(self, request, response, stats):
+        level = logging.WARNING if stats.wall >= self.slow_seconds else logging.DEBUG
+        if not request_logger.isEnabledFor(level):
+            return
+        fields = {
+            'view': stats.view,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(stats.wall * 1000, 1),
+            'db_ms': round(stats.db_time * 1000, 1),
+            'queries': stats.queries,
+            'template_ms': round(stats.template_time * 1000, 1),
+            'cache_hits': stats.cache_hits,
+            'cache_misses': stats.cache_misses,
+        }
+        request_logger.log(
+            level, ' '.join(f'{key}=%s' for key in fields), *fields.values(), extra={'request_stats': fields},
+        )
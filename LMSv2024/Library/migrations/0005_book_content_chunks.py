@@ -0,0 +1,61 @@
+# Generated by Django 5.1.3 on 2026-10-18 08:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+CHUNK_CHARS = 16384
+
+
+def move_content_to_chunks(apps, schema_editor):
+    ISBN = apps.get_model('Library', 'ISBN')
+    BookContentChunk = apps.get_model('Library', 'BookContentChunk')
+    rows = ISBN.objects.exclude(book_content__isnull=True).exclude(book_content='')
+    for isbn in rows.only('id', 'book_content').iterator(chunk_size=50):
+        text = isbn.book_content
+        chunks = []
+        offset = 0
+        for index, start in enumerate(range(0, len(text), CHUNK_CHARS)):
+            piece = text[start:start + CHUNK_CHARS]
+            chunks.append(BookContentChunk(isbn_id=isbn.id, index=index, byte_offset=offset, text=piece))
+            offset += len(piece.encode('utf-8'))
+        BookContentChunk.objects.bulk_create(chunks, batch_size=100)
+        ISBN.objects.filter(id=isbn.id).update(content_length=offset, content_chunk_count=len(chunks))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Library', '0004_merge_20241209_2124'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='isbn',
+            name='content_chunk_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='isbn',
+            name='content_length',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='BookContentChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('byte_offset', models.PositiveBigIntegerField()),
+                ('text', models.TextField()),
+                ('isbn', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='content_chunks', to='Library.isbn')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['isbn', 'byte_offset'], name='Library_boo_isbn_id_d885ec_idx')],
+                'unique_together': {('isbn', 'index')},
+            },
+        ),
+        migrations.RunPython(move_content_to_chunks, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='isbn',
+            name='book_content',
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.3 on 2026-10-18 08:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_book_access(apps, schema_editor):
+    Book = apps.get_model('Library', 'Book')
+    BookAccess = apps.get_model('Library', 'BookAccess')
+    Membership = apps.get_model('Library', 'Membership')
+    ordered_ids = Book.objects.order_by('id').values_list('id', flat=True)
+    BookAccess.objects.bulk_create(
+        (BookAccess(book_id=book_id) for book_id in ordered_ids.iterator(chunk_size=1000)), batch_size=1000
+    )
+    total = Book.objects.count()
+    last_id = 0
+    for tier in Membership.objects.order_by('book_access_percentage', 'id'):
+        count = total * tier.book_access_percentage // 100
+        if not count:
+            continue
+        boundary_id = ordered_ids[min(count, total) - 1]
+        if boundary_id > last_id:
+            BookAccess.objects.filter(book_id__gt=last_id, book_id__lte=boundary_id).update(
+                membership=tier, min_access_percentage=tier.book_access_percentage
+            )
+            last_id = boundary_id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Library', '0005_book_content_chunks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookAccess',
+            fields=[
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='access', serialize=False, to='Library.book')),
+                ('min_access_percentage', models.PositiveIntegerField(blank=True, db_index=True, null=True)),
+                ('membership', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='Library.membership')),
+            ],
+        ),
+        migrations.RunPython(build_book_access, migrations.RunPython.noop),
+    ]
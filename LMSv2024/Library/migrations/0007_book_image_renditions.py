@@ -0,0 +1,24 @@
+# Generated by Django 5.1.3 on 2026-10-18 08:32
+
+import Library.images
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Library', '0006_bookaccess'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='book_image_renditions',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='book',
+            name='book_image',
+            field=models.ImageField(blank=True, null=True, storage=Library.images.book_image_storage, upload_to=Library.images.book_image_upload_to),
+        ),
+    ]
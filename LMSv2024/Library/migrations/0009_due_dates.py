@@ -0,0 +1,62 @@
+# Generated by Django 5.1.3 on 2026-10-18 08:51
+
+from datetime import date, timedelta
+
+import Library.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_due_dates(apps, schema_editor):
+    """
+    Derive the stored dates from the existing start/issue dates, one UPDATE per
+    distinct date. Rentals that already ended are marked expired without
+    returning a copy to the shelf: they were taken before stock was tracked.
+    """
+    IssuedBook = apps.get_model('Library', 'IssuedBook')
+    Rent = apps.get_model('Library', 'Rent')
+    for issue_date in IssuedBook.objects.values_list('issue_date', flat=True).distinct():
+        IssuedBook.objects.filter(issue_date=issue_date).update(due_date=issue_date + timedelta(days=14))
+    for start_date in Rent.objects.values_list('start_date', flat=True).distinct():
+        end_date = start_date + timedelta(days=30)
+        Rent.objects.filter(start_date=start_date).update(end_date=end_date, expired=end_date < date.today())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Library', '0008_hot_path_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='issuedbook',
+            name='due_date',
+            field=models.DateField(default=Library.models.loan_due_date),
+        ),
+        migrations.AddField(
+            model_name='issuedbook',
+            name='fine',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=8),
+        ),
+        migrations.AddField(
+            model_name='rent',
+            name='end_date',
+            field=models.DateField(default=Library.models.rental_end_date),
+        ),
+        migrations.AddField(
+            model_name='rent',
+            name='expired',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(backfill_due_dates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='issuedbook',
+            index=models.Index(fields=['due_date', 'id'], name='issuedbook_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rent',
+            index=models.Index(fields=['expired', 'end_date', 'id'], name='rent_expiry_idx'),
+        ),
+    ]
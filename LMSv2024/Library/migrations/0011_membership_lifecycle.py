@@ -0,0 +1,41 @@
+# Generated by Django 5.1.3 on 2026-10-18 08:54
+
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_status(apps, schema_editor):
+    """Give open-ended memberships the usual 30 days and expire the ones that ran out."""
+    UserMembership = apps.get_model('Library', 'UserMembership')
+    open_ended = UserMembership.objects.filter(end_date__isnull=True)
+    for start_date in open_ended.values_list('start_date', flat=True).distinct():
+        open_ended.filter(start_date=start_date).update(end_date=start_date + timedelta(days=30))
+    UserMembership.objects.filter(end_date__lt=date.today()).update(status='expired')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Library', '0010_batch_checkpoint'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usermembership',
+            name='auto_renew',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='usermembership',
+            name='status',
+            field=models.CharField(choices=[('active', 'Active'), ('expired', 'Expired'), ('cancelled', 'Cancelled')], default='active', max_length=10),
+        ),
+        migrations.RunPython(backfill_status, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='usermembership',
+            index=models.Index(fields=['status', 'end_date', 'id'], name='usermembership_expiry_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.3 on 2026-10-18 08:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Library', '0011_membership_lifecycle'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('revenue', 'Revenue'), ('rentals', 'Rentals'), ('purchases', 'Purchases'), ('category', 'Category'), ('membership', 'Membership')], max_length=20)),
+                ('day', models.DateField()),
+                ('key', models.CharField(max_length=64)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+            options={
+                'unique_together': {('dimension', 'day', 'key')},
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.3 on 2026-10-18 09:29
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_books(apps, schema_editor):
+    Book = apps.get_model('Library', 'Book')
+    for model_name, field in (('Author', 'author_id'), ('Category', 'category_id'), ('Language', 'language_id')):
+        books = Book.objects.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(n=Count('id'))
+        apps.get_model('Library', model_name).objects.update(book_count=Coalesce(Subquery(books.values('n')), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Library', '0015_book_neighbours'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='book_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='book_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='language',
+            name='book_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(fields=['-book_count', 'id'], name='author_book_count_idx'),
+        ),
+        migrations.RunPython(count_books, migrations.RunPython.noop),
+    ]
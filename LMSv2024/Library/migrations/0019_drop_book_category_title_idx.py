@@ -0,0 +1,17 @@
+# Generated by Django 5.1.3 on 2026-10-18 09:59
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Library', '0018_job_key'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='book',
+            name='book_category_title_idx',
+        ),
+    ]
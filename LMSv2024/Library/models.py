@@ -1,14 +1,44 @@
 from django.db import models
 from django.contrib.auth.models import User
 from datetime import date, timedelta
+from decimal import Decimal
 from django.utils import timezone
 
+from .images import book_image_storage, book_image_upload_to
+from .managers import BookQuerySet, LiveManager, IssuedBookQuerySet, PurchaseQuerySet, RentQuerySet, UserMembershipQuerySet
+
+RENT_FEE_RATE = Decimal('0.10')  # Rent costs 10% of the book price
+RENTAL_PERIOD = timedelta(days=30)
+LOAN_PERIOD = timedelta(days=14)
+MEMBERSHIP_PERIOD = timedelta(days=30)
+COUNTED_FIELDS = ('author_id', 'category_id', 'language_id')  # Book keys with a book_count (counters.py)
+
+
+def rental_end_date():
+    return date.today() + RENTAL_PERIOD
+
+
+def loan_due_date():
+    return date.today() + LOAN_PERIOD
+
+
 # Author model to store author details
 class Author(models.Model):
     name = models.CharField(max_length=200)
     biography = models.TextField(blank=True, null=True)
     date_of_birth = models.DateField(blank=True, null=True)
     date_of_death = models.DateField(blank=True, null=True)
+    book_count = models.IntegerField(default=0, editable=False)  # Kept by counters.py
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)  # Hidden until purged (deletion.py)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['name'], name='author_name_idx'),  # manage_authors ordering
+            models.Index(fields=['-book_count', 'id'], name='author_book_count_idx'),  # "Most books" ordering
+        ]
 
     def __str__(self):
         return self.name
@@ -18,6 +48,11 @@ class Author(models.Model):
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True, null=True)
+    book_count = models.IntegerField(default=0, editable=False)  # Kept by counters.py
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)  # Hidden until purged (deletion.py)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
 
     def __str__(self):
         return self.name
@@ -26,6 +61,7 @@ class Category(models.Model):
 # Language model to store available languages
 class Language(models.Model):
     name = models.CharField(max_length=100, unique=True)
+    book_count = models.IntegerField(default=0, editable=False)  # Kept by counters.py
 
     def __str__(self):
         return self.name
@@ -33,12 +69,29 @@ class Language(models.Model):
 
 class ISBN(models.Model):
     isbn_number = models.CharField(max_length=13, unique=True)
-    book_content = models.TextField(blank=True, null=True)  # New Field to store book content
+    # Book text lives in BookContentChunk rows (see content.py); these describe it
+    content_length = models.PositiveBigIntegerField(default=0)  # UTF-8 bytes
+    content_chunk_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.isbn_number
 
 
+# One page of a book's text, addressed by ISBN and position
+class BookContentChunk(models.Model):
+    isbn = models.ForeignKey(ISBN, on_delete=models.CASCADE, related_name='content_chunks')
+    index = models.PositiveIntegerField()
+    byte_offset = models.PositiveBigIntegerField()  # Offset of this chunk in the UTF-8 encoded text
+    text = models.TextField()
+
+    class Meta:
+        unique_together = ("isbn", "index")
+        indexes = [models.Index(fields=['isbn', 'byte_offset'])]
+
+    def __str__(self):
+        return f"{self.isbn} #{self.index}"
+
+
 # Book model to store book details
 class Book(models.Model):
     title = models.CharField(max_length=150)
@@ -47,15 +100,28 @@ class Book(models.Model):
     language = models.ForeignKey('Language', on_delete=models.SET_NULL, null=True, blank=True)
     isbn = models.ForeignKey('ISBN', on_delete=models.CASCADE, null=True, blank=True)  # New Field
     quantity = models.PositiveIntegerField(default=1)
-    book_image = models.ImageField(upload_to="Book_image", null=True, blank=True)
+    book_image = models.ImageField(upload_to=book_image_upload_to, storage=book_image_storage, null=True, blank=True)
+    book_image_renditions = models.JSONField(default=list, blank=True, editable=False)  # Widths rendered by images.py
     description = models.TextField(blank=True, null=True)
     price = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)  # New Field
     added_by = models.ForeignKey('auth.User', on_delete=models.CASCADE)
     add_time = models.TimeField(default=timezone.now)
     add_date = models.DateField(default=date.today)
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)  # Hidden until purged (deletion.py)
+
+    objects = LiveManager.from_queryset(BookQuerySet)()
+    all_objects = BookQuerySet.as_manager()
 
     class Meta:
         unique_together = ("title", "author")
+        indexes = [models.Index(fields=['title', 'id'], name='book_title_idx')]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        book = super().from_db(db, field_names, values)
+        # The keys this book is counted under, so saves only touch the counts that change
+        book._counted = {field: book.__dict__[field] for field in COUNTED_FIELDS if field in book.__dict__}
+        return book
 
     def save(self, *args, **kwargs):
         if not self.isbn:
@@ -64,6 +130,10 @@ class Book(models.Model):
             self.isbn = isbn_instance
         super().save(*args, **kwargs)
 
+    @property
+    def rent_price(self):
+        return (self.price * RENT_FEE_RATE).quantize(Decimal('0.01'))
+
     def __str__(self):
         return self.title
 
@@ -73,7 +143,19 @@ class IssuedBook(models.Model):
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     issue_date = models.DateField(default=date.today)
+    due_date = models.DateField(default=loan_due_date)
     return_date = models.DateField(blank=True, null=True)
+    fine = models.DecimalField(max_digits=8, decimal_places=2, default=0)  # Kept current by overdue.py
+
+    objects = IssuedBookQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Open loans only; partial indexes are skipped on MySQL, which uses the next one
+            models.Index(fields=['book', 'user'], condition=models.Q(return_date__isnull=True), name='issuedbook_open_idx'),
+            models.Index(fields=['user', 'return_date'], name='issuedbook_user_return_idx'),
+            models.Index(fields=['due_date', 'id'], name='issuedbook_due_idx'),  # Overdue scan in overdue.py
+        ]
 
     @property
     def is_returned(self):
@@ -101,6 +183,10 @@ class Payment(models.Model):
     payment_date = models.DateTimeField(auto_now_add=True)
     payment_type = models.CharField(max_length=20, choices=PAYMENT_TYPES)
     payment_method = models.CharField(max_length=20, choices=PAYMENT_METHOD, default='Card')  # Set a default value
+    idempotency_key = models.CharField(max_length=64, unique=True, null=True, blank=True)  # See payments.py
+
+    class Meta:
+        indexes = [models.Index(fields=['user', '-payment_date'], name='payment_user_date_idx')]
 
     def __str__(self):
         return f"{self.user.username} - {self.payment_type} - {self.amount} - {self.payment_method}"
@@ -123,13 +209,44 @@ class Membership(models.Model):
 
 
 
+# Cheapest membership tier that unlocks each book, maintained by access.py
+class BookAccess(models.Model):
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, primary_key=True, related_name='access')
+    membership = models.ForeignKey(Membership, on_delete=models.SET_NULL, null=True, blank=True)
+    # Copied from membership so lookups need no join; null when no tier unlocks the book
+    min_access_percentage = models.PositiveIntegerField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.book_id} - {self.membership or 'rent only'}"
+
+
+
 class UserMembership(models.Model):
+    ACTIVE = 'active'
+    EXPIRED = 'expired'
+    CANCELLED = 'cancelled'  # Replaced by another plan before it ended
+    STATUS_CHOICES = [
+        (ACTIVE, 'Active'),
+        (EXPIRED, 'Expired'),
+        (CANCELLED, 'Cancelled'),
+    ]
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     membership = models.ForeignKey(Membership, on_delete=models.CASCADE)
     start_date = models.DateField(default=date.today)
     end_date = models.DateField(blank=True, null=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=ACTIVE)
+    auto_renew = models.BooleanField(default=False)
     payment = models.ForeignKey('Payment', on_delete=models.SET_NULL, null=True, blank=True)
 
+    objects = UserMembershipQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-start_date', '-id'], name='usermembership_user_idx'),
+            models.Index(fields=['status', 'end_date', 'id'], name='usermembership_expiry_idx'),  # memberships.py
+        ]
+
     def __str__(self):
         return f"{self.user.username} - {self.membership.name} membership"
 
@@ -140,12 +257,18 @@ class Rent(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
     start_date = models.DateField(auto_now_add=True)
+    end_date = models.DateField(default=rental_end_date)
+    expired = models.BooleanField(default=False)  # Set by overdue.py once the copy is back on the shelf
     rental_fee = models.DecimalField(max_digits=6, decimal_places=2)
     payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True)  # Added foreign key to Payment
 
-    @property
-    def end_date(self):
-        return self.start_date + timedelta(days=30)
+    objects = RentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-start_date', '-id'], name='rent_user_start_idx'),  # rent_list
+            models.Index(fields=['expired', 'end_date', 'id'], name='rent_expiry_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} rented {self.book.title}"
@@ -160,5 +283,102 @@ class Purchase(models.Model):
     purchase_price = models.DecimalField(max_digits=6, decimal_places=2)
     payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True)  # Added foreign key to Payment
 
+    objects = PurchaseQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=['user', '-purchase_date', '-id'], name='purchase_user_date_idx')]  # purchase_list
+
     def __str__(self):
         return f"{self.user.username} purchased {self.book.title}"
+
+
+# Progress of a resumable batch job run (see batches.py)
+class BatchCheckpoint(models.Model):
+    job = models.CharField(max_length=100)
+    run_date = models.DateField()
+    cursor = models.CharField(max_length=255, blank=True)  # Keyset cursor of the last row processed
+    processed = models.PositiveBigIntegerField(default=0)
+    finished = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ("job", "run_date")
+
+    def __str__(self):
+        return f"{self.job} {self.run_date}: {self.processed} rows{' (finished)' if self.finished else ''}"
+
+
+# Pre-aggregated daily totals for the analytics dashboard (see rollups.py)
+class DailyRollup(models.Model):
+    REVENUE = 'revenue'        # key: "<payment_type>/<payment_method>"
+    RENTALS = 'rentals'        # key: book id
+    PURCHASES = 'purchases'    # key: book id
+    CATEGORY = 'category'      # key: category id, rentals and purchases together
+    MEMBERSHIP = 'membership'  # key: membership plan id, memberships started
+    DIMENSION_CHOICES = [
+        (REVENUE, 'Revenue'),
+        (RENTALS, 'Rentals'),
+        (PURCHASES, 'Purchases'),
+        (CATEGORY, 'Category'),
+        (MEMBERSHIP, 'Membership'),
+    ]
+
+    dimension = models.CharField(max_length=20, choices=DIMENSION_CHOICES)
+    day = models.DateField()
+    key = models.CharField(max_length=64)
+    count = models.PositiveIntegerField(default=0)
+    amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        # Also the index for the dashboard's per-dimension date range scans
+        unique_together = ("dimension", "day", "key")
+
+    def __str__(self):
+        return f"{self.dimension} {self.key} on {self.day}: {self.count} ({self.amount})"
+
+
+
+# Top neighbours of each book by co-rental, rebuilt offline (see recommendations.py)
+class BookNeighbour(models.Model):
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='neighbours')
+    neighbour = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='neighbour_of')
+    score = models.FloatField()  # Cosine similarity of the two books' readers
+
+    class Meta:
+        unique_together = ("book", "neighbour")
+
+    def __str__(self):
+        return f"{self.book_id} -> {self.neighbour_id} ({self.score:.3f})"
+
+
+# Durable queue of side effects handled outside the request (see jobs.py)
+class Job(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'  # Out of attempts, kept for inspection
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=50)
+    # Jobs sharing a key are queued once and never run at the same time
+    key = models.CharField(max_length=255, blank=True)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_due_idx'),
+            models.Index(fields=['key', 'status'], name='job_key_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status}, {self.attempts} attempts)"
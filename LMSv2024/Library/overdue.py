@@ -0,0 +1,80 @@
+"""
+Daily rental-expiry and overdue-loan processing.
+
+Both jobs find their rows with an indexed range scan on the stored due dates
+(``rent_expiry_idx``, ``issuedbook_due_idx``) and work through them with
+``batches.run_batch``: a fixed number of rows per transaction, resumable from
+the last committed chunk. Each chunk is a handful of set-based UPDATEs rather
+than a save() per row.
+
+Run them from cron with ``manage.py process_overdue``. Fines are charged per
+day overdue at ``LIBRARY_FINE_PER_DAY``, capped at ``LIBRARY_FINE_CAP``.
+"""
+from collections import Counter, defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Case, DecimalField, F, PositiveIntegerField, Value, When
+
+from . import caching
+from .batches import DEFAULT_CHUNK_SIZE, run_batch
+from .models import Book, IssuedBook, Rent
+
+FINE_PER_DAY = Decimal('0.50')
+FINE_CAP = Decimal('50.00')
+
+RENTAL_JOB = 'expire_rentals'
+LOAN_JOB = 'assess_fines'
+
+
+def fine_for(days_overdue):
+    per_day = Decimal(str(getattr(settings, 'LIBRARY_FINE_PER_DAY', FINE_PER_DAY)))
+    cap = Decimal(str(getattr(settings, 'LIBRARY_FINE_CAP', FINE_CAP)))
+    return min(per_day * max(days_overdue, 0), cap)
+
+
+def expire_rentals(today, chunk_size=DEFAULT_CHUNK_SIZE, restart=False, progress=None):
+    """Mark rentals that ended before ``today`` expired and put their copies back on the shelf."""
+    def process(rows):
+        # Lock the chunk and skip rows another run expired in the meantime
+        rents = list(
+            Rent.objects.select_for_update()
+            .filter(pk__in=[row['id'] for row in rows], expired=False)
+            .values_list('id', 'book_id')
+        )
+        if not rents:
+            return
+        Rent.objects.filter(pk__in=[rent_id for rent_id, _ in rents]).update(expired=True)
+        returned = Counter(book_id for _, book_id in rents)
+        Book.objects.filter(pk__in=returned).update(quantity=F('quantity') + Case(
+            *[When(pk=book_id, then=Value(count)) for book_id, count in returned.items()],
+            output_field=PositiveIntegerField(),
+        ))
+        caching.bump_on_commit('stock')
+
+    return run_batch(
+        RENTAL_JOB, today, Rent.objects.filter(expired=False, end_date__lt=today),
+        ('end_date', 'id'), ('book_id',), process, chunk_size=chunk_size, restart=restart, progress=progress,
+    )
+
+
+def assess_fines(today, chunk_size=DEFAULT_CHUNK_SIZE, restart=False, progress=None):
+    """Set the fine on every open loan that was due before ``today``."""
+    def process(rows):
+        by_due_date = defaultdict(list)
+        for row in rows:
+            by_due_date[row['due_date']].append(row['id'])
+        # One UPDATE per chunk; the fine only depends on the due date
+        IssuedBook.objects.filter(pk__in=[row['id'] for row in rows]).update(fine=Case(
+            *[When(due_date=due_date, then=Value(fine_for((today - due_date).days))) for due_date in by_due_date],
+            default=F('fine'),
+            output_field=DecimalField(max_digits=8, decimal_places=2),
+        ))
+
+    return run_batch(
+        LOAN_JOB, today, IssuedBook.objects.filter(return_date__isnull=True, due_date__lt=today),
+        ('due_date', 'id'), ('due_date',), process, chunk_size=chunk_size, restart=restart, progress=progress,
+    )
+
+
+JOBS = {'rentals': expire_rentals, 'loans': assess_fines}
@@ -0,0 +1,208 @@
+"""
+Keyset (cursor) pagination.
+
+Pages are selected with a ``WHERE (a, b, id) > (...)`` condition on the last row
+already shown instead of ``OFFSET``, so fetching page 1000 costs the same as page
+1. Orderings must end with a unique column (normally ``id``) to be stable.
+NULLs always sort first, whatever the database default is.
+"""
+import base64
+import json
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+
+DEFAULT_PAGE_SIZE = 25
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError) as exc:
+        raise InvalidCursor(token) from exc
+    if not isinstance(values, list):
+        raise InvalidCursor(token)
+    return values
+
+
+def _split(field):
+    return (field[1:], True) if field.startswith('-') else (field, False)
+
+
+def _resolve(obj, field):
+    """Read ``category__name``-style paths from a model instance or a dict row."""
+    if isinstance(obj, dict):
+        return obj[field]
+    value = obj
+    for part in field.split('__'):
+        try:
+            value = getattr(value, part)
+        except ObjectDoesNotExist:
+            return None
+        if value is None:
+            return None
+    return value
+
+
+def _after(field, descending, value):
+    """Rows strictly after ``value`` on one column of the ordering."""
+    if descending:
+        if value is None:
+            return None  # NULL is the smallest value, nothing sorts after it
+        return Q(**{f'{field}__lt': value}) | Q(**{f'{field}__isnull': True})
+    if value is None:
+        return Q(**{f'{field}__isnull': False})
+    return Q(**{f'{field}__gt': value})
+
+
+def _equal(field, value):
+    return Q(**{f'{field}__isnull': True}) if value is None else Q(**{field: value})
+
+
+def keyset_filter(ordering, values, reverse=False):
+    """``Q`` selecting rows after (or, with ``reverse``, before) the key ``values``."""
+    condition = Q(pk__in=[])
+    prefix = Q()
+    for field_spec, value in zip(ordering, values):
+        field, descending = _split(field_spec)
+        step = _after(field, descending != reverse, value)
+        if step is not None:
+            condition |= prefix & step
+        prefix &= _equal(field, value)
+    return condition
+
+
+def keyset_order(ordering, reverse=False):
+    order = []
+    for field_spec in ordering:
+        field, descending = _split(field_spec)
+        if descending != reverse:
+            order.append(F(field).desc(nulls_last=True))
+        else:
+            order.append(F(field).asc(nulls_first=True))
+    return order
+
+
+class KeysetPage:
+    def __init__(self, object_list, ordering, has_next, has_previous):
+        self.object_list = object_list
+        self.ordering = ordering
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_querystring = ''
+        self.previous_querystring = ''
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def _cursor(self, obj):
+        return encode_cursor([_resolve(obj, _split(f)[0]) for f in self.ordering])
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.object_list:
+            return self._cursor(self.object_list[-1])
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous and self.object_list:
+            return self._cursor(self.object_list[0])
+        return None
+
+
+class KeysetPaginator:
+    def __init__(self, queryset, ordering, per_page=None):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page or getattr(settings, 'LIBRARY_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+
+    def _query(self, after, before):
+        """The sliced queryset for a page, with ``per_page + 1`` rows to detect more."""
+        queryset = self.queryset
+        if before:
+            queryset = queryset.filter(keyset_filter(self.ordering, decode_cursor(before), reverse=True))
+            return queryset.order_by(*keyset_order(self.ordering, reverse=True))[:self.per_page + 1]
+        if after:
+            queryset = queryset.filter(keyset_filter(self.ordering, decode_cursor(after)))
+        return queryset.order_by(*keyset_order(self.ordering))[:self.per_page + 1]
+
+    def _page(self, rows, after, before):
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if before:
+            return KeysetPage(rows[::-1], self.ordering, has_next=True, has_previous=more)
+        return KeysetPage(rows, self.ordering, has_next=more, has_previous=bool(after))
+
+    def page(self, after=None, before=None):
+        """
+        Return the page following the ``after`` cursor, preceding the ``before``
+        cursor, or the first page when neither is given.
+        """
+        return self._page(list(self._query(after, before)), after, before)
+
+    async def apage(self, after=None, before=None):
+        """``page()`` for async views."""
+        return self._page([row async for row in self._query(after, before)], after, before)
+
+
+def _page_params(request, prefix):
+    return request.GET.get(f'{prefix}after'), request.GET.get(f'{prefix}before')
+
+
+def _add_querystrings(request, page, prefix):
+    after_param, before_param = f'{prefix}after', f'{prefix}before'
+    params = request.GET.copy()
+    params.pop(after_param, None)
+    params.pop(before_param, None)
+    if page.next_cursor:
+        params[after_param] = page.next_cursor
+        page.next_querystring = params.urlencode()
+        del params[after_param]
+    if page.previous_cursor:
+        params[before_param] = page.previous_cursor
+        page.previous_querystring = params.urlencode()
+    return page
+
+
+def paginate(request, queryset, ordering, per_page=None, prefix=''):
+    """
+    Page ``queryset`` from the ``after`` / ``before`` request parameters.
+
+    The page carries ready-made ``next_querystring`` / ``previous_querystring``
+    values that keep the other GET parameters (search query etc.). An invalid
+    cursor falls back to the first page.
+    """
+    paginator = KeysetPaginator(queryset, ordering, per_page)
+    after, before = _page_params(request, prefix)
+    try:
+        page = paginator.page(after=after, before=before)
+    except InvalidCursor:
+        page = paginator.page()
+    return _add_querystrings(request, page, prefix)
+
+
+async def apaginate(request, queryset, ordering, per_page=None, prefix=''):
+    """``paginate()`` for async views."""
+    paginator = KeysetPaginator(queryset, ordering, per_page)
+    after, before = _page_params(request, prefix)
+    try:
+        page = await paginator.apage(after=after, before=before)
+    except InvalidCursor:
+        page = await paginator.apage()
+    return _add_querystrings(request, page, prefix)
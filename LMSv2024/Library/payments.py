@@ -0,0 +1,165 @@
+"""
+Payment recording.
+
+Every charge goes through ``charge()``, which writes the ``Payment`` and what
+it pays for (the Rent, Purchase or UserMembership created by its ``fulfil``
+callback) in one transaction: there is never a payment without its purchase or
+the other way round.
+
+Forms carry an idempotency key generated when the page was rendered
+(``new_idempotency_key()``). A key that was already used returns the original
+payment instead of charging again, which absorbs double-submits and retries
+after a timeout. Keys are unique in the database, so of two concurrent submits
+one insert fails on the index and that request returns the winner's payment.
+
+``record_payments()`` is the batch entry point for reconciliation feeds: rows
+are inserted a chunk at a time with one ``bulk_create`` each, and rows whose key
+is already recorded are counted as duplicates rather than charged twice.
+"""
+import uuid
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+
+from . import inventory, rollups
+from .models import Payment
+
+PAYMENT_TYPES = [value for value, _ in Payment.PAYMENT_TYPES]
+PAYMENT_METHODS = [value for value, _ in Payment.PAYMENT_METHOD]
+DEFAULT_CHUNK_SIZE = 1000
+
+
+class IdempotencyConflict(ValueError):
+    """The key was already used for a different charge."""
+
+
+def new_idempotency_key():
+    return uuid.uuid4().hex
+
+
+def _validate(payment_type, payment_method):
+    if payment_type not in PAYMENT_TYPES:
+        raise ValueError(f"Invalid payment type {payment_type!r}. Valid types are {', '.join(PAYMENT_TYPES)}.")
+    if payment_method not in PAYMENT_METHODS:
+        raise ValueError(f"Invalid payment method {payment_method!r}. Valid methods are {', '.join(PAYMENT_METHODS)}.")
+
+
+def _replayed(idempotency_key, user_id, amount, payment_type, locking=False):
+    payments = Payment.objects.filter(idempotency_key=idempotency_key)
+    if locking:
+        # A locking read sees the latest committed row, not the snapshot of the
+        # caller's transaction (MySQL's REPEATABLE READ)
+        with transaction.atomic():
+            payment = payments.select_for_update().first()
+    else:
+        payment = payments.first()
+    if payment is not None and (
+        payment.user_id != user_id or payment.payment_type != payment_type or payment.amount != Decimal(amount)
+    ):
+        raise IdempotencyConflict(f"Idempotency key {idempotency_key!r} was used for another payment")
+    return payment
+
+
+def charge(user, amount, payment_type, payment_method='Card', idempotency_key=None, fulfil=None):
+    """
+    Record a payment and call ``fulfil(payment)`` in the same transaction.
+
+    Returns ``(payment, created)``; ``created`` is False when ``idempotency_key``
+    was seen before and the original payment is returned without charging.
+    """
+    _validate(payment_type, payment_method)
+    if idempotency_key:
+        payment = _replayed(idempotency_key, user.pk, amount, payment_type)
+        if payment is not None:
+            return payment, False
+    try:
+        with transaction.atomic():
+            payment = Payment.objects.create(
+                user=user,
+                amount=amount,
+                payment_type=payment_type,
+                payment_method=payment_method,
+                idempotency_key=idempotency_key or None,
+            )
+            if fulfil is not None:
+                fulfil(payment)
+    except IntegrityError:
+        # A concurrent request with the same key committed first
+        payment = _replayed(idempotency_key, user.pk, amount, payment_type, locking=True) if idempotency_key else None
+        if payment is None:
+            raise
+        return payment, False
+    return payment, True
+
+
+@inventory.retry_on_conflict
+def pay_rent(user, book, payment_method='Card', idempotency_key=None):
+    """Charge the rental fee and rent ``book``; raises ``inventory.OutOfStock``."""
+    return charge(
+        user, book.rent_price, 'Rent', payment_method, idempotency_key,
+        fulfil=lambda payment: inventory.rent(user, book, payment=payment),
+    )
+
+
+@inventory.retry_on_conflict
+def pay_purchase(user, book, delivery_address, payment_method='Card', idempotency_key=None):
+    """Charge the price and order ``book``; raises ``inventory.OutOfStock``."""
+    return charge(
+        user, book.price, 'Purchase', payment_method, idempotency_key,
+        fulfil=lambda payment: inventory.purchase(user, book, delivery_address, payment=payment),
+    )
+
+
+### ---------- Batches ---------- ###
+
+class BatchReport:
+    def __init__(self):
+        self.created = 0
+        self.duplicates = 0
+        self.payments = {}  # idempotency key -> Payment, new and already recorded
+
+
+def record_payments(entries, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Record ``entries`` (dicts with user_id, amount, payment_type, payment_method
+    and idempotency_key) in chunks. Keys already recorded are skipped. Returns a
+    ``BatchReport``.
+    """
+    report = BatchReport()
+    chunk = []
+    for entry in entries:
+        if not entry.get('idempotency_key'):
+            raise ValueError("Batch payments need an idempotency key")
+        _validate(entry['payment_type'], entry.get('payment_method', 'Card'))
+        chunk.append(entry)
+        if len(chunk) >= chunk_size:
+            _record_chunk(chunk, report)
+            chunk = []
+    if chunk:
+        _record_chunk(chunk, report)
+    return report
+
+
+@transaction.atomic
+def _record_chunk(entries, report):
+    entries = {entry['idempotency_key']: entry for entry in entries}  # Last one wins within a feed
+    recorded = set(Payment.objects.filter(idempotency_key__in=entries).values_list('idempotency_key', flat=True))
+    Payment.objects.bulk_create(
+        [
+            Payment(
+                user_id=entry['user_id'],
+                amount=entry['amount'],
+                payment_type=entry['payment_type'],
+                payment_method=entry.get('payment_method', 'Card'),
+                idempotency_key=key,
+            )
+            for key, entry in entries.items() if key not in recorded
+        ],
+        ignore_conflicts=True,  # Keys recorded concurrently since the lookup above
+    )
+    payments = {payment.idempotency_key: payment for payment in Payment.objects.filter(idempotency_key__in=entries)}
+    created = [payment for key, payment in payments.items() if key not in recorded]
+    rollups.record_instances(created)  # bulk_create sends no post_save
+    report.created += len(created)
+    report.duplicates += len(entries) - len(created)
+    report.payments.update(payments)
@@ -0,0 +1,128 @@
+"""
+"Readers also rented" recommendations.
+
+``build_neighbours()`` (``manage.py build_recommendations``, run nightly)
+reads every reader's rentals, purchases and loans as one basket of books, in a
+single ordered UNION streamed from the database, and counts how often each
+pair of books shares a basket. A pair scores by cosine similarity,
+``together / sqrt(readers of a * readers of b)``, and each book keeps its
+``LIBRARY_RECOMMENDATION_NEIGHBOURS`` best partners in ``BookNeighbour``.
+Pairs are counted under one integer key each with ``Counter.update``, which
+runs in C; the work grows with the square of the basket size, so only the
+latest ``LIBRARY_RECOMMENDATION_BASKET`` books of each reader count.
+
+``for_user()`` turns the table into a per-student strip with one query: the
+neighbours of everything the student has read, minus what they have read,
+summed per book and ranked.
+"""
+import heapq
+import math
+from collections import Counter, defaultdict
+from itertools import combinations, groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import DateField, Max, Q, Sum
+from django.db.models.functions import Cast
+
+from .models import Book, BookNeighbour, IssuedBook, Purchase, Rent
+
+NEIGHBOURS = 20  # Kept per book
+BASKET = 50  # Latest books per reader that count
+MIN_SUPPORT = 2  # Readers two books must share to be neighbours
+STRIP = 8  # Books recommended at a time
+CHUNK_SIZE = 5000
+BATCH_SIZE = 1000
+
+
+def _setting(name, default):
+    return getattr(settings, f'LIBRARY_RECOMMENDATION_{name}', default)
+
+
+### ---------- Offline build ---------- ###
+
+def _baskets(size):
+    """Sorted book ids of each reader's latest ``size`` distinct books."""
+    rents = Rent.objects.values_list('user_id', 'book_id', 'start_date')
+    # The day only orders the rows: a plain cast, not TruncDate's per-row time zone conversion
+    purchases = (
+        Purchase.objects.annotate(day=Cast('purchase_date', DateField())).values_list('user_id', 'book_id', 'day')
+    )
+    loans = IssuedBook.objects.values_list('user_id', 'book_id', 'issue_date')
+    history = rents.union(purchases, loans, all=True).order_by('user_id', '-start_date')
+    for _, rows in groupby(history.iterator(chunk_size=CHUNK_SIZE), key=itemgetter(0)):
+        basket = set()
+        for _, book_id, _ in rows:
+            basket.add(book_id)
+            if len(basket) == size:
+                break  # groupby skips the rest of this reader's rows
+        yield sorted(basket)
+
+
+def _neighbours(baskets, stride, keep, min_support):
+    """``{book id: [(score, neighbour id), ...]}`` with the ``keep`` best per book."""
+    readers, together = Counter(), Counter()
+    for basket in baskets:
+        readers.update(basket)
+        together.update(a * stride + b for a, b in combinations(basket, 2))
+
+    candidates = defaultdict(list)
+    for key, shared in together.items():
+        if shared < min_support:
+            continue
+        a, b = divmod(key, stride)
+        score = shared / math.sqrt(readers[a] * readers[b])
+        candidates[a].append((score, b))
+        candidates[b].append((score, a))
+    return {book_id: heapq.nlargest(keep, scored) for book_id, scored in candidates.items()}
+
+
+def build_neighbours(neighbours=None, basket=None, min_support=None, progress=None):
+    """Recompute ``BookNeighbour`` from the reading history. Returns the number of rows written."""
+    stride = (Book.objects.aggregate(top=Max('id'))['top'] or 0) + 1
+    scored = _neighbours(
+        _baskets(basket or _setting('BASKET', BASKET)),
+        stride,
+        neighbours or _setting('NEIGHBOURS', NEIGHBOURS),
+        min_support or _setting('MIN_SUPPORT', MIN_SUPPORT),
+    )
+    if progress:
+        progress(len(scored))
+
+    with transaction.atomic():
+        existing = set(Book.objects.filter(pk__in=scored).values_list('id', flat=True))  # Skip deleted books
+        BookNeighbour.objects.all().delete()
+        rows = BookNeighbour.objects.bulk_create(
+            [
+                BookNeighbour(book_id=book_id, neighbour_id=neighbour_id, score=round(score, 6))
+                for book_id in sorted(existing)
+                for score, neighbour_id in scored[book_id] if neighbour_id in existing
+            ],
+            batch_size=BATCH_SIZE,
+        )
+    return len(rows)
+
+
+### ---------- Serving ---------- ###
+
+def for_user(user, books=None, limit=None):
+    """
+    The ``limit`` books of ``books`` (all books by default) most related to
+    what ``user`` has rented, bought or borrowed, best first; one query.
+    """
+    books = Book.objects.all() if books is None else books
+    read = [
+        Rent.objects.filter(user=user).values('book_id'),
+        Purchase.objects.filter(user=user).values('book_id'),
+        IssuedBook.objects.filter(user=user).values('book_id'),
+    ]
+    related = Q()
+    for history in read:
+        related |= Q(neighbour_of__book__in=history)
+        books = books.exclude(pk__in=history)
+    return (
+        books.filter(related)
+        .annotate(recommendation_score=Sum('neighbour_of__score'))
+        .order_by('-recommendation_score', 'id')[:limit or _setting('STRIP', STRIP)]
+    )
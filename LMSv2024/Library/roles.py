@@ -0,0 +1,52 @@
+"""
+Role resolution for librarians and students.
+
+A user's group names are loaded once and then served from memory: from the user
+object for the rest of the request, and from the cache for later requests. The
+cached set is invalidated when the user's groups change (see signals.py), so in
+a multi-process deployment ``CACHES['default']`` should be a shared backend.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+LIBRARIAN = 'Librarian'
+STUDENT = 'Student'
+
+ROLE_CACHE_TIMEOUT = 60 * 60
+
+
+def _cache_key(user_id):
+    return f'library:roles:{user_id}'
+
+
+def get_roles(user):
+    """Frozen set of the user's group names."""
+    if not user.is_authenticated:
+        return frozenset()
+    roles = getattr(user, '_library_roles', None)
+    if roles is None:
+        key = _cache_key(user.pk)
+        roles = cache.get(key)
+        if roles is None:
+            roles = frozenset(user.groups.values_list('name', flat=True))
+            cache.set(key, roles, getattr(settings, 'LIBRARY_ROLE_CACHE_TIMEOUT', ROLE_CACHE_TIMEOUT))
+        # request.user lives for one request, so this is the per-request memo
+        user._library_roles = roles
+    return roles
+
+
+def has_role(user, role):
+    return role in get_roles(user)
+
+
+# Utility functions to check roles (usable with user_passes_test)
+def is_librarian(user):
+    return has_role(user, LIBRARIAN)
+
+
+def is_student(user):
+    return has_role(user, STUDENT)
+
+
+def invalidate_roles(user_ids):
+    cache.delete_many([_cache_key(user_id) for user_id in user_ids])
@@ -0,0 +1,253 @@
+"""
+Daily rollups behind the librarian analytics dashboard.
+
+``DailyRollup`` holds one row per (dimension, day, key) with a count and an
+amount: revenue by payment type and method, rentals and purchases per book,
+activity per category and memberships started per plan. The dashboard reads
+nothing else.
+
+Rows are kept current on write: signals.py queues a job (jobs.py) for every
+new Payment, Rent, Purchase and UserMembership in the writer's transaction, so
+a rolled back sale is never counted, and a worker passes the row to
+``record()``, which adds to the day's counters with ``UPDATE ... SET count =
+count + n``. Bulk inserts bypass the signals and call ``record()`` themselves. ``reconcile()`` recomputes a date range from the
+source tables with GROUP BY queries and fixes whatever drifted; run it with
+``manage.py reconcile_rollups`` (``--all`` after first installing the table).
+
+``report()`` has the database sum a date range with one GROUP BY per
+dimension over the ``(dimension, day, key)`` index, so only the totals cross
+the wire; the totals of closed ranges are cached until a reconcile changes
+them, and the names they are shown under until those rows change.
+"""
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import caching
+from .models import Book, Category, DailyRollup, Membership, Payment, Purchase, Rent, UserMembership
+
+RECONCILE_WINDOW = 31  # Days recomputed per transaction
+TOP = 10
+
+
+def _day(value):
+    if hasattr(value, 'date'):
+        return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+    return value
+
+
+### ---------- Maintenance on write ---------- ###
+
+def entries_for(instance):
+    """(dimension, day, key, count, amount) contributions of one new row."""
+    if isinstance(instance, Payment):
+        key = f'{instance.payment_type}/{instance.payment_method}'
+        return [(DailyRollup.REVENUE, _day(instance.payment_date), key, 1, instance.amount)]
+    if isinstance(instance, Rent):
+        day, dimension, amount = _day(instance.start_date), DailyRollup.RENTALS, instance.rental_fee
+    elif isinstance(instance, Purchase):
+        day, dimension, amount = _day(instance.purchase_date), DailyRollup.PURCHASES, instance.purchase_price
+    elif isinstance(instance, UserMembership):
+        return [(DailyRollup.MEMBERSHIP, instance.start_date, str(instance.membership_id), 1, 0)]
+    else:
+        raise TypeError(f"No rollups for {type(instance).__name__}")
+    entries = [(dimension, day, str(instance.book_id), 1, amount)]
+    category_id = instance.book.category_id
+    if category_id:
+        entries.append((DailyRollup.CATEGORY, day, str(category_id), 1, amount))
+    return entries
+
+
+def record(entries):
+    """Add ``entries`` to the rollup counters."""
+    totals = defaultdict(lambda: [0, Decimal(0)])
+    for dimension, day, key, count, amount in entries:
+        totals[dimension, day, key][0] += count
+        totals[dimension, day, key][1] += Decimal(amount)
+
+    for (dimension, day, key), (count, amount) in totals.items():
+        counters = DailyRollup.objects.filter(dimension=dimension, day=day, key=key)
+        if counters.update(count=F('count') + count, amount=F('amount') + amount):
+            continue
+        try:
+            with transaction.atomic():
+                DailyRollup.objects.create(dimension=dimension, day=day, key=key, count=count, amount=amount)
+        except IntegrityError:
+            # Another writer created the row first
+            counters.update(count=F('count') + count, amount=F('amount') + amount)
+
+
+def record_instances(instances):
+    record(entry for instance in instances for entry in entries_for(instance))
+
+
+### ---------- Reconciliation ---------- ###
+
+def _recompute(start, end):
+    """Fresh ``{(dimension, day, key): (count, amount)}`` for ``start`` to ``end``."""
+    fresh = {}
+
+    def add(dimension, rows, day_field, key_field, amount_field=None):
+        rows = rows.annotate(n=Count('id'), total=Sum(amount_field)) if amount_field else rows.annotate(n=Count('id'))
+        for row in rows:
+            if row[key_field] is None:
+                continue  # Books without a category
+            key = (dimension, row[day_field], str(row[key_field]))
+            count, amount = fresh.get(key, (0, Decimal(0)))
+            fresh[key] = (count + row['n'], amount + row.get('total', 0))
+
+    payments = Payment.objects.annotate(day=TruncDate('payment_date')).filter(day__range=(start, end))
+    for row in payments.values('day', 'payment_type', 'payment_method').annotate(n=Count('id'), total=Sum('amount')):
+        key = (DailyRollup.REVENUE, row['day'], f"{row['payment_type']}/{row['payment_method']}")
+        fresh[key] = (row['n'], row['total'])
+
+    rents = Rent.objects.filter(start_date__range=(start, end))
+    add(DailyRollup.RENTALS, rents.values('start_date', 'book_id'), 'start_date', 'book_id', 'rental_fee')
+    add(DailyRollup.CATEGORY, rents.values('start_date', 'book__category_id'), 'start_date', 'book__category_id',
+        'rental_fee')
+    purchases = Purchase.objects.annotate(day=TruncDate('purchase_date')).filter(day__range=(start, end))
+    add(DailyRollup.PURCHASES, purchases.values('day', 'book_id'), 'day', 'book_id', 'purchase_price')
+    add(DailyRollup.CATEGORY, purchases.values('day', 'book__category_id'), 'day', 'book__category_id',
+        'purchase_price')
+    memberships = UserMembership.objects.filter(start_date__range=(start, end))
+    add(DailyRollup.MEMBERSHIP, memberships.values('start_date', 'membership_id'), 'start_date', 'membership_id')
+    return fresh
+
+
+def reconcile(start, end, window=RECONCILE_WINDOW, progress=None):
+    """
+    Make the rollups for ``start`` to ``end`` match the source tables, one
+    ``window`` of days per transaction. Returns the number of rows corrected.
+    """
+    corrected = 0
+    while start <= end:
+        stop = min(start + timedelta(days=window - 1), end)
+        with transaction.atomic():
+            fresh = _recompute(start, stop)
+            stale, changed = [], []
+            for row in DailyRollup.objects.select_for_update().filter(day__range=(start, stop)):
+                expected = fresh.pop((row.dimension, row.day, row.key), None)
+                if expected is None:
+                    stale.append(row.pk)
+                elif (row.count, row.amount) != expected:
+                    row.count, row.amount = expected
+                    changed.append(row)
+            DailyRollup.objects.filter(pk__in=stale).delete()
+            DailyRollup.objects.bulk_update(changed, ['count', 'amount'], batch_size=1000)
+            DailyRollup.objects.bulk_create(
+                [DailyRollup(dimension=dimension, day=day, key=key, count=count, amount=amount)
+                 for (dimension, day, key), (count, amount) in fresh.items()],
+                batch_size=1000,
+            )
+            if stale or changed or fresh:
+                corrected += len(stale) + len(changed) + len(fresh)
+                caching.bump_on_commit('dailyrollup')  # Cached reports of closed ranges
+        if progress:
+            progress(stop, corrected)
+        start = stop + timedelta(days=1)
+    return corrected
+
+
+def first_day():
+    """Earliest day with any activity, for reconciling everything."""
+    days = [
+        value for value in (
+            Payment.objects.order_by('payment_date').values_list('payment_date', flat=True).first(),
+            Rent.objects.order_by('start_date').values_list('start_date', flat=True).first(),
+            Purchase.objects.order_by('purchase_date').values_list('purchase_date', flat=True).first(),
+            UserMembership.objects.order_by('start_date').values_list('start_date', flat=True).first(),
+        )
+        if value is not None
+    ]
+    return min(map(_day, days)) if days else date.today()
+
+
+### ---------- Reporting ---------- ###
+
+def _sums(dimension, start, end, group_by='key', limit=None):
+    """(group, count, amount) totals of one dimension, summed by the database."""
+    rows = (
+        DailyRollup.objects.filter(dimension=dimension, day__range=(start, end))
+        .values(*group_by.split()).annotate(total_count=Sum('count'), total_amount=Sum('amount'))
+    )
+    if limit:
+        rows = rows.order_by('-total_count', 'key')[:limit]
+    return [(*(row[field] for field in group_by.split()), row['total_count'], row['total_amount']) for row in rows]
+
+
+def _names(model, field, rows):
+    return dict(model.objects.filter(pk__in=[int(key) for key, *_ in rows]).values_list('id', field))
+
+
+def _labelled(rows, names):
+    """Replace the id keys of ``rows`` with display names."""
+    return [(names.get(int(key), f"Deleted #{key}"), *values) for key, *values in rows]
+
+
+def _totals(start, end):
+    """The report's figures, with the rollup keys of books, categories and plans still unlabelled."""
+    revenue, daily = defaultdict(lambda: [0, Decimal(0)]), defaultdict(Decimal)
+    for day, key, count, amount in _sums(DailyRollup.REVENUE, start, end, group_by='day key'):
+        revenue[key][0] += count
+        revenue[key][1] += amount
+        daily[day] += amount
+    revenue = sorted(
+        ((*key.split('/', 1), count, amount) for key, (count, amount) in revenue.items()), key=lambda row: -row[3],
+    )
+    plans = _sums(DailyRollup.MEMBERSHIP, start, end)
+    started = sum(count for _, count, _ in plans)
+
+    return {
+        'start': start,
+        'end': end,
+        'revenue': revenue,
+        'revenue_total': sum(row[3] for row in revenue),
+        'daily_revenue': sorted(daily.items()),
+        'top_rented': _sums(DailyRollup.RENTALS, start, end, limit=TOP),
+        'top_purchased': _sums(DailyRollup.PURCHASES, start, end, limit=TOP),
+        'top_categories': _sums(DailyRollup.CATEGORY, start, end, limit=TOP),
+        'membership_mix': [(key, count, round(count * 100 / started, 1)) for key, count, _ in sorted(plans)],
+    }
+
+
+def _labels(totals):
+    """Display names of the books, categories and plans in ``totals``."""
+    return {
+        'titles': _names(Book, 'title', totals['top_rented'] + totals['top_purchased']),
+        'categories': _names(Category, 'name', totals['top_categories']),
+        'plans': _names(Membership, 'name', totals['membership_mix']),
+    }
+
+
+def _labelled_report(totals, labels):
+    return {
+        **totals,
+        'top_rented': _labelled(totals['top_rented'], labels['titles']),
+        'top_purchased': _labelled(totals['top_purchased'], labels['titles']),
+        'top_categories': _labelled(totals['top_categories'], labels['categories']),
+        'membership_mix': _labelled(totals['membership_mix'], labels['plans']),
+    }
+
+
+def report(start, end):
+    """
+    Dashboard figures for ``start`` to ``end``, both inclusive. Ranges that end
+    before today only change when ``reconcile()`` corrects them, so their
+    totals are served from the cache (caching.py) until then. The names they
+    are shown under are cached apart, on the versions of their own tables, so
+    renaming a book only costs the name lookups and not the rollup sums.
+    """
+    if end >= date.today():
+        totals = _totals(start, end)
+        return _labelled_report(totals, _labels(totals))
+    totals = caching.get_or_render('analytics_totals', ('dailyrollup',), (start, end), lambda: _totals(start, end))
+    labels = caching.get_or_render(
+        'analytics_labels', ('dailyrollup', 'book', 'category', 'membership'), (start, end),
+        lambda: _labels(totals),
+    )
+    return _labelled_report(totals, labels)
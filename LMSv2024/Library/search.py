@@ -0,0 +1,545 @@
+"""
+Catalog search.
+
+All list screens query through ``filter_queryset()`` / ``search_ids()`` instead of
+running ``icontains`` scans. Two backends are shipped:
+
+* ``SQLiteFTSBackend`` keeps an FTS5 index in a side SQLite file
+  (``LIBRARY_SEARCH_INDEX_PATH``), independent of the main database.
+* ``InMemoryBackend`` keeps an inverted index inside the worker process and is
+  used when FTS5 is not available or ``LIBRARY_SEARCH_BACKEND = "memory"``.
+
+Indexes are built in bulk with the ``rebuild_search_index`` management
+command and kept up to date by the receivers in ``signals.py``. A search that
+finds its index missing never builds it inside the request: it starts the
+build in a background thread and answers from a bounded ``icontains`` query
+until the index is ready (``LIBRARY_SEARCH_BACKGROUND_BUILD = False`` builds
+inline instead, e.g. in tests).
+
+Every index update bumps the ``search-<kind>`` cache version (caching.py).
+The SQLite file is shared by all workers, but an in-memory index only sees
+the writes of its own process. It remembers the version it is current at
+(its own writes move it along) and compares it with the shared one at most
+every ``LIBRARY_SEARCH_REFRESH`` seconds; when another worker has written
+since, it is rebuilt the same way as above while the old one keeps serving.
+"""
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, When
+from django.utils.module_loading import import_string
+
+from . import caching
+from .models import Author, Book, Category
+from .roles import STUDENT
+
+
+# Indexed fields per document kind, with their ranking weight
+SEARCH_FIELDS = {
+    'book': {'title': 10.0, 'author': 5.0, 'category': 3.0, 'description': 1.0, 'isbn': 8.0},
+    'author': {'name': 10.0, 'biography': 1.0},
+    'category': {'name': 10.0, 'description': 1.0},
+    'user': {'username': 10.0, 'email': 5.0, 'first_name': 5.0},
+    'student': {'username': 10.0, 'email': 5.0, 'first_name': 5.0},
+}
+
+# Columns the database fallback matches while an index is being built
+DATABASE_FIELDS = {
+    'book': ['title', 'author__name', 'category__name', 'description', 'isbn__isbn_number'],
+    'author': ['name', 'biography'],
+    'category': ['name', 'description'],
+    'user': ['username', 'email', 'first_name'],
+    'student': ['username', 'email', 'first_name'],
+}
+
+DEFAULT_LIMIT = 500
+REFRESH_SECONDS = 30
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall((text or '').lower())
+
+
+### ---------- Documents ---------- ###
+
+def book_document(book):
+    return {
+        'title': book.title,
+        'author': book.author.name if book.author_id else '',
+        'category': book.category.name if book.category_id else '',
+        'description': book.description or '',
+        'isbn': book.isbn.isbn_number if book.isbn_id else '',
+    }
+
+
+def author_document(author):
+    return {'name': author.name, 'biography': author.biography or ''}
+
+
+def category_document(category):
+    return {'name': category.name, 'description': category.description or ''}
+
+
+def user_document(user):
+    return {'username': user.username, 'email': user.email or '', 'first_name': user.first_name or ''}
+
+
+def source_queryset(kind):
+    """Queryset every document of ``kind`` is built from."""
+    if kind == 'book':
+        return Book.objects.select_related('author', 'category', 'isbn')
+    if kind == 'author':
+        return Author.objects.all()
+    if kind == 'category':
+        return Category.objects.all()
+    if kind == 'user':
+        return User.objects.all()
+    if kind == 'student':
+        return User.objects.filter(groups__name=STUDENT)
+    raise ValueError(f"Unknown search kind: {kind!r}")
+
+
+_DOCUMENT_BUILDERS = {
+    'book': book_document,
+    'author': author_document,
+    'category': category_document,
+    'user': user_document,
+    'student': user_document,
+}
+
+
+def iter_documents(kind, queryset=None, chunk_size=2000):
+    """Yield ``(pk, document)`` pairs without materializing the whole table."""
+    build = _DOCUMENT_BUILDERS[kind]
+    if queryset is None:
+        queryset = source_queryset(kind)
+    for obj in queryset.order_by('pk').iterator(chunk_size=chunk_size):
+        yield obj.pk, build(obj)
+
+
+### ---------- Backends ---------- ###
+
+def version_name(kind):
+    return f'search-{kind}'
+
+
+class SearchBackend:
+    """Interface every search backend implements."""
+
+    def index(self, kind, pk, document):
+        self.index_many(kind, [(pk, document)])
+
+    def index_many(self, kind, documents):
+        raise NotImplementedError
+
+    def remove(self, kind, pk):
+        raise NotImplementedError
+
+    def clear(self, kind):
+        raise NotImplementedError
+
+    def is_built(self, kind):
+        raise NotImplementedError
+
+    def mark_built(self, kind):
+        raise NotImplementedError
+
+    def search(self, kind, query, limit=DEFAULT_LIMIT):
+        """Return matching primary keys, best match first."""
+        raise NotImplementedError
+
+    def current_version(self, kind):
+        """
+        ``search-<kind>`` version this index has seen every write up to, or None
+        for indexes that all processes share and so never fall behind.
+        """
+        return None
+
+    def written(self, kind, version):
+        """This process wrote to the index, which bumped the version to ``version``."""
+
+    def rebuild(self, kind, chunk_size=2000):
+        self.clear(kind)
+        batch = []
+        for item in iter_documents(kind, chunk_size=chunk_size):
+            batch.append(item)
+            if len(batch) >= chunk_size:
+                self.index_many(kind, batch)
+                batch = []
+        if batch:
+            self.index_many(kind, batch)
+        self.mark_built(kind)
+
+
+class InMemoryBackend(SearchBackend):
+    """
+    Inverted index held in the worker process.
+
+    Every term of the query is matched as a prefix against a sorted token list,
+    so lookups cost O(log n) plus the size of the matching posting lists.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = {kind: {} for kind in SEARCH_FIELDS}   # token -> {pk: score}
+        self._doc_tokens = {kind: {} for kind in SEARCH_FIELDS}  # pk -> set of tokens
+        self._sorted_tokens = {kind: [] for kind in SEARCH_FIELDS}
+        self._built = set()
+        self._versions = {}
+
+    def _drop(self, kind, pk):
+        postings = self._postings[kind]
+        sorted_tokens = self._sorted_tokens[kind]
+        for token in self._doc_tokens[kind].pop(pk, ()):
+            docs = postings.get(token)
+            if docs is None:
+                continue
+            docs.pop(pk, None)
+            if not docs:
+                del postings[token]
+                i = bisect_left(sorted_tokens, token)
+                if i < len(sorted_tokens) and sorted_tokens[i] == token:
+                    del sorted_tokens[i]
+
+    def index_many(self, kind, documents):
+        weights = SEARCH_FIELDS[kind]
+        with self._lock:
+            postings = self._postings[kind]
+            sorted_tokens = self._sorted_tokens[kind]
+            for pk, document in documents:
+                self._drop(kind, pk)
+                scores = {}
+                for field, weight in weights.items():
+                    for token in tokenize(document.get(field)):
+                        scores[token] = scores.get(token, 0.0) + weight
+                for token, score in scores.items():
+                    if token not in postings:
+                        postings[token] = {}
+                        insort(sorted_tokens, token)
+                    postings[token][pk] = score
+                self._doc_tokens[kind][pk] = set(scores)
+
+    def remove(self, kind, pk):
+        with self._lock:
+            self._drop(kind, pk)
+
+    def clear(self, kind):
+        with self._lock:
+            self._postings[kind] = {}
+            self._doc_tokens[kind] = {}
+            self._sorted_tokens[kind] = []
+            self._built.discard(kind)
+
+    def is_built(self, kind):
+        return kind in self._built
+
+    def mark_built(self, kind):
+        self._built.add(kind)
+
+    def current_version(self, kind):
+        return self._versions.get(kind)
+
+    def written(self, kind, version):
+        with self._lock:
+            if self._versions.get(kind) == version - 1:  # No other process wrote in between
+                self._versions[kind] = version
+
+    def rebuild(self, kind, chunk_size=2000):
+        """Build into a fresh index and swap it in, so searches keep the old one meanwhile."""
+        version = int(caching.versions([version_name(kind)]))
+        fresh = InMemoryBackend()
+        SearchBackend.rebuild(fresh, kind, chunk_size)
+        with self._lock:
+            self._postings[kind] = fresh._postings[kind]
+            self._doc_tokens[kind] = fresh._doc_tokens[kind]
+            self._sorted_tokens[kind] = fresh._sorted_tokens[kind]
+            self._versions[kind] = version
+            self._built.add(kind)
+
+    def _match_prefix(self, kind, term):
+        sorted_tokens = self._sorted_tokens[kind]
+        postings = self._postings[kind]
+        matches = {}
+        i = bisect_left(sorted_tokens, term)
+        while i < len(sorted_tokens) and sorted_tokens[i].startswith(term):
+            token = sorted_tokens[i]
+            # Exact token matches rank above prefix matches
+            boost = 1.0 if token == term else 0.5
+            for pk, score in postings[token].items():
+                matches[pk] = max(matches.get(pk, 0.0), score * boost)
+            i += 1
+        return matches
+
+    def search(self, kind, query, limit=DEFAULT_LIMIT):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        with self._lock:
+            scores = None
+            for term in terms:
+                matches = self._match_prefix(kind, term)
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = {pk: scores[pk] + s for pk, s in matches.items() if pk in scores}
+                if not scores:
+                    return []
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [pk for pk, _ in ranked[:limit]]
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """
+    FTS5 index stored in a standalone SQLite file.
+
+    Each kind gets its own virtual table whose rowid is the model primary key,
+    so incremental updates are a single DELETE/INSERT by rowid.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        with self._connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS search_meta (kind TEXT PRIMARY KEY)')
+            for kind, weights in SEARCH_FIELDS.items():
+                columns = ', '.join(weights)
+                conn.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS search_{kind} USING fts5("
+                    f"{columns}, tokenize='unicode61', prefix='2 3 4')"
+                )
+
+    @staticmethod
+    def is_available():
+        try:
+            conn = sqlite3.connect(':memory:')
+            conn.execute('CREATE VIRTUAL TABLE fts5_probe USING fts5(x)')
+            conn.close()
+            return True
+        except sqlite3.OperationalError:
+            return False
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def index_many(self, kind, documents):
+        fields = list(SEARCH_FIELDS[kind])
+        placeholders = ', '.join('?' * (len(fields) + 1))
+        rows = [(pk, *(document.get(field) or '' for field in fields)) for pk, document in documents]
+        if not rows:
+            return
+        with self._write_lock, self._connection() as conn:
+            conn.executemany(f'DELETE FROM search_{kind} WHERE rowid = ?', [(row[0],) for row in rows])
+            conn.executemany(
+                f"INSERT INTO search_{kind} (rowid, {', '.join(fields)}) VALUES ({placeholders})", rows
+            )
+
+    def remove(self, kind, pk):
+        with self._write_lock, self._connection() as conn:
+            conn.execute(f'DELETE FROM search_{kind} WHERE rowid = ?', (pk,))
+
+    def clear(self, kind):
+        with self._write_lock, self._connection() as conn:
+            conn.execute(f'DELETE FROM search_{kind}')
+            conn.execute('DELETE FROM search_meta WHERE kind = ?', (kind,))
+
+    def is_built(self, kind):
+        row = self._connection().execute('SELECT 1 FROM search_meta WHERE kind = ?', (kind,)).fetchone()
+        return row is not None
+
+    def mark_built(self, kind):
+        with self._write_lock, self._connection() as conn:
+            conn.execute('INSERT OR IGNORE INTO search_meta (kind) VALUES (?)', (kind,))
+
+    def search(self, kind, query, limit=DEFAULT_LIMIT):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        match = ' '.join(f'"{term}"*' for term in terms)
+        weights = ', '.join(str(w) for w in SEARCH_FIELDS[kind].values())
+        rows = self._connection().execute(
+            f'SELECT rowid FROM search_{kind} WHERE search_{kind} MATCH ? '
+            f'ORDER BY bm25(search_{kind}, {weights}), rowid LIMIT ?',
+            (match, limit),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+
+### ---------- Public API ---------- ###
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def _create_backend():
+    backend = getattr(settings, 'LIBRARY_SEARCH_BACKEND', 'sqlite')
+    if backend == 'memory':
+        return InMemoryBackend()
+    if backend == 'sqlite':
+        if not SQLiteFTSBackend.is_available():
+            return InMemoryBackend()
+        path = getattr(settings, 'LIBRARY_SEARCH_INDEX_PATH', None) or settings.BASE_DIR / 'search_index.sqlite3'
+        return SQLiteFTSBackend(path)
+    # Dotted path to a custom SearchBackend subclass
+    return import_string(backend)()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _create_backend()
+    return _backend
+
+
+def reset_backend():
+    """Drop the cached backend (used when settings change, e.g. in tests)."""
+    global _backend
+    with _backend_lock:
+        _backend = None
+
+
+_building = set()
+_checked = {}  # (backend id, kind) -> when the index was last compared with the shared version
+
+
+def _build(backend, kind):
+    try:
+        backend.rebuild(kind)
+    finally:
+        with _backend_lock:
+            _building.discard((id(backend), kind))
+
+
+def _build_in_background(backend, kind):
+    with _backend_lock:
+        if (id(backend), kind) in _building:
+            return
+        _building.add((id(backend), kind))
+
+    def run():
+        try:
+            _build(backend, kind)
+        finally:
+            connection.close()
+
+    threading.Thread(target=run, name=f'search-build-{kind}', daemon=True).start()
+
+
+def _schedule_build(backend, kind):
+    """Start building ``kind``; returns True once the index can be searched."""
+    if getattr(settings, 'LIBRARY_SEARCH_BACKGROUND_BUILD', True):
+        _build_in_background(backend, kind)
+        return backend.is_built(kind)
+    _build(backend, kind)
+    return True
+
+
+def _ready(backend, kind):
+    if not backend.is_built(kind):
+        return _schedule_build(backend, kind)
+    version = backend.current_version(kind)
+    if version is not None:
+        now = time.monotonic()
+        key = (id(backend), kind)
+        if now - _checked.get(key, 0.0) >= getattr(settings, 'LIBRARY_SEARCH_REFRESH', REFRESH_SECONDS):
+            _checked[key] = now
+            if int(caching.versions([version_name(kind)])) != version:
+                _schedule_build(backend, kind)  # Another process wrote; serve this index meanwhile
+    return True
+
+
+def _database_ids(kind, query, limit):
+    """Ids whose indexed columns contain every term of ``query``, in id order."""
+    terms = tokenize(query)
+    if not terms:
+        return []
+    queryset = source_queryset(kind)
+    for term in terms:
+        condition = Q()
+        for field in DATABASE_FIELDS[kind]:
+            condition |= Q(**{f'{field}__icontains': term})
+        queryset = queryset.filter(condition)
+    return list(queryset.order_by('pk').values_list('pk', flat=True)[:limit])
+
+
+def _written(backend, kind):
+    """Record a write to ``kind``; returns whether there is a built index to apply it to."""
+    name = version_name(kind)
+    backend.written(kind, caching.bump(name)[name])
+    return backend.is_built(kind)
+
+
+def reindex(kind, queryset):
+    """
+    (Re)index the documents in ``queryset``. Skipped while the index is not
+    built yet, since its build reads them from the database anyway.
+    """
+    backend = get_backend()
+    if not _written(backend, kind):
+        return
+    batch = []
+    for item in iter_documents(kind, queryset):
+        batch.append(item)
+        if len(batch) >= 500:
+            backend.index_many(kind, batch)
+            batch = []
+    if batch:
+        backend.index_many(kind, batch)
+
+
+def unindex(kind, pk):
+    backend = get_backend()
+    if _written(backend, kind):
+        backend.remove(kind, pk)
+
+
+def refresh(kind, pks):
+    """Index the ``pks`` that are in ``kind``'s source queryset and drop the others."""
+    backend = get_backend()
+    if not _written(backend, kind):
+        return
+    documents = list(iter_documents(kind, source_queryset(kind).filter(pk__in=pks)))
+    backend.index_many(kind, documents)
+    for pk in set(pks) - {pk for pk, _ in documents}:
+        backend.remove(kind, pk)
+
+
+def search_ids(kind, query, limit=None):
+    limit = limit or getattr(settings, 'LIBRARY_SEARCH_LIMIT', DEFAULT_LIMIT)
+    backend = get_backend()
+    if not _ready(backend, kind):
+        return _database_ids(kind, query, limit)
+    return backend.search(kind, query, limit)
+
+
+def filter_queryset(queryset, kind, query, limit=None):
+    """
+    Restrict ``queryset`` to the search hits for ``query``, best match first.
+
+    Hits are annotated with ``search_rank`` (0 is the best match) so they can be
+    paged with the ``('search_rank', 'id')`` keyset ordering. An empty query
+    returns the queryset unchanged.
+    """
+    if not query or not query.strip():
+        return queryset
+    ids = search_ids(kind, query, limit)
+    if not ids:
+        return queryset.none()
+    rank = Case(*[When(pk=pk, then=position) for position, pk in enumerate(ids)], output_field=IntegerField())
+    return queryset.filter(pk__in=ids).annotate(search_rank=rank).order_by('search_rank')
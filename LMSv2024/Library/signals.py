@@ -0,0 +1,291 @@
+from django.contrib.auth.models import Group, User
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import autocomplete, caching, counters, jobs, search
+from .access import add_book_access, refresh_book_access
+from .images import schedule_renditions
+from .memberships import invalidate_memberships
+from .middleware import watch_connection
+from .roles import invalidate_roles
+from .models import ISBN, Author, Book, Category, Language, Membership, Payment, Purchase, Rent, UserMembership
+
+
+### ---------- Search index maintenance ---------- ###
+
+@receiver(setting_changed)
+def reset_search_indexes(sender, setting, **kwargs):
+    if setting.startswith('LIBRARY_SEARCH_'):
+        search.reset_backend()
+    if setting.startswith('LIBRARY_AUTOCOMPLETE_'):
+        autocomplete.reset()
+
+
+# Index updates run after commit so a rolled back save never reaches the index.
+
+def _reindex_on_commit(kind, queryset):
+    transaction.on_commit(lambda: search.reindex(kind, queryset))
+
+
+def _unindex_on_commit(kind, pk):
+    transaction.on_commit(lambda: search.unindex(kind, pk))
+
+
+@receiver(post_save, sender=Book)
+def index_book(sender, instance, **kwargs):
+    _reindex_on_commit('book', search.source_queryset('book').filter(pk=instance.pk))
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book(sender, instance, **kwargs):
+    _unindex_on_commit('book', instance.pk)
+
+
+@receiver(post_save, sender=Author)
+def index_author(sender, instance, **kwargs):
+    _reindex_on_commit('author', Author.objects.filter(pk=instance.pk))
+    # Books carry the author name in their document
+    _reindex_on_commit('book', search.source_queryset('book').filter(author_id=instance.pk))
+
+
+@receiver(post_delete, sender=Author)
+def unindex_author(sender, instance, **kwargs):
+    _unindex_on_commit('author', instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def index_category(sender, instance, **kwargs):
+    _reindex_on_commit('category', Category.objects.filter(pk=instance.pk))
+    _reindex_on_commit('book', search.source_queryset('book').filter(category_id=instance.pk))
+
+
+@receiver(post_delete, sender=Category)
+def unindex_category(sender, instance, **kwargs):
+    _unindex_on_commit('category', instance.pk)
+
+
+@receiver(post_save, sender=ISBN)
+def index_isbn(sender, instance, created, **kwargs):
+    if not created:
+        _reindex_on_commit('book', search.source_queryset('book').filter(isbn_id=instance.pk))
+
+
+@receiver(post_save, sender=User)
+def index_user(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return  # Logging in changes nothing that is indexed
+    _reindex_on_commit('user', User.objects.filter(pk=instance.pk))
+    transaction.on_commit(lambda: search.refresh('student', [instance.pk]))
+
+
+@receiver(post_delete, sender=User)
+def unindex_user(sender, instance, **kwargs):
+    _unindex_on_commit('user', instance.pk)
+    _unindex_on_commit('student', instance.pk)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def index_students(sender, instance, action, reverse, pk_set, **kwargs):
+    # Users joining or leaving the Student group
+    if action in ('post_add', 'post_remove'):
+        pks = list(pk_set) if reverse else [instance.pk]
+    elif action == 'pre_clear':
+        pks = list(instance.user_set.values_list('pk', flat=True)) if reverse else [instance.pk]
+    else:
+        return
+    transaction.on_commit(lambda: search.refresh('student', pks))
+
+
+### ---------- Autocomplete indexes ---------- ###
+
+def _refresh_completions_on_commit(kind, pks):
+    transaction.on_commit(lambda: autocomplete.refresh(kind, pks))
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def refresh_book_completions(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'title' in update_fields:
+        _refresh_completions_on_commit('book', [instance.pk])
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+def refresh_author_completions(sender, instance, **kwargs):
+    _refresh_completions_on_commit('author', [instance.pk])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def refresh_user_completions(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'username' in update_fields:  # Not on every login
+        _refresh_completions_on_commit('user', [instance.pk])
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def refresh_student_completions(sender, instance, action, reverse, pk_set, **kwargs):
+    # Users joining or leaving the Student group
+    if action in ('post_add', 'post_remove'):
+        _refresh_completions_on_commit('user', list(pk_set) if reverse else [instance.pk])
+    elif action == 'pre_clear':
+        pks = list(instance.user_set.values_list('pk', flat=True)) if reverse else [instance.pk]
+        _refresh_completions_on_commit('user', pks)
+
+
+### ---------- Membership access mapping ---------- ###
+
+# New books are mapped in their own transaction; the tier boundaries are only
+# recomputed when the tiers themselves change (see access.py).
+
+@receiver(post_save, sender=Book)
+def map_book_access(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        add_book_access(instance)
+
+
+@receiver(post_save, sender=Membership)
+@receiver(post_delete, sender=Membership)
+def refresh_membership_access(sender, instance, **kwargs):
+    transaction.on_commit(refresh_book_access)
+
+
+### ---------- Response and fragment cache versions ---------- ###
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Language)
+@receiver(post_delete, sender=Language)
+@receiver(post_save, sender=ISBN)
+@receiver(post_delete, sender=ISBN)
+@receiver(post_save, sender=Membership)
+@receiver(post_delete, sender=Membership)
+@receiver(post_save, sender=UserMembership)
+@receiver(post_delete, sender=UserMembership)
+def bump_cache_version(sender, **kwargs):
+    caching.bump_on_commit(sender._meta.model_name)
+
+
+### ---------- Book counters ---------- ###
+
+@receiver(pre_save, sender=Book)
+def load_book_counters(sender, instance, raw=False, **kwargs):
+    if not raw:
+        counters.book_saving(instance)
+
+
+@receiver(post_save, sender=Book)
+def count_saved_book(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if not raw:
+        counters.book_saved(instance, created, update_fields)
+
+
+@receiver(post_delete, sender=Book)
+def count_deleted_book(sender, instance, **kwargs):
+    counters.book_deleted(instance)
+
+
+### ---------- Role cache invalidation ---------- ###
+
+# Cached roles and memberships are dropped after commit: dropped before it, a
+# concurrent request could cache the old rows again until they expire. The
+# user ids are read now, while the members being removed are still there.
+
+def _invalidate_roles_on_commit(user_ids):
+    user_ids = list(user_ids)
+    transaction.on_commit(lambda: invalidate_roles(user_ids))
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        # user.groups.add(...) etc.: instance is the user
+        _invalidate_roles_on_commit([instance.pk])
+    elif action == 'pre_clear':
+        # group.user_set.clear(): collect the members before they are removed
+        _invalidate_roles_on_commit(instance.user_set.values_list('pk', flat=True))
+    else:
+        _invalidate_roles_on_commit(pk_set)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    _invalidate_roles_on_commit([instance.pk])
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    # A renamed or deleted group changes the roles of all its members
+    _invalidate_roles_on_commit(instance.user_set.values_list('pk', flat=True))
+
+
+### ---------- Current membership cache ---------- ###
+
+def _invalidate_memberships_on_commit(user_ids):
+    user_ids = list(user_ids)
+    transaction.on_commit(lambda: invalidate_memberships(user_ids))
+
+
+@receiver(post_save, sender=UserMembership)
+@receiver(post_delete, sender=UserMembership)
+def user_membership_changed(sender, instance, **kwargs):
+    _invalidate_memberships_on_commit([instance.user_id])
+
+
+@receiver(post_save, sender=Membership)
+def membership_plan_changed(sender, instance, **kwargs):
+    # The cached memberships carry their plan; deleting a plan cascades to them
+    _invalidate_memberships_on_commit(
+        UserMembership.objects.filter(membership=instance).active().values_list('user_id', flat=True)
+    )
+
+
+### ---------- Write-behind side effects ---------- ###
+
+# Queued in the writer's transaction and handled by the job workers (jobs.py)
+
+@receiver(post_save, sender=Payment)
+@receiver(post_save, sender=Rent)
+@receiver(post_save, sender=Purchase)
+@receiver(post_save, sender=UserMembership)
+def record_rollups(sender, instance, created, **kwargs):
+    if created:
+        jobs.enqueue('record_rollups', model=sender._meta.model_name, pk=instance.pk)
+
+
+@receiver(post_save, sender=Payment)
+def send_receipt(sender, instance, created, **kwargs):
+    if created:
+        jobs.enqueue('send_receipt', payment=instance.pk)
+
+
+### ---------- Book cover renditions ---------- ###
+
+@receiver(pre_save, sender=Book)
+def reset_book_image_renditions(sender, instance, **kwargs):
+    # A newly uploaded (not yet committed) image invalidates the old renditions
+    if not instance.book_image or not instance.book_image._committed:
+        instance.book_image_renditions = []
+
+
+@receiver(post_save, sender=Book)
+def render_book_image(sender, instance, **kwargs):
+    if instance.book_image and not instance.book_image_renditions:
+        schedule_renditions(instance.book_image.name)
+
+
+### ---------- Query counting ---------- ###
+
+@receiver(connection_created)
+def count_queries(sender, connection, **kwargs):
+    watch_connection(connection)
@@ -0,0 +1,148 @@
+"""
+Synthetic library data for benchmarks.
+
+``generate()`` bulk inserts a catalogue, students and their rentals, purchases,
+payments, loans and memberships with a fixed seed, so two runs produce the same
+rows. Model signals are bypassed; only the membership access mapping, the book
+counts and the analytics rollups are built afterwards. Never point it at a
+database that holds real data.
+"""
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import Group, User
+
+from . import counters, rollups
+from .access import refresh_book_access
+from .models import (
+    ISBN, LOAN_PERIOD, MEMBERSHIP_PERIOD, Author, Book, Category, IssuedBook, Language, Membership, Payment, Purchase, Rent,
+    UserMembership,
+)
+
+BATCH_SIZE = 2000
+
+TIERS = [('GOLD', 10, 30), ('PLATINUM', 20, 60), ('DIAMOND', 30, 100)]
+
+
+def _ids(model):
+    return list(model.objects.order_by('id').values_list('id', flat=True))
+
+
+def generate(books=10000, students=1000, activity=20, authors=None, rents=None, purchases=None,
+             payments=None, loans=None, seed=0, log=None):
+    """
+    Create ``books`` books and ``students`` students with about ``activity``
+    rentals, purchases, payments and loans each. The per-table counts can be
+    set individually; ``authors`` defaults to one per twenty books.
+    """
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+
+    librarian, _ = User.objects.get_or_create(username='synthetic-librarian')
+    librarian.groups.add(Group.objects.get_or_create(name='Librarian')[0])
+    student_group = Group.objects.get_or_create(name='Student')[0]
+    tiers = [
+        Membership.objects.get_or_create(
+            name=name, defaults={'price_per_month': price, 'book_access_percentage': percentage},
+        )[0]
+        for name, price, percentage in TIERS
+    ]
+
+    Author.objects.bulk_create(
+        [Author(name=f"Author {i}") for i in range(authors or max(books // 20, 1))], batch_size=BATCH_SIZE,
+    )
+    Category.objects.bulk_create(
+        [Category(name=f"Synthetic category {i}") for i in range(50)], batch_size=BATCH_SIZE, ignore_conflicts=True,
+    )
+    Language.objects.bulk_create(
+        [Language(name=name) for name in ('English', 'Malayalam', 'Hindi', 'Tamil')], ignore_conflicts=True,
+    )
+    author_ids, category_ids, language_ids = _ids(Author), _ids(Category), _ids(Language)
+
+    start = ISBN.objects.count()
+    ISBN.objects.bulk_create(
+        [ISBN(isbn_number=f"{9790000000000 + start + i}") for i in range(books)], batch_size=BATCH_SIZE,
+    )
+    isbn_ids = _ids(ISBN)[-books:]
+    Book.objects.bulk_create(
+        [
+            Book(
+                title=f"Synthetic book {start + i}",
+                author_id=rng.choice(author_ids),
+                category_id=rng.choice(category_ids),
+                language_id=rng.choice(language_ids),
+                isbn_id=isbn_ids[i],
+                quantity=rng.randint(0, 20),
+                price=Decimal(rng.randint(100, 5000)) / 10,
+                added_by=librarian,
+            )
+            for i in range(books)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    log(f"{books} books")
+
+    first = User.objects.count()
+    users = User.objects.bulk_create(
+        [User(username=f"synthetic-student-{first + i}") for i in range(students)], batch_size=BATCH_SIZE,
+    )
+    user_ids = [user.id for user in users]
+    if None in user_ids:  # Backends that do not return ids from bulk inserts (MySQL)
+        user_ids = _ids(User)[-students:]
+    User.groups.through.objects.bulk_create(
+        [User.groups.through(user_id=user_id, group_id=student_group.id) for user_id in user_ids],
+        batch_size=BATCH_SIZE,
+    )
+    log(f"{students} students")
+
+    book_ids = _ids(Book)
+    today = date.today()
+    rows = students * activity
+
+    def count(value):
+        return rows if value is None else value
+
+    Payment.objects.bulk_create(
+        [
+            Payment(user_id=rng.choice(user_ids), amount=rng.randint(10, 500),
+                    payment_type=rng.choice(['Membership', 'Purchase', 'Rent']))
+            for _ in range(count(payments))
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    Rent.objects.bulk_create(
+        [Rent(user_id=rng.choice(user_ids), book_id=rng.choice(book_ids), rental_fee=rng.randint(1, 50))
+         for _ in range(count(rents))],
+        batch_size=BATCH_SIZE,
+    )
+    Purchase.objects.bulk_create(
+        [
+            Purchase(user_id=rng.choice(user_ids), book_id=rng.choice(book_ids),
+                     purchase_price=rng.randint(10, 500), delivery_address='Synthetic address')
+            for _ in range(count(purchases))
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    issued_books = []
+    for _ in range(count(loans)):
+        issued = today - timedelta(days=rng.randint(0, 365))
+        # About one loan in ten is still open
+        returned = None if rng.random() < 0.1 else issued + timedelta(days=rng.randint(1, 30))
+        issued_books.append(IssuedBook(user_id=rng.choice(user_ids), book_id=rng.choice(book_ids),
+                                issue_date=issued, due_date=issued + LOAN_PERIOD, return_date=returned))
+    IssuedBook.objects.bulk_create(issued_books, batch_size=BATCH_SIZE)
+    # One active membership per student, as memberships.subscribe() keeps it
+    memberships = []
+    for user_id in user_ids:
+        if rng.random() < 0.7:
+            start_date = today - timedelta(days=rng.randint(0, 29))
+            memberships.append(UserMembership(user_id=user_id, membership=rng.choice(tiers), start_date=start_date,
+                                              end_date=start_date + MEMBERSHIP_PERIOD))
+    UserMembership.objects.bulk_create(memberships, batch_size=BATCH_SIZE)
+    log(f"{count(payments)} payments, {count(rents)} rentals, {count(purchases)} purchases, {count(loans)} loans")
+
+    refresh_book_access()
+    counters.reconcile()
+    rollups.reconcile(rollups.first_day(), today)
+    return user_ids, book_ids
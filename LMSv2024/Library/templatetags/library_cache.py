@@ -0,0 +1,49 @@
+from django import template
+from django.template.base import token_kwargs
+
+from Library import caching
+
+register = template.Library()
+
+
+class CacheFragmentNode(template.Node):
+    def __init__(self, nodelist, name, models, kwargs):
+        self.nodelist = nodelist
+        self.name = name
+        self.models = models
+        self.kwargs = kwargs
+
+    def render(self, context):
+        name = self.name.resolve(context)
+        models = [model.resolve(context) for model in self.models]
+        vary = [self.kwargs['vary'].resolve(context)] if 'vary' in self.kwargs else []
+        timeout = self.kwargs['timeout'].resolve(context) if 'timeout' in self.kwargs else None
+        return caching.get_or_render(name, models, vary, lambda: self.nodelist.render(context), timeout)
+
+
+@register.tag
+def cachefragment(parser, token):
+    """
+    Cache the enclosed template until one of the listed models changes.
+
+        {% cachefragment 'catalogue' 'book' 'author' vary=request.get_full_path %}
+            ...
+        {% endcachefragment %}
+
+    ``vary`` separates entries (per user, per page); ``timeout`` overrides
+    ``LIBRARY_CACHE_TIMEOUT``. Everything the fragment needs should be lazy in
+    the view so a hit skips the queries as well as the rendering.
+    """
+    bits = token.split_contents()
+    positional = []
+    remaining = bits[1:]
+    while remaining and '=' not in remaining[0]:
+        positional.append(parser.compile_filter(remaining.pop(0)))
+    if len(positional) < 2:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' takes a fragment name and at least one model name.")
+    kwargs = token_kwargs(remaining, parser)
+    if remaining or set(kwargs) - {'vary', 'timeout'}:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' only accepts vary= and timeout= options.")
+    nodelist = parser.parse(('endcachefragment',))
+    parser.delete_first_token()
+    return CacheFragmentNode(nodelist, positional[0], positional[1:], kwargs)
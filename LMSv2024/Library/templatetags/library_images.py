@@ -0,0 +1,41 @@
+from django import template
+from django.utils.html import format_html
+
+from Library.images import rendition_url
+
+register = template.Library()
+
+
+@register.simple_tag
+def book_image(book, sizes='100vw', css_class='', style='', alt=None):
+    """
+    Render a book cover as a responsive ``<picture>``.
+
+    Browsers pick the smallest WebP (or JPEG) rendition that covers ``sizes``;
+    books whose renditions are not rendered yet fall back to the original file.
+
+        {% book_image book sizes="100px" style="max-width: 100px;" %}
+    """
+    if not book.book_image:
+        return ''
+    alt = book.title if alt is None else alt
+    widths = book.book_image_renditions
+    if not widths:
+        return format_html(
+            '<img src="{}" alt="{}" class="{}" style="{}" loading="lazy">',
+            book.book_image.url, alt, css_class, style,
+        )
+
+    name = book.book_image.name
+
+    def srcset(extension):
+        return ', '.join(f"{rendition_url(name, width, extension)} {width}w" for width in widths)
+
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" style="{}" loading="lazy">'
+        '</picture>',
+        srcset('webp'), sizes,
+        rendition_url(name, widths[0], 'jpg'), srcset('jpg'), sizes, alt, css_class, style,
+    )
@@ -1,3 +1,1175 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import Group, User
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, close_old_connections, transaction
+from django.test import TestCase, TransactionTestCase, modify_settings, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import (
+    async_views, autocomplete, benchmarks, caching, content, counters, deletion, exports, images, inventory, jobs,
+    memberships, overdue, payments, recommendations, rollups, search, synthetic,
+)
+from .access import refresh_book_access, split_books_by_access, split_books_for_user
+from .forms import CategoryForm
+from .importer import CatalogImporter, read_rows
+from .instrumentation import METRICS
+from .middleware import QueryBudgetExceeded
+from .roles import is_librarian, is_student
+from .templatetags.library_images import book_image
+from .models import (
+    ISBN, Author, BatchCheckpoint, Book, BookAccess, BookNeighbour, Category, DailyRollup, IssuedBook, Job, Language,
+    Membership, Payment, Purchase, Rent, UserMembership,
+)
+
+
+def create_catalog(librarian, books=30):
+    authors = [Author.objects.create(name=f"Author {i}") for i in range(5)]
+    categories = [Category.objects.create(name=f"Category {i}") for i in range(3)]
+    for i in range(books):
+        Book.objects.create(
+            title=f"Book {i}",
+            author=authors[i % len(authors)],
+            category=categories[i % len(categories)],
+            added_by=librarian,
+            isbn=ISBN.objects.create(isbn_number=f"{9780000000000 + i}"),
+            book_image='Book_image/book1.webp',
+            book_image_renditions=[100, 200],  # Keeps the rendition worker out of the tests
+            price=100,
+        )
+
+
+@modify_settings(MIDDLEWARE={'append': 'Library.middleware.QueryBudgetMiddleware'})
+@override_settings(LIBRARY_SEARCH_BACKEND='memory', LIBRARY_SEARCH_BACKGROUND_BUILD=False)
+class QueryBudgetTests(TestCase):
+    """List views must run a constant number of queries however many rows they show."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user('librarian', password='pw')
+        cls.librarian.groups.add(Group.objects.create(name='Librarian'))
+        cls.student = User.objects.create_user('student', password='pw')
+        cls.student.groups.add(Group.objects.create(name='Student'))
+        create_catalog(cls.librarian)
+        gold = Membership.objects.create(name='GOLD', price_per_month=10, book_access_percentage=50)
+        UserMembership.objects.create(user=cls.student, membership=gold)
+        refresh_book_access()
+        for book in Book.objects.all()[:10]:
+            Rent.objects.create(user=cls.student, book=book, rental_fee=10)
+            Purchase.objects.create(user=cls.student, book=book, delivery_address='x', purchase_price=100)
+
+    def test_librarian_views(self):
+        self.client.force_login(self.librarian)
+        for name in ('librarian_dashboard', 'manage_books', 'manage_authors', 'manage_categories', 'user_list'):
+            with self.subTest(view=name):
+                self.assertEqual(self.client.get(reverse(name)).status_code, 200)
+
+    def test_student_views(self):
+        self.client.force_login(self.student)
+        for name in ('student_dashboard', 'available_books', 'rent_list', 'purchase_list'):
+            with self.subTest(view=name):
+                self.assertEqual(self.client.get(reverse(name)).status_code, 200)
+
+    def test_student_dashboard_turns_librarians_away(self):
+        self.client.force_login(self.librarian)
+        self.assertEqual(self.client.get(reverse('student_dashboard')).status_code, 302)
+
+    async def test_budgets_are_counted_under_asgi(self):
+        await self.async_client.aforce_login(self.student)
+        for name in ('student_dashboard', 'available_books', 'rent_list', 'purchase_list'):
+            with self.subTest(view=name):
+                self.assertEqual((await self.async_client.get(reverse(name))).status_code, 200)
+        # The ORM runs in sync_to_async threads; its queries must still be seen
+        with mock.patch.object(async_views.rent_list, 'query_budget', 1), self.assertRaises(QueryBudgetExceeded):
+            await self.async_client.get(reverse('rent_list'))
+
+
+@override_settings(LIBRARY_PAGE_SIZE=7, LIBRARY_SEARCH_BACKEND='memory', LIBRARY_SEARCH_BACKGROUND_BUILD=False)
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user('librarian', password='pw')
+        cls.librarian.groups.add(Group.objects.create(name='Librarian'))
+        create_catalog(cls.librarian)
+        # A book without a category exercises NULL handling in the cursor
+        Book.objects.filter(title='Book 4').update(category=None)
+
+    def walk(self, params=None):
+        self.client.force_login(self.librarian)
+        params = dict(params or {})
+        titles, pages = [], []
+        while True:
+            page = self.client.get(reverse('manage_books'), params).context['page']
+            pages.append(page)
+            titles.extend(book.title for book in page)
+            if not page.has_next:
+                return titles, pages
+            params['after'] = page.next_cursor
+
+    def test_forward_walk_matches_full_ordering(self):
+        titles, pages = self.walk()
+        expected = sorted(
+            Book.objects.select_related('category'),
+            key=lambda b: (b.category is not None, b.category.name if b.category else '', b.title, b.id),
+        )
+        self.assertEqual(titles, [b.title for b in expected])
+        self.assertTrue(all(len(page) == 7 for page in pages[:-1]))
+
+    def test_previous_cursor_returns_same_page(self):
+        _, pages = self.walk()
+        second, third = pages[1], pages[2]
+        previous = self.client.get(reverse('manage_books'), {'before': third.previous_cursor}).context['page']
+        self.assertEqual([b.id for b in previous], [b.id for b in second])
+
+    def test_search_results_are_paged_by_rank(self):
+        titles, _ = self.walk({'q': 'book'})
+        self.assertEqual(len(titles), Book.objects.count())
+        self.assertEqual(len(set(titles)), len(titles))
+
+
+@override_settings(LIBRARY_SEARCH_BACKEND='memory', LIBRARY_SEARCH_BACKGROUND_BUILD=False, LIBRARY_SEARCH_REFRESH=0)
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user('librarian', password='pw')
+        cls.librarian.groups.add(Group.objects.create(name='Librarian'))
+        students = Group.objects.create(name='Student')
+        for i in range(5):
+            User.objects.create_user(f'sam{i}', password='pw')
+        cls.students = [User.objects.create_user(f'sam-student{i}', password='pw') for i in range(2)]
+        students.user_set.add(*cls.students)
+        create_catalog(cls.librarian, books=3)
+
+    def setUp(self):
+        search.reset_backend()
+        caching.get_cache().clear()
+
+    @override_settings(LIBRARY_SEARCH_LIMIT=3)
+    def test_limit_applies_to_students_only(self):
+        self.assertEqual(sorted(search.search_ids('student', 'sam')), sorted(user.pk for user in self.students))
+        self.client.force_login(self.librarian)
+        response = self.client.get(reverse('user_list'), {'q': 'sam'})
+        self.assertEqual({user.username for user in response.context['users']}, {'sam-student0', 'sam-student1'})
+
+    def test_missing_index_is_built_in_background(self):
+        with override_settings(LIBRARY_SEARCH_BACKGROUND_BUILD=True), \
+                mock.patch.object(search, '_build_in_background') as build:
+            ids = search.search_ids('book', 'book 1')
+            backend = search.get_backend()
+        build.assert_called_once_with(backend, 'book')
+        self.assertEqual(ids, [Book.objects.get(title='Book 1').pk])  # Answered from the database
+        self.assertFalse(backend.is_built('book'))
+
+    def test_writes_from_other_processes_trigger_a_rebuild(self):
+        search.search_ids('book', 'book')
+        Book.objects.filter(title='Book 2').update(title='Dune')  # No signal: as if written elsewhere
+        self.assertEqual(search.search_ids('book', 'dune'), [])
+        caching.bump(search.version_name('book'))
+        self.assertEqual(search.search_ids('book', 'dune'), [Book.objects.get(title='Dune').pk])
+
+    def test_own_writes_do_not_trigger_a_rebuild(self):
+        search.search_ids('book', 'book')
+        book = Book.objects.get(title='Book 2')
+        book.title = 'Dune'
+        with self.captureOnCommitCallbacks(execute=True):
+            book.save()
+        with mock.patch.object(search.InMemoryBackend, 'rebuild') as rebuild:
+            self.assertEqual(search.search_ids('book', 'dune'), [book.pk])
+        rebuild.assert_not_called()
+
+    def test_login_does_not_reindex_the_user(self):
+        with mock.patch.object(search, 'reindex') as reindex, self.captureOnCommitCallbacks(execute=True):
+            self.client.login(username='sam0', password='pw')
+        reindex.assert_not_called()
+
+
+class BookContentTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user('librarian', password='pw')
+        cls.librarian.groups.add(Group.objects.create(name='Librarian'))
+        create_catalog(cls.librarian, books=1)
+        cls.book = Book.objects.select_related('isbn').get()
+        # Multi-byte characters straddle chunk boundaries
+        cls.text = ''.join(f"Chapter {i} – ünïcode line\n" for i in range(5000))
+        content.write_content(cls.book.isbn, cls.text)
+
+    def setUp(self):
+        self.client.force_login(self.librarian)
+
+    def test_full_stream(self):
+        response = self.client.get(reverse('book_content', args=[self.book.id]))
+        self.assertEqual(response.status_code, 200)
+        body = b''.join(response.streaming_content)
+        self.assertEqual(body, self.text.encode('utf-8'))
+        self.assertEqual(response['Content-Length'], str(len(body)))
+
+    def test_byte_ranges(self):
+        data = self.text.encode('utf-8')
+        for header, expected in (
+            ('bytes=0-99', data[:100]),
+            ('bytes=16380-40000', data[16380:40001]),
+            ('bytes=-50', data[-50:]),
+            (f'bytes={len(data) - 10}-', data[-10:]),
+        ):
+            with self.subTest(range=header):
+                response = self.client.get(reverse('book_content', args=[self.book.id]), HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(b''.join(response.streaming_content), expected)
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(reverse('book_content', args=[self.book.id]), HTTP_RANGE='bytes=99999999-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_reader_pages(self):
+        response = self.client.get(reverse('read_book', args=[self.book.id]), {'page': 2})
+        self.assertEqual(response.context['page_text'], self.text[content.CHUNK_CHARS:2 * content.CHUNK_CHARS])
+        self.assertEqual(response.context['total_pages'], self.book.isbn.content_chunk_count)
+
+
+@override_settings(MEDIA_URL='/media/')
+class BookImageTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.librarian = User.objects.create_user('librarian', password='pw')
+
+    def upload(self, width=500, height=300):
+        buffer = io.BytesIO()
+        Image.new('RGB', (width, height), 'teal').save(buffer, 'JPEG')
+        return SimpleUploadedFile('cover.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_renditions_are_rendered_by_one_keyed_job(self):
+        author = Author.objects.create(name="Frank Herbert")
+        book = Book.objects.create(title="Dune", author=author, added_by=self.librarian, book_image=self.upload())
+        book.save()  # Still unrendered: must not queue a second render
+        name = book.book_image.name
+        self.assertEqual(list(Job.objects.values_list('kind', 'key')), [('render_book_image', f'render:{name}')])
+
+        self.assertEqual(jobs.drain(), (1, 0))
+        book.refresh_from_db()
+        self.assertEqual(book.book_image_renditions, [100, 200, 400])  # None wider than the original
+        storage = images.book_image_storage()
+        for width in (100, 200, 400):
+            for extension in ('webp', 'jpg'):
+                with storage.open(images.rendition_name(name, width, extension)) as rendition:
+                    self.assertEqual(Image.open(rendition).size, (width, round(300 * width / 500)))
+
+    def test_failed_render_is_retried_with_backoff(self):
+        author = Author.objects.create(name="Frank Herbert")
+        corrupt = SimpleUploadedFile('cover.jpg', b'not an image', content_type='image/jpeg')
+        Book.objects.create(title="Dune", author=author, added_by=self.librarian, book_image=corrupt)
+        self.assertEqual(jobs.drain(), (0, 1))
+        job = Job.objects.get(kind='render_book_image')
+        self.assertEqual(job.status, Job.PENDING)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn('UnidentifiedImageError', job.last_error)
+
+    def test_keyed_jobs_never_run_together(self):
+        first = jobs.enqueue('render_book_image', key='render:x', image_name='x')
+        first.status = Job.RUNNING
+        first.save()
+        second = jobs.enqueue('render_book_image', key='render:x', image_name='x')
+        self.assertNotEqual(first.pk, second.pk)
+        self.assertEqual(jobs.claim('worker'), [])
+        Job.objects.filter(pk=first.pk).delete()
+        self.assertEqual(jobs.claim('worker'), [second])
+
+    def test_srcset_lists_every_rendition(self):
+        book = Book(title="Dune", book_image='Book_image/abc.jpg', book_image_renditions=[100, 200])
+        html = book_image(book, sizes='100px')
+        self.assertIn(
+            'srcset="/media/Book_image/renditions/abc-100.webp 100w, /media/Book_image/renditions/abc-200.webp 200w"',
+            html,
+        )
+        self.assertIn('src="/media/Book_image/renditions/abc-100.jpg"', html)
+        self.assertIn('sizes="100px"', html)
+        book.book_image_renditions = []
+        self.assertEqual(book_image(book), '<img src="/media/Book_image/abc.jpg" alt="Dune" class="" style="" loading="lazy">')
+
+
+class BookAccessTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user('librarian', password='pw')
+        create_catalog(cls.librarian, books=23)
+        cls.gold = Membership.objects.create(name='GOLD', price_per_month=10, book_access_percentage=30)
+        cls.platinum = Membership.objects.create(name='PLATINUM', price_per_month=20, book_access_percentage=60)
+        cls.diamond = Membership.objects.create(name='DIAMOND', price_per_month=30, book_access_percentage=100)
+
+    def assertMatchesPercentages(self):
+        refresh_book_access()
+        ids = list(Book.objects.order_by('id').values_list('id', flat=True))
+        for tier in Membership.objects.all():
+            expected = ids[:len(ids) * tier.book_access_percentage // 100]
+            accessible, rent = split_books_by_access(Book.objects.all(), UserMembership(membership=tier))
+            self.assertEqual(sorted(accessible.values_list('id', flat=True)), expected)
+            self.assertEqual(sorted(rent.values_list('id', flat=True)), ids[len(expected):])
+
+    def test_mapping_follows_catalogue_and_tier_changes(self):
+        self.assertMatchesPercentages()
+        Book.objects.order_by('id').first().delete()
+        self.assertMatchesPercentages()
+        self.platinum.book_access_percentage = 20
+        self.platinum.save()
+        self.assertMatchesPercentages()
+
+    def test_new_book_is_mapped_without_a_refresh(self):
+        refresh_book_access()
+        author, category = Author.objects.first(), Category.objects.first()
+        with mock.patch('Library.access.refresh_book_access') as refresh, self.captureOnCommitCallbacks(execute=True):
+            book = Book.objects.create(title="New", author=author, category=category, added_by=self.librarian,
+                                       book_image_renditions=[100])
+        refresh.assert_not_called()
+        self.assertEqual(BookAccess.objects.get(book=book).membership, self.diamond)
+        self.platinum.delete()  # Tier changes still recompute everything
+        self.assertMatchesPercentages()
+
+    def test_subquery_split_matches_loaded_membership(self):
+        refresh_book_access()
+        student = User.objects.create_user('student', password='pw')
+        for tier in (None, self.gold, self.diamond):
+            if tier:
+                UserMembership.objects.create(user=student, membership=tier)
+            expected = split_books_by_access(Book.objects.all(), UserMembership.objects.for_user(student).active().first())
+            actual = split_books_for_user(Book.objects.all(), student)
+            for want, got in zip(expected, actual):
+                self.assertEqual(sorted(got.values_list('id', flat=True)), sorted(want.values_list('id', flat=True)))
+
+
+class RoleResolutionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.librarians = Group.objects.create(name='Librarian')
+        self.user = User.objects.create_user('someone', password='pw')
+
+    def fresh_user(self):
+        return User.objects.get(pk=self.user.pk)
+
+    def test_roles_are_cached_across_requests(self):
+        self.user.groups.add(self.librarians)
+        self.assertTrue(is_librarian(self.fresh_user()))
+        user = self.fresh_user()
+        with self.assertNumQueries(0):
+            self.assertTrue(is_librarian(user))
+            self.assertFalse(is_student(user))
+
+    def test_group_changes_invalidate_cache(self):
+        self.assertFalse(is_librarian(self.fresh_user()))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.librarians.user_set.add(self.user)
+        self.assertTrue(is_librarian(self.fresh_user()))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.clear()
+        self.assertFalse(is_librarian(self.fresh_user()))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(self.librarians)
+            self.librarians.user_set.clear()
+        self.assertFalse(is_librarian(self.fresh_user()))
+
+
+@override_settings(LIBRARY_SEARCH_BACKEND='memory', LIBRARY_SEARCH_BACKGROUND_BUILD=False,
+                   LIBRARY_AUTOCOMPLETE_BACKGROUND_BUILD=False)
+class AutocompleteTests(TestCase):
+    def setUp(self):
+        autocomplete.reset()
+        self.librarian = User.objects.create_user('librarian', password='pw')
+        self.librarian.groups.add(Group.objects.create(name='Librarian'))
+        students = Group.objects.create(name='Student')
+        for name in ('alice', 'alan'):
+            User.objects.create_user(name, password='pw').groups.add(students)
+        author = Author.objects.create(name='J. K. Rowling')
+        for i, title in enumerate(('Harry Potter', 'Pottery for Beginners', 'Pride and Prejudice')):
+            Book.objects.create(title=title, author=author, added_by=self.librarian, price=10,
+                                isbn=ISBN.objects.create(isbn_number=f'{9780000000000 + i}'),
+                                book_image='Book_image/book1.webp', book_image_renditions=[100])
+
+    def labels(self, kind, prefix):
+        return [label for _, label in autocomplete.complete(kind, prefix)]
+
+    def test_completes_any_word_start_from_memory(self):
+        self.assertEqual(self.labels('book', 'pot'), ['Pottery for Beginners', 'Harry Potter'])
+        self.assertEqual(self.labels('author', 'rowl'), ['J. K. Rowling'])
+        self.assertEqual(self.labels('user', 'al'), ['alan', 'alice'])  # Not the librarian
+        with self.assertNumQueries(0):  # Loaded now
+            self.assertEqual(self.labels('book', '  PRIDE and'), ['Pride and Prejudice'])
+            self.assertEqual(self.labels('book', 'x'), [])
+
+    def test_index_follows_writes(self):
+        self.labels('book', 'pot')
+        self.labels('user', 'al')
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.filter(title='Harry Potter').get().delete()
+            book = Book.objects.get(title='Pride and Prejudice')
+            book.title = 'Potted Plants'
+            book.save()
+            User.objects.get(username='alan').groups.clear()
+        self.assertEqual(self.labels('book', 'pot'), ['Potted Plants', 'Pottery for Beginners'])
+        self.assertEqual(self.labels('book', 'pride'), [])
+        self.assertEqual(self.labels('user', 'al'), ['alice'])
+
+    def test_entries_are_capped(self):
+        index = autocomplete.PrefixIndex.build([(1, 'one two three'), (2, 'four five')], max_entries=4)
+        self.assertEqual(len(index.keys), 3)
+        self.assertEqual(index.complete('four'), [])
+
+    def test_expired_index_is_only_reloaded_when_its_version_moved(self):
+        index = autocomplete.get_index('book')
+        index.checked_at -= autocomplete.TTL + 1
+        with self.assertNumQueries(0):
+            self.assertIs(autocomplete.get_index('book'), index)
+        Book.objects.filter(title='Harry Potter').update(title='Potions')  # As another process would
+        caching.bump('book')
+        index.checked_at -= autocomplete.TTL + 1
+        self.assertEqual(self.labels('book', 'pot'), ['Potions', 'Pottery for Beginners'])
+
+    @override_settings(LIBRARY_AUTOCOMPLETE_MAX_ENTRIES=5)
+    def test_capped_index_keeps_the_oldest_objects(self):
+        self.assertEqual(self.labels('book', 'p'), ['Pottery for Beginners', 'Harry Potter'])
+
+    def test_endpoint(self):
+        self.client.force_login(self.librarian)
+        response = self.client.get(reverse('autocomplete', args=['book']), {'q': 'harry'})
+        self.assertEqual(response.json(), {'results': [{'id': Book.objects.get(title='Harry Potter').pk,
+                                                        'label': 'Harry Potter'}]})
+        self.assertEqual(self.client.get(reverse('autocomplete', args=['isbn'])).status_code, 404)
+        self.client.force_login(User.objects.get(username='alice'))
+        self.assertEqual(self.client.get(reverse('autocomplete', args=['user']), {'q': 'a'}).status_code, 403)
+
+
+class BookCounterTests(TestCase):
+    def setUp(self):
+        self.librarian = User.objects.create_user('librarian', password='pw')
+        create_catalog(self.librarian, books=10)
+
+    def counts(self, model):
+        return dict(model.objects.values_list('name', 'book_count'))
+
+    def test_counts_follow_book_writes(self):
+        self.assertEqual(self.counts(Author)['Author 0'], 2)
+        self.assertEqual(self.counts(Category), {'Category 0': 4, 'Category 1': 3, 'Category 2': 3})
+        book = Book.objects.select_related('isbn').get(title='Book 0')
+        book.author = Author.objects.get(name='Author 1')
+        book.category = None
+        with self.assertNumQueries(4):  # The book, then one move per changed counter
+            book.save(update_fields=['author', 'category'])
+        book.save()  # Nothing changed, no counter touched
+        self.assertEqual((self.counts(Author)['Author 0'], self.counts(Author)['Author 1']), (1, 3))
+        self.assertEqual(self.counts(Category)['Category 0'], 3)
+        Book.objects.filter(title__in=['Book 1', 'Book 6']).delete()
+        self.assertEqual(self.counts(Author)['Author 1'], 1)
+        self.assertEqual((self.counts(Category)['Category 0'], self.counts(Category)['Category 1']), (2, 2))
+        # Not loaded from the database: the previous keys are read back first
+        Book(pk=book.pk, title='Book 0', author_id=book.author_id, category_id=Category.objects.get(name='Category 2').pk,
+             added_by=self.librarian, isbn=book.isbn).save()
+        self.assertEqual(self.counts(Category)['Category 2'], 4)
+        self.assertEqual(counters.reconcile(), 0)
+
+    def test_reconcile_and_most_books_listing(self):
+        Author.objects.update(book_count=0)
+        Book.objects.filter(title='Book 2').update(author=Author.objects.get(name='Author 4'))  # No signals
+        self.assertEqual(counters.reconcile(), 5)
+        self.assertEqual(self.counts(Author), {'Author 0': 2, 'Author 1': 2, 'Author 2': 1, 'Author 3': 2, 'Author 4': 3})
+        response = self.client.get(reverse('manage_authors'), {'sort': 'books'})
+        self.assertEqual([author.name for author in response.context['authors']][:2], ['Author 4', 'Author 0'])
+        response = self.client.get(reverse('manage_categories'), {'sort': 'books'})
+        self.assertEqual([category.name for category in response.context['categories']][0], 'Category 0')
+
+
+@override_settings(LIBRARY_SEARCH_BACKGROUND_BUILD=False)
+class CatalogImportTests(TestCase):
+    FEED = (
+        "title,author,category,language,isbn,quantity,price\n"
+        "Dune,Frank Herbert,Fiction,English,9780441013593,3,12.50\n"
+        "Emma,Jane Austen,Fiction,English,,1,8\n"
+        "Dune,Frank Herbert,Fiction,English,9780441013593,3,12.50\n"
+        ",Nobody,Fiction,English,,1,1\n"
+        "Persuasion,Jane Austen,Classics,English,,2,not-a-price\n"
+    )
+
+    def setUp(self):
+        self.librarian = User.objects.create_user('librarian', password='pw')
+
+    def run_import(self, feed, chunk_size=2):
+        return CatalogImporter(self.librarian, chunk_size=chunk_size).run(read_rows(io.StringIO(feed), 'csv'))
+
+    def test_import_resolves_lookups_and_skips_duplicates(self):
+        search.reset_backend()
+        search.search_ids('book', 'dune')  # Build the index so the import has to update it
+        with self.captureOnCommitCallbacks(execute=True):
+            report = self.run_import(self.FEED)
+        self.assertEqual((report.rows, report.created, report.duplicates, report.error_count), (5, 2, 1, 2))
+        self.assertEqual(Author.objects.count(), 2)
+        dune = Book.objects.get(title='Dune')
+        self.assertEqual((dune.author.name, dune.category.name, dune.isbn.isbn_number), ('Frank Herbert', 'Fiction', '9780441013593'))
+        self.assertTrue(BookAccess.objects.filter(book=dune).exists())
+        self.assertIn(dune.id, search.search_ids('book', 'dune'))
+        self.assertEqual(Category.objects.get(name='Fiction').book_count, 2)
+        self.assertEqual(Language.objects.get(name='English').book_count, 2)
+
+        report = self.run_import(self.FEED)
+        self.assertEqual((report.created, report.duplicates), (0, 3))
+        self.assertEqual(Book.objects.count(), 2)
+
+    def test_isbns_are_normalised_before_validation(self):
+        report = self.run_import(
+            "title,author,isbn\n"
+            "Dune,Frank Herbert,978-0-441-01359-3\n"
+            "Emma,Jane Austen,0 14 143958 X\n"
+            "Kim,Rudyard Kipling,978-0-441-ABCDE-3\n"
+        )
+        self.assertEqual((report.created, report.errors), (2, [(4, 'isbn must have 10 or 13 digits')]))
+        self.assertEqual(
+            sorted(Book.objects.values_list('isbn__isbn_number', flat=True)), ['014143958X', '9780441013593'],
+        )
+
+    def test_rows_dropped_as_conflicts_are_not_counted(self):
+        bulk_create = Book.objects.bulk_create
+
+        def conflicting_bulk_create(books, **kwargs):
+            # As when another transaction inserted the first book since the duplicate check
+            return bulk_create(books[1:], **kwargs)
+
+        with mock.patch.object(Book.objects, 'bulk_create', conflicting_bulk_create):
+            report = self.run_import("title,author\nDune,Frank Herbert\nChildren of Dune,Frank Herbert\n")
+        self.assertEqual((report.created, report.duplicates), (1, 1))
+
+
+    def test_prices_that_do_not_fit_are_row_errors(self):
+        report = self.run_import(
+            "title,author,price\nDune,Frank Herbert,NaN\nEmma,Jane Austen,Infinity\n"
+            "Kim,Rudyard Kipling,1e12\nMiddlemarch,George Eliot,99999999.99\n"
+        )
+        self.assertEqual(report.created, 1)
+        self.assertEqual([message for _, message in report.errors], [
+            'quantity and price must be numbers', 'quantity and price must be numbers',
+            'price must be less than 100000000',
+        ])
+
+    def test_unreadable_file_stops_with_a_file_error(self):
+        self.librarian.groups.add(Group.objects.create(name='Librarian'))
+        self.client.force_login(self.librarian)
+        body = "title,author\n" + ''.join(f"Book {i},Author {i}\n" for i in range(1000))
+        feed = SimpleUploadedFile('feed.csv', body.encode() + b'Caf\xe9,Nobody\n', content_type='text/csv')
+        response = self.client.post(reverse('import_books'), {'feed': feed, 'file_format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('not UTF-8', response.context['report'].file_error)
+        self.assertEqual(Book.objects.count(), response.context['report'].created)
+        self.assertGreater(Book.objects.count(), 0)
+        report = self.run_import(f"title,author,description\nDune,Frank Herbert\nEmma,Jane Austen,{'x' * 200000}\n")
+        self.assertEqual(report.created, 1)
+        self.assertIn('Malformed CSV after line 2: field larger than field limit', report.file_error)
+
+@override_settings(LIBRARY_SEARCH_BACKEND='memory', LIBRARY_SEARCH_BACKGROUND_BUILD=False)
+class ExportTests(TestCase):
+    def setUp(self):
+        self.librarian = User.objects.create_user('librarian', password='pw')
+        self.librarian.groups.add(Group.objects.create(name='Librarian'))
+        create_catalog(self.librarian, books=450)
+        student = User.objects.create_user('alice', password='pw')
+        student.groups.add(Group.objects.create(name='Student'))
+        Payment.objects.create(user=student, amount=10, payment_type='Membership', payment_method='UPI')
+        Payment.objects.create(user=student, amount=5, payment_type='Rent', payment_method='Card')
+        self.client.force_login(self.librarian)
+
+    def download(self, name, **params):
+        response = self.client.get(reverse('export_data', args=[name]), params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_books_export_streams_every_row_in_import_format(self):
+        rows = list(csv.DictReader(io.StringIO(self.download('books').decode())))
+        self.assertEqual(len(rows), 450)
+        self.assertEqual((rows[0]['title'], rows[0]['author'], rows[0]['category']), ('Book 0', 'Author 0', 'Category 0'))
+
+        rows = list(csv.DictReader(io.StringIO(self.download('books', category='Category 1').decode())))
+        self.assertEqual(len(rows), 150)
+
+    def test_rows_are_read_in_keyset_chunks(self):
+        with mock.patch.object(exports, 'CHUNK_SIZE', 100), self.assertNumQueries(5):
+            ids = [row[0] for row in exports.EXPORTS['books'].rows()]
+        self.assertEqual(ids, sorted(Book.objects.values_list('id', flat=True)))
+
+    @override_settings(LIBRARY_EXPORT_SEARCH_LIMIT=100)
+    def test_searches_over_the_limit_are_refused(self):
+        response = self.client.get(reverse('export_data', args=['books']), {'q': 'Book'})
+        self.assertEqual(response.status_code, 400)
+        self.assertContains(response, 'more than 100 rows', status_code=400)
+        rows = list(csv.DictReader(io.StringIO(self.download('books', q='Book 10').decode())))
+        self.assertIn('Book 10', [row['title'] for row in rows])
+
+    def test_filtered_gzip_json_export(self):
+        body = gzip.decompress(self.download('payments', format='json', gzip='on', q='alice', payment_method='UPI'))
+        self.assertEqual([(row['username'], row['amount']) for row in json.loads(body)], [('alice', '10.00')])
+        self.assertEqual(json.loads(self.download('payments', format='json', q='nobody')), [])
+        lines = self.download('students', format='jsonl').decode().splitlines()
+        self.assertEqual([json.loads(line)['username'] for line in lines], ['alice'])
+
+    def test_exports_are_for_librarians(self):
+        self.client.force_login(User.objects.get(username='alice'))
+        response = self.client.get(reverse('export_data', args=['payments']))
+        self.assertEqual(response.status_code, 302)
+
+
+class InventoryConcurrencyTests(TransactionTestCase):
+    COPIES = 5
+    BUYERS = 40
+
+    def setUp(self):
+        librarian = User.objects.create_user('librarian', password='pw')
+        self.buyers = User.objects.bulk_create(User(username=f'student{i}') for i in range(self.BUYERS))
+        create_catalog(librarian, books=1)
+        self.book = Book.objects.get()
+        Book.objects.filter(pk=self.book.pk).update(quantity=self.COPIES)
+
+    def attempt(self, index):
+        try:
+            user = self.buyers[index]
+            if index % 2:
+                inventory.rent(user, self.book)
+            else:
+                inventory.purchase(user, self.book, 'Somewhere')
+            return True
+        except inventory.OutOfStock:
+            return False
+        finally:
+            close_old_connections()
+
+    def test_concurrent_buyers_never_oversell(self):
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            results = list(pool.map(self.attempt, range(self.BUYERS)))
+        self.assertEqual(results.count(True), self.COPIES)
+        self.assertEqual(Rent.objects.count() + Purchase.objects.count(), self.COPIES)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.quantity, 0)
+
+    def test_failed_write_releases_the_copy(self):
+        with self.assertRaises(IntegrityError):
+            inventory.purchase(self.buyers[0], self.book, None)  # delivery_address is NOT NULL
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.quantity, self.COPIES)
+
+
+class PaymentRecordingTests(TestCase):
+    def setUp(self):
+        librarian = User.objects.create_user('librarian', password='pw')
+        self.student = User.objects.create_user('student', password='pw')
+        create_catalog(librarian, books=1)
+        self.book = Book.objects.get()
+        Book.objects.filter(pk=self.book.pk).update(quantity=3)
+
+    def test_replayed_key_charges_once(self):
+        payment, created = payments.pay_rent(self.student, self.book, idempotency_key='rent-1')
+        replayed, replay_created = payments.pay_rent(self.student, self.book, idempotency_key='rent-1')
+        self.assertTrue(created)
+        self.assertFalse(replay_created)
+        self.assertEqual(replayed, payment)
+        self.assertEqual(Rent.objects.get().payment, payment)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.quantity, 2)
+
+        with self.assertRaises(payments.IdempotencyConflict):
+            payments.charge(self.student, 999, 'Rent', idempotency_key='rent-1')
+
+    def test_losing_a_race_returns_the_winners_payment(self):
+        winner, _ = payments.pay_rent(self.student, self.book, idempotency_key='rent-1')
+        replayed = payments._replayed
+
+        def first_lookup_misses(*args, locking=False):
+            # As when the winner committed after this request's first lookup
+            return replayed(*args, locking=True) if locking else None
+
+        with mock.patch.object(payments, '_replayed', first_lookup_misses):
+            payment, created = payments.pay_rent(self.student, self.book, idempotency_key='rent-1')
+        self.assertEqual((payment, created), (winner, False))
+        self.assertEqual(Rent.objects.count(), 1)
+
+    def test_purchase_form_double_submit(self):
+        self.client.force_login(self.student)
+        key = self.client.get(reverse('purchase_book', args=[self.book.pk])).context['idempotency_key']
+        for _ in range(2):
+            self.client.post(reverse('purchase_book', args=[self.book.pk]), {'address': 'Here', 'idempotency_key': key})
+        self.assertEqual(Purchase.objects.count(), 1)
+        self.assertEqual(Payment.objects.get().payment_type, 'Purchase')
+
+    def test_reused_key_on_another_form_is_turned_away(self):
+        self.student.groups.add(Group.objects.create(name='Student'))
+        self.client.force_login(self.student)
+        key = self.client.get(reverse('purchase_book', args=[self.book.pk])).context['idempotency_key']
+        self.client.post(reverse('purchase_book', args=[self.book.pk]), {'address': 'Here', 'idempotency_key': key})
+        gold = Membership.objects.create(name='GOLD', price_per_month=10, book_access_percentage=30)
+        response = self.client.post(reverse('take_membership', args=[gold.pk]),
+                                    {'payment_method': 'UPI', 'idempotency_key': key}, follow=True)
+        self.assertEqual([str(message) for message in response.context['messages']],
+                         ["This link has expired, please try again."])
+        self.assertFalse(UserMembership.objects.exists())
+
+    def test_batch_skips_recorded_keys(self):
+        payments.charge(self.student, 10, 'Membership', idempotency_key='feed-0')
+        entries = [
+            {'user_id': self.student.pk, 'amount': 10, 'payment_type': 'Membership', 'idempotency_key': f'feed-{i % 5}'}
+            for i in range(8)
+        ]
+        report = payments.record_payments(entries, chunk_size=3)
+        self.assertEqual((report.created, report.duplicates), (4, 4))
+        self.assertEqual(set(report.payments), {f'feed-{i}' for i in range(5)})
+        self.assertEqual(Payment.objects.count(), 5)
+        self.assertEqual(DailyRollup.objects.get(dimension=DailyRollup.REVENUE).count, 4)  # The batch's own
+        jobs.drain()
+        self.assertEqual(DailyRollup.objects.get(dimension=DailyRollup.REVENUE).count, 5)
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.student = User.objects.create_user('student', password='pw', email='student@example.com')
+
+    def test_side_effects_wait_for_the_workers(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            payments.charge(self.student, 10, 'Rent')
+            raise RuntimeError  # A rolled back payment queues nothing
+        self.assertFalse(Job.objects.exists())
+
+        payment, _ = payments.charge(self.student, 10, 'Rent')
+        self.assertEqual(sorted(Job.objects.values_list('kind', flat=True)), ['record_rollups', 'send_receipt'])
+        self.assertFalse(DailyRollup.objects.exists())
+        self.assertEqual(jobs.drain(), (2, 0))
+        self.assertEqual(DailyRollup.objects.get().count, 1)
+        self.assertIn(f'Receipt number: {payment.pk}', mail.outbox[0].body)
+        self.assertFalse(Job.objects.exists())
+
+    @override_settings(LIBRARY_JOB_MAX_ATTEMPTS=2)
+    def test_failures_back_off_then_stop(self):
+        failing = mock.Mock(side_effect=ValueError('boom'))
+        with mock.patch.dict(jobs.HANDLERS, {'flaky': failing}), self.assertLogs('Library.jobs', 'WARNING'):
+            job = jobs.enqueue('flaky', n=1)
+            self.assertEqual(jobs.run_pending(), (0, 1))
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts, job.last_error), (Job.PENDING, 1, 'ValueError: boom'))
+            self.assertEqual(jobs.run_pending(), (0, 0))  # Not due yet
+
+            Job.objects.update(run_after=job.created_at)
+            self.assertEqual(jobs.run_pending(), (0, 1))
+            job.refresh_from_db()
+            self.assertEqual(job.status, Job.FAILED)
+        failing.assert_called_with(n=1)
+
+    def test_expired_lease_is_taken_over_once(self):
+        job = jobs.enqueue('record_rollups', model='payment', pk=0)
+        [stale] = jobs.claim('worker-a')
+        Job.objects.update(locked_at=stale.locked_at - timedelta(hours=1))
+        [current] = jobs.claim('worker-b') if jobs.requeue_expired() else []
+        self.assertEqual(current.pk, job.pk)
+        self.assertIsNone(jobs.run_job(stale))
+        self.assertTrue(jobs.run_job(current))
+
+
+@override_settings(LIBRARY_PURGE_CHUNK_SIZE=3, LIBRARY_PURGE_PAUSE=0)
+class SoftDeleteTests(TestCase):
+    def setUp(self):
+        self.librarian = User.objects.create_user('librarian', password='pw')
+        self.librarian.groups.add(Group.objects.create(name='Librarian'))
+        create_catalog(self.librarian, books=10)
+        self.author = Author.objects.get(name='Author 0')  # Books 0 and 5
+        student = User.objects.create_user('student', password='pw')
+        for book in Book.objects.all():
+            Rent.objects.create(user=student, book=book, rental_fee=10)
+            Rent.objects.create(user=student, book=book, rental_fee=10)
+            Purchase.objects.create(user=student, book=book, delivery_address='x', purchase_price=100)
+        jobs.drain()
+        self.client.force_login(self.librarian)
+
+    def test_author_is_hidden_at_once_and_purged_in_chunks(self):
+        with self.assertNumQueries(16):  # Stamps and recounts only, however many rows hang off the author
+            self.client.get(reverse('delete_author', args=[self.author.pk]))
+        self.assertFalse(Author.objects.filter(pk=self.author.pk).exists())
+        self.assertEqual(Book.objects.count(), 8)
+        self.assertEqual(Category.objects.get(name='Category 0').book_count, 3)  # Lost Book 0
+        self.assertEqual(Rent.objects.count(), 20)  # History stays until the purge
+
+        succeeded, failed = jobs.drain()
+        self.assertEqual((succeeded, failed), (6, 0))  # Rents in chunks of 3 and 1, purchases, access rows, books, the author
+        self.assertFalse(Author.all_objects.filter(pk=self.author.pk).exists())
+        self.assertFalse(Book.all_objects.filter(author_id=self.author.pk).exists())
+        self.assertEqual((Rent.objects.count(), Purchase.objects.count()), (16, 8))
+        checkpoint = BatchCheckpoint.objects.get(job=f'purge:author:{self.author.pk}')
+        self.assertEqual((checkpoint.processed, checkpoint.finished), (11, True))
+        self.assertEqual(counters.reconcile(), 0)
+
+    def test_authors_books_leave_the_completions_at_once(self):
+        autocomplete.reset()
+        self.assertEqual([label for _, label in autocomplete.complete('book', 'book 5')], ['Book 5'])
+        with self.captureOnCommitCallbacks(execute=True):
+            deletion.soft_delete(self.author)
+        self.assertEqual(autocomplete.complete('book', 'book 5'), [])
+
+    def test_category_purge_keeps_its_books(self):
+        category = Category.objects.get(name='Category 1')
+        self.client.get(reverse('delete_category', args=[category.pk]))
+        form = CategoryForm({'name': 'Category 1'})
+        self.assertIn('still being removed', form.errors['name'][0])
+        jobs.drain()
+        self.assertEqual(Book.objects.filter(category=None).count(), 3)
+        self.assertTrue(CategoryForm({'name': 'Category 1'}).is_valid())
+
+
+@modify_settings(MIDDLEWARE={'append': 'Library.middleware.QueryBudgetMiddleware'})
+class RecommendationTests(TestCase):
+    def setUp(self):
+        librarian = User.objects.create_user('librarian', password='pw')
+        create_catalog(librarian, books=4)
+        self.books = list(Book.objects.order_by('id'))
+        self.students = [User.objects.create_user(f'student{i}', password='pw') for i in range(3)]
+        self.students[0].groups.add(Group.objects.create(name='Student'))
+        a, b, c, d = self.books
+        # Two readers share a and b, only one shares a and c
+        for student, books in zip(self.students, ([a], [a, b], [a, b, c])):
+            for book in books:
+                Rent.objects.create(user=student, book=book, rental_fee=10)
+        IssuedBook.objects.create(user=self.students[1], book=d)
+
+    def test_neighbours_need_shared_readers(self):
+        self.assertEqual(recommendations.build_neighbours(min_support=2), 2)
+        a, b = self.books[:2]
+        self.assertEqual(
+            set(BookNeighbour.objects.values_list('book', 'neighbour', 'score')),
+            {(a.pk, b.pk, round(2 / 6 ** 0.5, 6)), (b.pk, a.pk, round(2 / 6 ** 0.5, 6))},
+        )
+
+    def test_strip_skips_books_already_read(self):
+        recommendations.build_neighbours(min_support=1)
+        with self.assertNumQueries(1):
+            strip = list(recommendations.for_user(self.students[0]))
+        self.assertEqual(strip[:2], self.books[1:3])  # b ranks above c
+        self.assertNotIn(self.books[0], strip)
+
+        self.client.force_login(self.students[0])
+        response = self.client.get(reverse('available_books'))
+        self.assertContains(response, 'Readers also rented')
+        self.assertContains(response, f'?key={response.context["rent_key"]}-{self.books[1].pk}')
+
+
+@override_settings(LIBRARY_FINE_PER_DAY='0.50', LIBRARY_FINE_CAP='5.00')
+class OverdueProcessingTests(TestCase):
+    TODAY = date(2026, 3, 1)
+
+    def setUp(self):
+        librarian = User.objects.create_user('librarian', password='pw')
+        self.student = User.objects.create_user('student', password='pw')
+        create_catalog(librarian, books=2)
+        self.books = list(Book.objects.order_by('id'))
+        Book.objects.update(quantity=0)
+        for days_ago, book in ((3, self.books[0]), (2, self.books[0]), (1, self.books[1]), (0, self.books[1])):
+            Rent.objects.create(user=self.student, book=book, rental_fee=10, end_date=self.TODAY - timedelta(days=days_ago))
+        for days_ago in (2, 30, 0):
+            IssuedBook.objects.create(user=self.student, book=self.books[0], due_date=self.TODAY - timedelta(days=days_ago))
+        IssuedBook.objects.create(user=self.student, book=self.books[1], due_date=self.TODAY - timedelta(days=9),
+                                  return_date=self.TODAY)
+
+    def test_rentals_expire_and_return_their_copies(self):
+        checkpoint = overdue.expire_rentals(self.TODAY, chunk_size=2)
+        self.assertTrue(checkpoint.finished)
+        self.assertEqual(checkpoint.processed, 3)
+        self.assertEqual(Rent.objects.filter(expired=True).count(), 3)
+        self.assertEqual(list(Book.objects.order_by('id').values_list('quantity', flat=True)), [2, 1])
+
+        # A second run for the same day is a no-op
+        overdue.expire_rentals(self.TODAY, chunk_size=2, restart=True)
+        self.assertEqual(list(Book.objects.order_by('id').values_list('quantity', flat=True)), [2, 1])
+
+    def test_fines_are_charged_on_open_overdue_loans(self):
+        overdue.assess_fines(self.TODAY, chunk_size=1)
+        fines = sorted(IssuedBook.objects.values_list('due_date', 'fine'))
+        self.assertEqual([fine for _, fine in fines], [Decimal('5.00'), Decimal('0'), Decimal('1.00'), Decimal('0')])
+
+    def test_interrupted_run_resumes_after_last_committed_chunk(self):
+        chunks = []
+        state = {'crash': True}
+
+        def process(rows):
+            if state['crash'] and len(chunks) == 2:
+                raise RuntimeError('worker killed')
+            chunks.append([row['id'] for row in rows])
+
+        def run():
+            return overdue.run_batch('test', self.TODAY, Rent.objects.all(), ('end_date', 'id'), (), process, chunk_size=1)
+
+        with self.assertRaises(RuntimeError):
+            run()
+        self.assertEqual(BatchCheckpoint.objects.get(job='test').processed, 2)
+        state['crash'] = False
+        self.assertEqual(run().processed, 4)
+        self.assertEqual(sorted(sum(chunks, [])), sorted(Rent.objects.values_list('id', flat=True)))
+
+
+class MembershipLifecycleTests(TestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+        self.gold = Membership.objects.create(name='GOLD', price_per_month=10, book_access_percentage=30)
+        self.diamond = Membership.objects.create(name='DIAMOND', price_per_month=30, book_access_percentage=100)
+        self.students = User.objects.bulk_create(User(username=f'student{i}') for i in range(4))
+
+    def test_nightly_run_expires_and_renews_in_bulk(self):
+        today = date.today()
+        for student, ended, auto_renew in zip(self.students, (3, 1, 1, -5), (True, False, True, True)):
+            UserMembership.objects.create(user=student, membership=self.gold, start_date=today - timedelta(days=40),
+                                          end_date=today - timedelta(days=ended), auto_renew=auto_renew)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            memberships.process_memberships(today, chunk_size=2)
+        self.assertEqual(UserMembership.objects.filter(status=UserMembership.EXPIRED).count(), 3)
+        renewed = UserMembership.objects.filter(status=UserMembership.ACTIVE, start_date=today)
+        self.assertEqual(sorted(renewed.values_list('user__username', flat=True)), ['student0', 'student2'])
+        self.assertEqual(Payment.objects.filter(payment_type='Membership', amount=10).count(), 2)
+        self.assertTrue(all(membership.payment_id for membership in renewed))
+        self.assertIsNone(memberships.current_membership(self.students[1]))
+        self.assertEqual(memberships.current_membership(self.students[3]).end_date, today + timedelta(days=5))
+
+    def test_current_membership_is_cached_until_it_changes(self):
+        student = self.students[0]
+        memberships.subscribe(student, self.gold, 'Card')
+        self.assertEqual(memberships.current_membership(User.objects.get(pk=student.pk)).membership, self.gold)
+        fresh = User.objects.get(pk=student.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(memberships.current_membership(fresh).membership, self.gold)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            memberships.subscribe(student, self.diamond, 'UPI')
+        self.assertEqual(UserMembership.objects.filter(user=student, status=UserMembership.ACTIVE).count(), 1)
+        # Not dropped before commit, where another request could cache the old one again
+        self.assertEqual(memberships.current_membership(User.objects.get(pk=student.pk)).membership, self.gold)
+        for callback in callbacks:
+            callback()
+        fresh = User.objects.get(pk=student.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(memberships.current_membership(fresh).membership, self.diamond)
+
+
+@modify_settings(MIDDLEWARE={'append': 'Library.middleware.QueryBudgetMiddleware'})
+class AnalyticsRollupTests(TransactionTestCase):
+    # Commits for real, so the on_commit cache version bumps run
+    def setUp(self):
+        self.librarian = User.objects.create_user('librarian', password='pw')
+        self.librarian.groups.add(Group.objects.create(name='Librarian'))
+        self.student = User.objects.create_user('student', password='pw')
+        create_catalog(self.librarian, books=3)
+        Book.objects.update(quantity=10)
+        self.books = list(Book.objects.order_by('id'))
+        self.gold = Membership.objects.create(name='GOLD', price_per_month=10, book_access_percentage=30)
+        caching.get_cache().clear()
+
+    def make_activity(self):
+        inventory.rent(self.student, self.books[0])
+        inventory.rent(self.student, self.books[0])
+        inventory.purchase(self.student, self.books[1], 'Somewhere')
+        memberships.subscribe(self.student, self.gold, 'UPI')
+        jobs.drain()
+
+    def test_rollups_are_maintained_on_write(self):
+        self.make_activity()
+        today = date.today()
+        report = rollups.report(today, today)
+        self.assertEqual(report['revenue'], [('Membership', 'UPI', 1, 10.0)])
+        self.assertEqual(report['top_rented'], [('Book 0', 2, 20.0)])
+        self.assertEqual(report['top_purchased'], [('Book 1', 1, 100.0)])
+        self.assertEqual(report['top_categories'], [('Category 0', 2, 20.0), ('Category 1', 1, 100.0)])
+        self.assertEqual(report['membership_mix'], [('GOLD', 1, 100.0)])
+        self.assertEqual(rollups.reconcile(today, today), 0)
+
+    def test_reconcile_repairs_drift(self):
+        self.make_activity()
+        today = date.today()
+        expected = set(DailyRollup.objects.values_list('dimension', 'day', 'key', 'count', 'amount'))
+        DailyRollup.objects.filter(dimension=DailyRollup.RENTALS).update(count=7)
+        DailyRollup.objects.filter(dimension=DailyRollup.MEMBERSHIP).delete()
+        DailyRollup.objects.create(dimension=DailyRollup.PURCHASES, day=today, key='999', count=1)
+        self.assertEqual(rollups.reconcile(today - timedelta(days=3), today, window=2), 3)
+        self.assertEqual(set(DailyRollup.objects.values_list('dimension', 'day', 'key', 'count', 'amount')), expected)
+
+    def test_dashboard_reads_only_rollups(self):
+        self.make_activity()
+        self.client.force_login(self.librarian)
+        with self.assertNumQueries(11):  # Session, user and roles, five rollup sums, three name lookups
+            response = self.client.get(reverse('analytics'), {'start': '2020-01-01'})
+        self.assertContains(response, 'Book 0')
+
+    def test_closed_ranges_are_cached_until_reconciled(self):
+        self.make_activity()
+        yesterday = date.today() - timedelta(days=1)
+        self.assertEqual(rollups.report(yesterday, yesterday)['top_rented'], [])
+        Rent.objects.update(start_date=yesterday)  # Bypasses the rollups
+        self.assertEqual(rollups.report(yesterday, yesterday)['top_rented'], [])
+        rollups.reconcile(yesterday, date.today())
+        self.assertEqual(rollups.report(yesterday, yesterday)['top_rented'], [('Book 0', 2, 20)])
+
+    def test_renaming_a_book_keeps_the_cached_totals(self):
+        self.make_activity()
+        yesterday = date.today() - timedelta(days=1)
+        Rent.objects.update(start_date=yesterday)
+        rollups.reconcile(yesterday, yesterday)
+        rollups.report(yesterday, yesterday)
+        self.books[0].title = 'Book Zero'
+        self.books[0].save()
+        with self.assertNumQueries(2):  # Titles and category names only, no rollup sums
+            report = rollups.report(yesterday, yesterday)
+        self.assertEqual(report['top_rented'], [('Book Zero', 2, 20)])
+
+
+class CachingTests(TransactionTestCase):
+    # Commits for real, so the on_commit version bumps run as in production
+    def setUp(self):
+        caching.get_cache().clear()
+        caching.reset_stats()
+        self.librarian = User.objects.create_user('librarian', password='pw')
+        self.librarian.groups.add(Group.objects.create(name='Librarian'))
+        create_catalog(self.librarian, books=5)
+
+    def test_anonymous_response_is_cached_until_model_changes(self):
+        url = reverse('manage_categories')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+        Category.objects.create(name='Poetry')
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, 'Poetry')
+        self.assertEqual(caching.stats()['manage_categories'], {'hit': 1, 'miss': 2})
+
+    def test_authenticated_pages_cache_fragments(self):
+        self.client.login(username='librarian', password='pw')
+        url = reverse('librarian_dashboard')
+        self.client.get(url)
+        with self.assertNumQueries(2):  # Session and user only, the catalogue comes from the cache
+            self.assertContains(self.client.get(url), 'Book 0')
+        book = Book.objects.get(title='Book 0')
+        book.title = 'Renamed'
+        book.save()
+        self.assertContains(self.client.get(url), 'Renamed')
+        self.assertEqual(caching.stats()['librarian_catalogue'], {'hit': 1, 'miss': 2})
+
+    def test_rentals_only_invalidate_what_shows_stock(self):
+        book = Book.objects.get(title='Book 0')
+        before = caching.versions(['book', 'stock'])
+        inventory.rent(self.librarian, book)
+        after = caching.versions(['book', 'stock'])
+        self.assertEqual(after.split('.')[0], before.split('.')[0])
+        self.assertNotEqual(after.split('.')[1], before.split('.')[1])
+
+
+class CatalogueAPITests(TransactionTestCase):
+    def setUp(self):
+        caching.get_cache().clear()
+        self.librarian = User.objects.create_user('librarian', password='pw')
+        create_catalog(self.librarian, books=5)
+
+    def test_pages_with_selected_fields(self):
+        url = reverse('api_list', args=['books'])
+        first = self.client.get(url, {'fields': 'title,author_name', 'limit': 3}).json()
+        self.assertEqual(first['results'][0], {'id': Book.objects.get(title='Book 0').pk, 'title': 'Book 0',
+                                               'author_name': 'Author 0'})
+        second = self.client.get(first['next']).json()
+        self.assertEqual([row['title'] for row in second['results']], ['Book 3', 'Book 4'])
+        self.assertIsNone(second['next'])
+        category = Category.objects.get(name='Category 1')
+        response = self.client.get(url, {'category': category.pk, 'fields': 'category_name'})
+        self.assertEqual({row['category_name'] for row in response.json()['results']}, {'Category 1'})
+
+    def test_unchanged_data_is_not_modified(self):
+        url = reverse('api_list', args=['categories'])
+        Category.objects.create(name='Poetry')  # Gives the table a change time
+        response = self.client.get(url)
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        self.assertEqual(self.client.get(url, {'fields': 'name'}, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        Category.objects.filter(name='Poetry').get().delete()
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotIn('Poetry', [row['name'] for row in changed.json()['results']])
+
+    def test_etags_change_when_the_cache_was_cleared_between_writes(self):
+        url = reverse('api_list', args=['authors'])
+        caching.get_cache().clear()
+        Author.objects.create(name='First Author')
+        response = self.client.get(url)
+        caching.get_cache().clear()  # A restart of a local memory cache, an eviction or a flush
+        Author.objects.create(name='New Author')
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertIn('New Author', [row['name'] for row in changed.json()['results']])
+
+    def test_errors(self):
+        book = Book.objects.get(title='Book 0')
+        self.assertEqual(self.client.get(reverse('api_detail', args=['books', book.pk]), {'fields': 'price'}).json(),
+                         {'id': book.pk, 'price': '100.00'})
+        self.assertEqual(self.client.get(reverse('api_detail', args=['books', 0])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('api_list', args=['payments'])).status_code, 404)
+        for params in ({'fields': 'title,password'}, {'after': '!!'}, {'limit': 1000}, {'author': 'x'}):
+            self.assertEqual(self.client.get(reverse('api_list', args=['books']), params).status_code, 400)
+        self.assertEqual(self.client.post(reverse('api_list', args=['books'])).status_code, 405)
+
+
+@override_settings(LIBRARY_SEARCH_BACKEND='memory', LIBRARY_SEARCH_BACKGROUND_BUILD=False)
+class BenchmarkSuiteTests(TestCase):
+    def test_every_scenario_runs_cleanly(self):
+        student_ids, _ = synthetic.generate(books=40, students=5, activity=3)
+        results = benchmarks.run(
+            User.objects.filter(groups__name='Librarian'), User.objects.filter(pk__in=student_ids),
+            requests=60, memory_samples=1,
+        )
+        self.assertLessEqual(set(results), {scenario.name for scenario in benchmarks.SCENARIOS})
+        self.assertIn('available_books', results)
+        for name, row in results.items():
+            self.assertEqual(row['errors'], 0, name)
+            self.assertLessEqual(row['p50_ms'], row['p95_ms'])
+            self.assertLessEqual(row['p95_ms'], row['p99_ms'])
+
+
+@modify_settings(MIDDLEWARE={'append': 'Library.middleware.InstrumentationMiddleware'})
+@override_settings(LIBRARY_SEARCH_BACKEND='memory', LIBRARY_SEARCH_BACKGROUND_BUILD=False)
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        METRICS.reset()
+        caching.get_cache().clear()
+
+    def test_metrics_endpoint_reports_per_view_numbers(self):
+        self.client.get(reverse('manage_categories'))
+        self.client.get(reverse('manage_categories'))
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('library_requests_total{view="manage_categories",method="GET",status="200"} 2', body)
+        self.assertIn('library_request_duration_seconds_count{view="manage_categories"} 2', body)
+        self.assertIn('library_cache_hits_total{view="manage_categories"} 1', body)
+        self.assertRegex(body, r'library_db_queries_total\{view="manage_categories"\} [1-9]')
+        self.assertRegex(body, r'library_template_seconds_total\{view="manage_categories"\} 0\.0*[1-9]')
+
+    def test_metrics_endpoint_is_local_only(self):
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.9')
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(LIBRARY_METRICS_TOKEN='s3cret')
+    def test_metrics_token_is_required_when_set(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)  # Even from 127.0.0.1
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.9', HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response.status_code, 200)
+
+    def test_sampled_requests_are_profiled(self):
+        with tempfile.TemporaryDirectory() as profile_dir:
+            with self.settings(LIBRARY_PROFILE_SAMPLE_RATE=1.0, LIBRARY_PROFILE_DIR=profile_dir):
+                self.client.get(reverse('landing_page'))
+            self.assertEqual(len(os.listdir(profile_dir)), 1)
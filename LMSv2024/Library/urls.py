@@ -1,5 +1,9 @@
+from django.conf import settings
 from django.urls import path
-from .import views
+from .import api, async_views, views
+
+# Student read/browse paths are served by async views unless disabled
+student_views = async_views if getattr(settings, 'LIBRARY_ASYNC_VIEWS', True) else views
 
 urlpatterns = [
     # Authentication URLs
@@ -10,11 +14,13 @@ urlpatterns = [
 
     # Dashboard URLs
     path("librarian/dashboard/", views.librarian_dashboard, name="librarian_dashboard"),
+    path("librarian/analytics/", views.analytics, name="analytics"),
 
 
     # Book Management URLs
     path('books/', views.manage_books, name='manage_books'),  # List and search books
     path('books/add/', views.add_book, name='add_book'),  # Add book
+    path('books/import/', views.import_books, name='import_books'),  # Bulk import books
     path('books/update/<int:book_id>/', views.update_book, name='update_book'),  # Update book
     path('books/delete/<int:book_id>/', views.delete_book, name='delete_book'),  # Delete book
 
@@ -31,15 +37,24 @@ urlpatterns = [
 
 
     # Membership URLs (if required)
-     path('student-dashboard/', views.student_dashboard, name='student_dashboard'),
+     path('student-dashboard/', student_views.student_dashboard, name='student_dashboard'),
     path('membership/take/<int:membership_id>/', views.take_membership, name='take_membership'),
     path("memberships/", views.manage_memberships, name="manage_memberships"),
-    path('available-books/', views.available_books, name='available_books'),
+    path('available-books/', student_views.available_books, name='available_books'),
     path('rent-book/<int:book_id>/', views.rent_book, name='rent_book'),
     path('purchase-book/<int:book_id>/', views.purchase_book, name='purchase_book'),
-    path('rent-list/', views.rent_list, name='rent_list'),
-    path('purchase-list/', views.purchase_list, name='purchase_list'),
+    path('rent-list/', student_views.rent_list, name='rent_list'),
+    path('purchase-list/', student_views.purchase_list, name='purchase_list'),
+    path('books/<int:book_id>/read/', student_views.read_book, name='read_book'),
+    path('books/<int:book_id>/content/', views.book_content, name='book_content'),
     #for displaying users list
     path("users/", views.user_list, name="user_list"),
+    path("export/<str:name>/", views.export_data, name="export_data"),
+    path("autocomplete/<str:kind>/", views.autocomplete_search, name="autocomplete"),  # Search box completions
+    path(f"api/{api.VERSION}/<str:resource>/", views.api_list, name="api_list"),  # Read-only JSON catalogue
+    path(f"api/{api.VERSION}/<str:resource>/<int:pk>/", views.api_detail, name="api_detail"),
+
+    # Prometheus metrics (local scrapers only)
+    path("metrics/", views.metrics, name="metrics"),
 
 ]
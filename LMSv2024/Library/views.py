@@ -1,27 +1,39 @@
+import hmac
+import io
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.models import User, Group
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.contrib import messages
-from django.db.models import Q
-from datetime import date, timedelta, timezone
-
-from .forms import UserRegistratioForm, BookForm, AuthorForm, CategoryForm, PaymentForm
-from .models import ISBN, Language, Membership, Author, Category, Book, IssuedBook, Rent, Purchase, Payment, UserMembership
+from django.utils.cache import patch_cache_control
+from django.utils.functional import SimpleLazyObject
+from django.views.decorators.http import condition, require_safe
+from datetime import date, timedelta
+
+from . import api, autocomplete, content, deletion, exports, inventory, payments, recommendations, rollups, search
+from .caching import cache_response
+from .access import split_books_by_access
+from .instrumentation import METRICS
+from .memberships import current_membership, subscribe
+from .middleware import query_budget
+from .pagination import paginate
+from .roles import is_librarian, is_student
+from .forms import UserRegistratioForm, BookForm, AuthorForm, CategoryForm, PaymentForm, CatalogImportForm, AnalyticsRangeForm, ExportForm
+from .importer import CatalogImporter, read_rows
+from .models import ISBN, Language, Membership, Author, Category, Book, IssuedBook, Rent, Purchase
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
-from .models import Membership, UserMembership, Payment, Book
+from .models import Membership, Book
 
 
+@cache_response()
 def landing_page(request):
     return render(request, "landing_page.html")
 
-# Utility function to check roles
-def is_librarian(user):
-    return user.groups.filter(name='Librarian').exists()
-
 
 
 ### ---------- User Registration and Authentication Views ---------- ###
@@ -91,8 +103,26 @@ def logout_user(request):
 @login_required
 @user_passes_test(is_librarian)
 def librarian_dashboard(request):
-    books = Book.objects.all()
-    return render(request, "librarian_dashboard.html", {"books": books})
+    # Only evaluated when the cached catalogue fragment misses
+    books = SimpleLazyObject(lambda: paginate(request, Book.objects.for_catalog(), ('title', 'id')))
+    return render(request, "librarian_dashboard.html", {"books": books, "page": books})
+
+
+@query_budget(11)
+@login_required
+@user_passes_test(is_librarian)
+def analytics(request):
+    """
+    Revenue, rentals, categories and membership mix for a date range (default:
+    the last 30 days), read from the daily rollups only.
+    """
+    form = AnalyticsRangeForm(request.GET or None)
+    end = date.today()
+    start = end - timedelta(days=29)
+    if form.is_valid():
+        end = form.cleaned_data['end'] or end
+        start = form.cleaned_data['start'] or end - timedelta(days=29)
+    return render(request, "librarian_analytics.html", {"form": form, "report": rollups.report(start, end)})
 
 
 
@@ -115,63 +145,20 @@ def manage_memberships(request):
 
 
 
-# Books Management
-def manage_books(request):
-    query = request.GET.get('q', '')
-    print(f"Search Query: {query}")  # Debugging line
-
-    books = Book.objects.all()
-
-    # Apply search filter if a query is provided
-    if query:
-        books = books.filter(Q(title__icontains=query) | Q(author__name__icontains=query))
-
-    # Initialize an empty form for rendering purposes
-    form = BookForm()
-
-    if request.method == 'POST':
-        if 'add' in request.POST:
-            form = BookForm(request.POST, request.FILES)  # Bind form data for adding a book
-            if form.is_valid():
-                form.save()
-                messages.success(request, 'Book added successfully!')
-                return redirect('manage_books')
-            else:
-                messages.error(request, 'Error adding the book. Please check the form.')
-        elif 'update' in request.POST:
-            book_id = request.POST.get('book_id')
-            if not book_id:
-                messages.error(request, 'Book ID is required to update a book.')
-                return redirect('manage_books')
-
-            book = get_object_or_404(Book, id=book_id)
-            form = BookForm(request.POST, request.FILES, instance=book)  # Bind form data for updating the book
-            if form.is_valid():
-                form.save()
-                messages.success(request, 'Book updated successfully!')
-                return redirect('manage_books')
-            else:
-                messages.error(request, 'Error updating the book. Please check the form.')
-
-    return render(request, 'book_operations/manage_books.html', {'books': books, 'query': query, 'form': form})
-
-
-
-def delete_book(request, book_id):
-    book = get_object_or_404(Book, id=book_id)
-    book.delete()
-    messages.success(request, 'Book deleted successfully!')
-    return redirect('manage_books')
-
-
-
 # Manage Authors - List and Search
+@query_budget(4)
+@cache_response('author')
 def manage_authors(request):
     query = request.GET.get('q', '')
-    authors = Author.objects.all()
-    if query:
-        authors = authors.filter(name__icontains=query)
-    return render(request, 'book_operations/manage_authors.html', {'authors': authors, 'query': query})
+    sort = request.GET.get('sort', '')
+    authors = search.filter_queryset(Author.objects.all(), 'author', query)
+    if sort == 'books':  # Most books first, from the book_count counters
+        ordering = ('-book_count', 'id')
+    else:
+        ordering = ('search_rank', 'id') if query else ('name', 'id')
+    authors = paginate(request, authors, ordering)
+    return render(request, 'book_operations/manage_authors.html',
+                  {'authors': authors, 'page': authors, 'query': query, 'sort': sort})
 
 # Add Author
 def add_author(request):
@@ -201,20 +188,24 @@ def edit_author(request, author_id):
 # Delete Author
 def delete_author(request, author_id):
     author = get_object_or_404(Author, id=author_id)
-    author.delete()
+    deletion.soft_delete(author)  # Hidden now, its books and their history are purged in the background
     messages.success(request, 'Author deleted successfully!')
     return redirect('manage_authors')
 
 
 
 # List and Search Categories
+@query_budget(4)
+@cache_response('category')
 def manage_categories(request):
     query = request.GET.get('q', '')  # Search query
-    categories = Category.objects.all()
-    if query:
-        categories = categories.filter(name__icontains=query)
+    sort = request.GET.get('sort', '')
+    categories = search.filter_queryset(Category.objects.all(), 'category', query)
+    if sort == 'books':  # Most books first, from the book_count counters
+        categories = categories.order_by('-book_count', 'name')
 
-    return render(request, 'book_operations/manage_categories.html', {'categories': categories, 'query': query})
+    return render(request, 'book_operations/manage_categories.html',
+                  {'categories': categories, 'query': query, 'sort': sort})
 
 
 # Add Category
@@ -247,27 +238,26 @@ def update_category(request, category_id):
 # Delete Category
 def delete_category(request, category_id):
     category = get_object_or_404(Category, id=category_id)
-    category.delete()
+    deletion.soft_delete(category)
     messages.success(request, 'Category deleted successfully!')
     return redirect('manage_categories')
 
 
 
-# Check if user is a librarian
-def is_librarian(user):
-    return user.groups.filter(name='Librarian').exists()
-
 # Manage Books - List and Search
+@query_budget(5)
 @login_required
 @user_passes_test(is_librarian)
 def manage_books(request):
     query = request.GET.get('q', '')  # Search query
-    books = Book.objects.all().order_by('category__name', 'title')  # List books category-wise
-
+    books = search.filter_queryset(Book.objects.for_catalog(), 'book', query)
     if query:
-        books = books.filter(title__icontains=query)
+        ordering = ('search_rank', 'id')  # Best matches first
+    else:
+        ordering = ('category__name', 'title', 'id')  # List books category-wise
+    books = paginate(request, books, ordering)
 
-    return render(request, 'book_operations/manage_books.html', {'books': books, 'query': query})
+    return render(request, 'book_operations/manage_books.html', {'books': books, 'page': books, 'query': query})
 
 # Add Book
 @login_required
@@ -285,6 +275,27 @@ def add_book(request):
         form = BookForm()
     return render(request, 'book_operations/add_book.html', {'form': form})
 
+# Bulk Import Books
+@login_required
+@user_passes_test(is_librarian)
+def import_books(request):
+    report = None
+    if request.method == "POST":
+        form = CatalogImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            feed = form.cleaned_data['feed']
+            # Large uploads are spooled to a temporary file; read it as a text stream
+            stream = io.TextIOWrapper(feed.file, encoding='utf-8', newline='')
+            report = CatalogImporter(request.user).run(read_rows(stream, form.cleaned_data['file_format']))
+            if report.file_error:
+                messages.error(request, f"{report.file_error}. Imported {report.created} books from the "
+                                        f"{report.rows} rows before it.")
+            else:
+                messages.success(request, f"Imported {report.created} books from {report.rows} rows.")
+    else:
+        form = CatalogImportForm()
+    return render(request, 'book_operations/import_books.html', {'form': form, 'report': report})
+
 # Update Book
 @login_required
 @user_passes_test(is_librarian)
@@ -306,7 +317,7 @@ def update_book(request, book_id):
 def delete_book(request, book_id):
     book = get_object_or_404(Book, id=book_id)
     if request.method == "POST":
-        book.delete()
+        deletion.soft_delete(book)
         messages.success(request, "Book deleted successfully!")
         return redirect('manage_books')
     return render(request, 'book_operations/delete_book.html', {'book': book})
@@ -315,10 +326,7 @@ def delete_book(request, book_id):
 
 
 
-# Helper function to check if the user is a student
-def is_student(user):
-    return user.groups.filter(name='Student').exists()
-
+@query_budget(6)  # Cold caches: session, user, roles, membership, a page of books, recommendations
 @login_required
 @user_passes_test(is_student)
 def student_dashboard(request):
@@ -326,21 +334,20 @@ def student_dashboard(request):
     Student dashboard showing books, membership plans, and purchased membership details.
     """
     user = request.user
-    user_membership = UserMembership.objects.filter(user=user).first()  # Fetch user's active membership
+    user_membership = current_membership(user)
     memberships = Membership.objects.all()  # All available membership plans
-    books = Book.objects.all()  # All books in the system
 
     # Restrict book access based on membership plan
-    if user_membership:
-        access_percentage = user_membership.membership.book_access_percentage  # Fetch access limit percentage
-        total_books = books.count()
-        access_limit = int(total_books * (access_percentage / 100))  # Calculate the number of books user can access
-        books = books[:access_limit]  # Restrict books to the calculated limit
+    books, _ = split_books_by_access(Book.objects.for_browsing(), user_membership)
+    recommended_books = recommendations.for_user(user, books)
+    books = paginate(request, books, ('id',))
 
     context = {
         'user_membership': user_membership,
         'memberships': memberships,
         'books': books,
+        'page': books,
+        'recommended_books': recommended_books,
     }
     return render(request, 'student_dashboard.html', context)
 
@@ -359,36 +366,26 @@ def take_membership(request, membership_id):
             messages.error(request, "Invalid payment method selected.")
             return redirect('take_membership', membership_id=membership_id)
 
-        # Record payment
-        payment = Payment.objects.create(
-            user=request.user,
-            amount=membership.price_per_month,
-            payment_type='Membership',
-            payment_method=payment_method,
-        )
-
-        # Update or create UserMembership
-        start_date = date.today()
-        end_date = start_date + timedelta(days=30)
-        UserMembership.objects.update_or_create(
-            user=request.user,
-            defaults={
-                'membership': membership,
-                'start_date': start_date,
-                'end_date': end_date,
-                'payment': payment,
-            }
-        )
+        try:
+            subscribe(
+                request.user, membership, payment_method,
+                auto_renew=request.POST.get('auto_renew') == 'on',
+                idempotency_key=request.POST.get('idempotency_key'),
+            )
+        except payments.IdempotencyConflict:
+            messages.error(request, "This link has expired, please try again.")
+            return redirect('take_membership', membership_id=membership_id)
 
         messages.success(request, "Membership purchased successfully!")
         return redirect('student_dashboard')
 
-    return render(request, 'take_membership.html', {'membership': membership})
+    context = {'membership': membership, 'idempotency_key': payments.new_idempotency_key()}
+    return render(request, 'take_membership.html', context)
 
 
 # Librarian-only view to manage memberships
 @login_required
-@user_passes_test(lambda user: user.groups.filter(name='Librarian').exists())
+@user_passes_test(is_librarian)
 def manage_memberships(request):
     memberships = Membership.objects.all()
 
@@ -404,26 +401,24 @@ def manage_memberships(request):
 
 
 
+@query_budget(4)
 @login_required
 def available_books(request):
     """
     View to display available books based on user's membership plan.
     """
     user = request.user
-    membership = user.usermembership_set.first()
-
-    if membership:
-        percentage = membership.membership.book_access_percentage
-        accessible_books_count = Book.objects.count() * percentage // 100
-        accessible_books = Book.objects.all()[:accessible_books_count]
-        rent_books = Book.objects.all()[accessible_books_count:]
-    else:
-        accessible_books = []
-        rent_books = Book.objects.all()
+    membership = current_membership(user)
+    accessible_books, rent_books = split_books_by_access(Book.objects.for_browsing(), membership)
+    recommended_books = recommendations.for_user(user, rent_books)
+    rent_books = paginate(request, rent_books, ('id',))
 
     context = {
         'accessible_books': accessible_books,
         'rent_books': rent_books,
+        'page': rent_books,
+        'recommended_books': recommended_books,
+        'rent_key': payments.new_idempotency_key(),
     }
     return render(request, 'student/available_books.html', context)
 
@@ -434,14 +429,17 @@ def rent_book(request, book_id):
     View to rent a book for non-accessible books based on membership.
     """
     book = get_object_or_404(Book, id=book_id)
-    rent_fee = book.price * 0.1  # 10% of the book price
-
-    Rent.objects.create(
-        user=request.user,
-        book=book,
-        rent_start_date=date.today(),
-        rent_fee=rent_fee,
-    )
+    try:
+        _, created = payments.pay_rent(request.user, book, idempotency_key=request.GET.get('key'))
+    except inventory.OutOfStock:
+        messages.error(request, f'"{book.title}" is out of stock.')
+    except payments.IdempotencyConflict:
+        messages.error(request, "This link has expired, please try again.")
+    else:
+        if created:
+            messages.success(request, f'You rented "{book.title}".')
+        else:
+            messages.info(request, f'You already rented "{book.title}".')
     return redirect('available_books')
 
 
@@ -453,40 +451,149 @@ def purchase_book(request, book_id):
     book = get_object_or_404(Book, id=book_id)
 
     if request.method == 'POST':
-        Purchase.objects.create(
-            user=request.user,
-            book=book,
-            purchase_date=date.today(),
-            delivery_address=request.POST.get('delivery_address'),
-        )
+        try:
+            payments.pay_purchase(
+                request.user, book, request.POST.get('address', ''),
+                idempotency_key=request.POST.get('idempotency_key'),
+            )
+        except inventory.OutOfStock:
+            messages.error(request, f'"{book.title}" is out of stock.')
+            return redirect('available_books')
+        except payments.IdempotencyConflict:
+            messages.error(request, "This link has expired, please try again.")
+            return redirect('purchase_book', book_id=book_id)
         return redirect('student_dashboard')
 
     context = {
         'book': book,
+        'idempotency_key': payments.new_idempotency_key(),
     }
     return render(request, 'student/purchase_book.html', context)
 
 
+@query_budget(4)
 @login_required
 def rent_list(request):
     """
     View to display the list of rented books by the user.
     """
-    rents = Rent.objects.filter(user=request.user)
-    context = {'rents': rents}
+    rents = paginate(request, Rent.objects.for_user(request.user), ('-start_date', '-id'))
+    context = {'rented_books': rents, 'page': rents}
     return render(request, 'student/rent_list.html', context)
 
 
+@query_budget(4)
 @login_required
 def purchase_list(request):
     """
     View to display the list of purchased books by the user.
     """
-    purchases = Purchase.objects.filter(user=request.user)
-    context = {'purchases': purchases}
+    purchases = paginate(request, Purchase.objects.for_user(request.user), ('-purchase_date', '-id'))
+    context = {'purchased_books': purchases, 'page': purchases}
     return render(request, 'student/purchased_books.html', context)
 
 
+def can_read_book(user, book):
+    """
+    Librarians can read everything; students can read books their membership
+    gives access to, and books they rented or purchased.
+    """
+    if is_librarian(user):
+        return True
+    membership = current_membership(user)
+    accessible_books, _ = split_books_by_access(Book.objects.all(), membership)
+    return (
+        accessible_books.filter(pk=book.pk).exists()
+        or Rent.objects.filter(user=user, book=book).exists()
+        or Purchase.objects.filter(user=user, book=book).exists()
+    )
+
+
+@login_required
+def read_book(request, book_id):
+    """
+    Reader view showing one page (content chunk) of the book at a time.
+    """
+    book = get_object_or_404(Book.objects.select_related('isbn'), id=book_id)
+    if not can_read_book(request.user, book):
+        messages.error(request, "Rent or purchase this book to read it.")
+        return redirect('available_books')
+
+    total_pages = book.isbn.content_chunk_count if book.isbn else 0
+    try:
+        page_number = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page_number = 1
+    page_text = content.read_page(book.isbn, page_number) if total_pages else None
+
+    context = {
+        'book': book,
+        'page_text': page_text,
+        'page_number': page_number,
+        'total_pages': total_pages,
+        'previous_page': page_number - 1 if page_number > 1 else None,
+        'next_page': page_number + 1 if page_number < total_pages else None,
+    }
+    return render(request, 'student/read_book.html', context)
+
+
+def parse_byte_range(header, length):
+    """
+    Parse a single-range ``Range: bytes=...`` header.
+
+    Returns ``(start, end)`` inclusive, None when the header is absent or not
+    a single byte range (the full body is served), or raises ValueError when
+    the range cannot be satisfied.
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, _, last = header[len('bytes='):].strip().partition('-')
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else length - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(length - int(last), 0)
+            end = length - 1
+    except ValueError:
+        return None
+    if start >= length or start > end:
+        raise ValueError(header)
+    return start, min(end, length - 1)
+
+
+@login_required
+def book_content(request, book_id):
+    """
+    Stream the book text as UTF-8, honouring HTTP Range requests.
+    """
+    book = get_object_or_404(Book.objects.select_related('isbn'), id=book_id)
+    if not book.isbn or not can_read_book(request.user, book):
+        return HttpResponse(status=404)
+
+    length = book.isbn.content_length
+    try:
+        byte_range = parse_byte_range(request.headers.get('Range'), length)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{length}'
+        return response
+
+    if byte_range is None:
+        start, end, status = 0, length - 1, 200
+    else:
+        (start, end), status = byte_range, 206
+    response = StreamingHttpResponse(
+        content.iter_bytes(book.isbn, start, end), status=status, content_type='text/plain; charset=utf-8'
+    )
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Length'] = str(max(end - start + 1, 0))
+    if status == 206:
+        response['Content-Range'] = f'bytes {start}-{end}/{length}'
+    return response
+
+
 
 def create_payment(user: User, amount: float, payment_type: str):
     """
@@ -500,28 +607,122 @@ def create_payment(user: User, amount: float, payment_type: str):
     Returns:
         Payment: The created Payment object.
     """
-    if payment_type not in ['Membership', 'Purchase', 'Rent']:
-        raise ValueError("Invalid payment type. Valid types are 'Membership', 'Purchase', 'Rent'.")
-
-    # Create the payment object
-    payment = Payment.objects.create(
-        user=user,
-        amount=amount,
-        payment_date=timezone.now(),  # Automatically set the payment date
-        payment_type=payment_type
-    )
-
-    # Return the created Payment object
+    payment, _ = payments.charge(user, amount, payment_type)
     return payment
 
 
 #users list
+@query_budget(4)
 def user_list(request):
     query = request.GET.get('q')
     students_group = Group.objects.get(name='Student')
     students = User.objects.filter(groups=students_group)
+    students = search.filter_queryset(students, 'student', query)
+    students = paginate(request, students, ('search_rank', 'id') if query else ('username', 'id'))
+
+    return render(request, 'user_list.html', {'users': students, 'page': students, 'query': query})
 
-    if query:
-        students = students.filter(username__icontains=query) | students.filter(email__icontains=query) | students.filter(first_name__icontains=query)
 
-    return render(request, 'user_list.html', {'users': students, 'query': query})
+### ---------- Autocomplete ---------- ###
+
+# Completions for the search boxes, answered from memory (see autocomplete.py)
+@query_budget(3)
+@login_required
+def autocomplete_search(request, kind):
+    if kind not in autocomplete.SOURCES:
+        raise Http404("No such completion.")
+    if kind == 'user' and not is_librarian(request.user):
+        return HttpResponseForbidden()
+    try:
+        limit = min(int(request.GET.get('limit', autocomplete.LIMIT)), 50)
+    except ValueError:
+        limit = autocomplete.LIMIT
+    completions = autocomplete.complete(kind, request.GET.get('q', ''), limit)
+    return JsonResponse({'results': [{'id': pk, 'label': label} for pk, label in completions]})
+
+
+### ---------- JSON API ---------- ###
+
+# Read-only catalogue API; unchanged data is answered with 304 before any query (see api.py)
+def _api_response(payload, status=200):
+    response = JsonResponse(payload, status=status)
+    patch_cache_control(response, no_cache=True)  # Shared caches revalidate with the ETag
+    return response
+
+
+@query_budget(3)
+@require_safe
+@condition(etag_func=api.etag, last_modified_func=api.last_modified)
+def api_list(request, resource):
+    resource = api.RESOURCES.get(resource)
+    if resource is None:
+        return _api_response({'error': "No such resource."}, status=404)
+    try:
+        payload = api.list_payload(resource, request.GET)
+    except api.InvalidQuery as error:
+        return _api_response({'error': str(error)}, status=400)
+    if payload['next']:
+        params = request.GET.copy()
+        params['after'] = payload['next']
+        payload['next'] = request.build_absolute_uri(f'?{params.urlencode()}')
+    return _api_response(payload)
+
+
+@query_budget(3)
+@require_safe
+@condition(etag_func=api.etag, last_modified_func=api.last_modified)
+def api_detail(request, resource, pk):
+    resource = api.RESOURCES.get(resource)
+    if resource is None:
+        return _api_response({'error': "No such resource."}, status=404)
+    try:
+        payload = api.detail_payload(resource, request.GET, pk)
+    except api.InvalidQuery as error:
+        return _api_response({'error': str(error)}, status=400)
+    if payload is None:
+        return _api_response({'error': "Not found."}, status=404)
+    return _api_response(payload)
+
+
+### ---------- Exports ---------- ###
+
+# Streams books, payments, rents, purchases or students as CSV/JSON (see exports.py)
+@login_required
+@user_passes_test(is_librarian)
+def export_data(request, name):
+    export = exports.EXPORTS.get(name)
+    if export is None:
+        raise Http404("No such export.")
+    form = ExportForm(request.GET)
+    if not form.is_valid():
+        return HttpResponse(form.errors.as_text(), status=400, content_type='text/plain; charset=utf-8')
+
+    file_format = form.cleaned_data['format'] or 'csv'
+    compress = form.cleaned_data['gzip']
+    try:
+        pieces = exports.stream(export, file_format, compress, **form.filters())
+    except exports.TooManyMatches as error:
+        return HttpResponse(str(error), status=400, content_type='text/plain; charset=utf-8')
+    response = StreamingHttpResponse(
+        pieces,
+        content_type='application/gzip' if compress else exports.CONTENT_TYPES[file_format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{exports.filename(export, file_format, compress)}"'
+    return response
+
+
+### ---------- Instrumentation ---------- ###
+
+# Prometheus scrape endpoint, filled by InstrumentationMiddleware. With
+# LIBRARY_METRICS_TOKEN set, scrapers must send "Authorization: Bearer <token>";
+# set it whenever the site runs behind a reverse proxy. Without it, only
+# LIBRARY_METRICS_ALLOWED_IPS may scrape, which assumes REMOTE_ADDR is the real
+# client: behind a proxy every request comes from the proxy's address.
+def metrics(request):
+    token = getattr(settings, 'LIBRARY_METRICS_TOKEN', None)
+    if token:
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return HttpResponseForbidden()
+    elif request.META.get('REMOTE_ADDR') not in getattr(settings, 'LIBRARY_METRICS_ALLOWED_IPS', ('127.0.0.1', '::1')):
+        return HttpResponseForbidden()
+    return HttpResponse(METRICS.render(), content_type='text/plain; version=0.0.4; charset=utf-8')